@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+Atlas mode: batch-render per-species and per-territory variants of the geo map.
+
+The shaded-relief basemap is built (or loaded from the raster cache) once in
+the parent process and shared read-only with a process pool as a memory-
+mapped .npy file, so no worker rebuilds the DEM or the shading. Each worker
+draws the full map once when it starts and keeps the Agg buffer of its
+static layers (see layers.py). For every variant it is given, it only adds
+that variant's overlays (occurrence points or a highlighted territory, and
+the title), blits them and the labels over the cached buffer, encodes the
+image and removes the overlays again.
+
+Species variants need an observation export (see occurrences.py); their
+points are gathered in a single streaming pass over it. Territory variants
+come from territories.geojson.
+"""
+
+import argparse
+import os
+import re
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import matplotlib
+import numpy as np
+from matplotlib.patches import Polygon
+from PIL import Image
+
+import occurrences
+from create_territory_map_geo import (MAP_EXTENT, add_basemap_arguments, draw_map,
+                                      load_basemap, topography_caption)
+from export import (DEFAULT_OUTPUT_DIR, RASTER_FORMATS, add_export_arguments,
+                    encode_image, export_figure, output_path, tight_bbox)
+from layers import LayeredFigure, crop_pixels, label_artists
+from territories import load_registry
+
+VARIANT_KINDS = ('territory', 'species')
+
+POINT_STYLE = dict(s=14, c='#FFD700', edgecolors='black', linewidths=0.4, zorder=6)
+HIGHLIGHT_STYLE = dict(closed=True, fill=False, edgecolor='#FFD700', linewidth=4, zorder=5)
+
+# Per-process state set up by _init_worker
+_worker = {}
+
+
+def slugify(text):
+    return re.sub(r'[^a-z0-9]+', '_', text.lower()).strip('_')
+
+
+def territory_variants(registry):
+    variants = []
+    for t in registry.territories:
+        label = t['label'].replace('\n', ' ')
+        variants.append(dict(kind='territory', key=t['key'], name=f"territory/{t['key']}",
+                             title=f"{label}\nSaline Valley Region"))
+    return variants
+
+
+def species_points(path, checklist, extent, quality=occurrences.DEFAULT_QUALITY,
+                   delimiter=None):
+    """
+    (lat, lon) arrays of checklist observations inside extent, per species
+    index, from one streaming pass over an export. Captive observations and
+    grades outside quality are left out.
+    """
+    lon_min, lon_max, lat_min, lat_max = extent
+    grades = [occurrences.QUALITY_GRADES.index(q) for q in quality]
+    found = {}
+    for species, lat, lon, grade, _, _ in occurrences.read_chunks(
+            path, occurrences.taxon_lookup(checklist['species']), delimiter=delimiter):
+        keep = ((lon >= lon_min) & (lon <= lon_max) & (lat >= lat_min) & (lat <= lat_max)
+                & np.isin(grade, grades))
+        for i in np.unique(species[keep]):
+            sel = keep & (species == i)
+            found.setdefault(int(i), []).append(np.column_stack([lat[sel], lon[sel]]))
+    return {i: np.concatenate(parts) for i, parts in found.items()}
+
+
+def species_variants(checklist, points):
+    variants = []
+    for i, entry in enumerate(checklist['species']):
+        if 'outdated_name_of' in entry:
+            continue
+        pts = points.get(i, np.empty((0, 2)))
+        variants.append(dict(kind='species', name=f"species/{slugify(entry['name'])}",
+                             points=pts,
+                             title=f"{entry['name']} ({entry['common']})\n"
+                                   f"{len(pts)} observations"))
+    return variants
+
+
+def _init_worker(shaded_path, topography, out_dir, formats, dpis):
+    matplotlib.use('Agg')
+    registry = load_registry()
+    shaded = np.load(shaded_path, mmap_mode='r')
+    fig, ax = draw_map(shaded, registry, topography)
+    bboxes = {dpi: tight_bbox(fig, dpi) for dpi in dpis}
+    _worker.update(fig=fig, ax=ax, registry=registry, out_dir=out_dir,
+                   formats=formats, dpis=dpis, bboxes=bboxes,
+                   layered=LayeredFigure(fig, label_artists(ax)))
+
+
+def _write_variant(name, out_dir):
+    layered, formats, dpis = _worker['layered'], _worker['formats'], _worker['dpis']
+    os.makedirs(out_dir, exist_ok=True)
+    paths = []
+    for dpi in dpis:
+        raster = [fmt for fmt in formats if fmt in RASTER_FORMATS]
+        if raster:
+            rgba = layered.frame(dpi)
+            top, bottom, left, right = crop_pixels(_worker['bboxes'][dpi], dpi, rgba.shape[0])
+            image = Image.fromarray(rgba[top:bottom, left:right].copy(), 'RGBA')
+            paths += [encode_image(image, output_path(out_dir, name, fmt, dpi, dpis[0]),
+                                   fmt, dpi)
+                      for fmt in raster]
+    vector = [fmt for fmt in formats if fmt not in RASTER_FORMATS]
+    if vector:
+        with layered.drawn_in_full() as fig:
+            paths += export_figure(fig, name, out_dir, vector, dpis[:1], workers=0)
+    return paths
+
+
+def render_variant(variant):
+    """Worker: add the variant's overlays to the shared map, render, then remove them."""
+    ax, layered = _worker['ax'], _worker['layered']
+    if variant['kind'] == 'territory':
+        territory = _worker['registry'][variant['key']]
+        overlay = ax.add_patch(Polygon(territory['coords'], **HIGHLIGHT_STYLE))
+    else:
+        pts = variant['points']
+        overlay = ax.scatter(pts[:, 1], pts[:, 0], **POINT_STYLE)
+    layered.add_dynamic(overlay)
+    title = ax.title.get_text()
+    ax.title.set_text(variant['title'])
+    out_dir = os.path.join(_worker['out_dir'], os.path.dirname(variant['name']))
+    try:
+        return _write_variant(os.path.basename(variant['name']), out_dir)
+    finally:
+        layered.remove_dynamic(overlay)
+        ax.title.set_text(title)
+
+
+def render_atlas(shaded, variants, topography, out_dir, formats=('png',), dpis=(150,),
+                 jobs=None):
+    """
+    Render every variant over the shaded basemap in a process pool.
+
+    shaded is shared with the workers as a memmapped .npy file (the raster
+    cache entry itself when it is one). Returns (paths, seconds).
+    """
+    start = time.perf_counter()
+    with tempfile.TemporaryDirectory() as tmp:
+        if isinstance(shaded, np.memmap):
+            shaded_path = shaded.filename
+        else:
+            shaded_path = os.path.join(tmp, 'shaded.npy')
+            np.save(shaded_path, shaded)
+        jobs = min(jobs or os.cpu_count(), len(variants)) or 1
+        with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker,
+                                 initargs=(shaded_path, topography, out_dir,
+                                           list(formats), list(dpis))) as pool:
+            paths = [p for result in pool.map(render_variant, variants) for p in result]
+    return paths, time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--kinds', nargs='+', default=list(VARIANT_KINDS),
+                        choices=VARIANT_KINDS)
+    parser.add_argument('--occurrences', metavar='EXPORT',
+                        help='observation export for the species variants')
+    parser.add_argument('--quality', nargs='+', default=list(occurrences.DEFAULT_QUALITY),
+                        choices=occurrences.QUALITY_GRADES)
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='worker processes (default: all cores)')
+    add_basemap_arguments(parser)
+    add_export_arguments(parser)
+    parser.set_defaults(output_dir=os.path.join(DEFAULT_OUTPUT_DIR, 'atlas'),
+                        formats=['png'], dpi=[150])
+    args = parser.parse_args()
+
+    variants = []
+    if 'territory' in args.kinds:
+        variants += territory_variants(load_registry())
+    if 'species' in args.kinds:
+        if not args.occurrences:
+            parser.error('species variants need --occurrences')
+        checklist = occurrences.load_checklist()
+        variants += species_variants(checklist, species_points(
+            args.occurrences, checklist, MAP_EXTENT, args.quality))
+
+    start = time.perf_counter()
+    shaded = load_basemap(MAP_EXTENT, args)['shaded']
+    basemap_seconds = time.perf_counter() - start
+    paths, seconds = render_atlas(shaded, variants, topography_caption(args),
+                                  args.output_dir, args.formats, args.dpi, args.jobs)
+    print(f"Basemap ready in {basemap_seconds:.1f} s")
+    print(f"Rendered {len(variants)} maps ({len(paths)} files) to {args.output_dir} "
+          f"in {seconds:.1f} s: {len(variants) / seconds:.2f} maps/s")
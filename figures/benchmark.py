@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite for the map pipelines, with a regression baseline.
+
+Cases cover the hot paths of both map scripts: synthetic DEM construction
+at 360x400, 2k x 2k and 8k x 8k (8k in low-memory mode, as poster renders
+use it), the gaussian smoothing, hillshade and the shaded-relief blend
+(shade_rgb), drawing both maps (the geo map also in UTM, over the
+reprojected basemap), re-drawing the polygon and label layers, and PNG/PDF
+export at 150, 300 and 600 dpi.
+
+Each case runs in a fresh subprocess, so its peak RSS is its own. The case
+is set up once and then timed over several runs; the best run counts.
+Results are compared with benchmark_baseline.json. The run fails if a case
+got slower or used more memory than its baseline by more than the
+thresholds. --update records a new baseline. A baseline only makes sense
+on the machine it was recorded on; the machine details are stored with it
+and a mismatch is reported. BENCHMARK_VERSION changes whenever cases
+change, and baselines from another version are not compared.
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+from profiling import max_rss_bytes
+
+FIGURES_DIR = os.path.dirname(os.path.abspath(__file__))
+BASELINE_PATH = os.path.join(FIGURES_DIR, 'benchmark_baseline.json')
+
+# Bump when a case changes what it measures
+BENCHMARK_VERSION = 1
+
+# Allowed slowdown and memory growth over the baseline (fractions), and a
+# floor below which time differences are treated as noise
+TIME_THRESHOLD = 0.3
+MEMORY_THRESHOLD = 0.15
+MIN_SECONDS_DELTA = 0.005
+
+DEFAULT_REPEAT = 5
+
+DEM_SIZES = {'360x400': (360, 400), '2k': (2000, 2000), '8k': (8000, 8000)}
+EXPORT_DPIS = (150, 300, 600)
+
+# Cases too slow or memory-hungry for --quick
+SLOW_CASES = ('dem.8k', 'export.png.600dpi', 'export.pdf.600dpi')
+
+
+def _terrain(nx, ny, low_memory=False):
+    import dem
+    return dem.build_terrain(nx=nx, ny=ny, low_memory=low_memory)
+
+
+def _geo_light():
+    import create_territory_map_geo as geo
+    return dict(azdeg=geo.LIGHT_AZDEG, altdeg=geo.LIGHT_ALTDEG, vert_exag=geo.VERT_EXAG)
+
+
+def _shaded(nx=360, ny=400):
+    import create_territory_map_geo as geo
+    from shading import shaded_relief
+    _, shaded = shaded_relief(_terrain(nx, ny), geo.TERRAIN_CMAP, geo.ELEV_MIN,
+                              geo.ELEV_MAX, blend_mode=geo.BLEND_MODE, **_geo_light())
+    return shaded
+
+
+def _geo_figure():
+    import create_territory_map_geo as geo
+    from territories import load_registry
+    return geo.draw_map(_shaded(), load_registry(), 'benchmark')
+
+
+def case_dem(size):
+    nx, ny = DEM_SIZES[size]
+    return lambda: _terrain(nx, ny, low_memory=(size == '8k'))
+
+
+def case_smooth():
+    import dem
+    from scipy import ndimage
+    elevation = dem.build_dem(nx=2000, ny=2000)
+    return lambda: ndimage.gaussian_filter(elevation, sigma=dem.SMOOTH_SIGMA, output=elevation)
+
+
+def case_hillshade():
+    from shading import hillshade
+    elevation = _terrain(2000, 2000)
+    return lambda: hillshade(elevation, **_geo_light())
+
+
+def case_shade_rgb():
+    import create_territory_map_geo as geo
+    from shading import hillshade, shaded_relief
+    elevation = _terrain(2000, 2000)
+    intensity = hillshade(elevation, **_geo_light())
+    return lambda: shaded_relief(elevation, geo.TERRAIN_CMAP, geo.ELEV_MIN, geo.ELEV_MAX,
+                                 blend_mode=geo.BLEND_MODE, intensity=intensity,
+                                 **_geo_light())
+
+
+def case_draw_geo():
+    import matplotlib.pyplot as plt
+    import create_territory_map_geo as geo
+    from territories import load_registry
+    shaded, registry = _shaded(), load_registry()
+
+    def run():
+        fig, _ = geo.draw_map(shaded, registry, 'benchmark')
+        fig.canvas.draw()
+        plt.close(fig)
+    return run
+
+
+def case_draw_geo_projected():
+    import argparse
+    import matplotlib.pyplot as plt
+    import create_territory_map_geo as geo
+    from projection import get_projection
+    from territories import load_registry
+    args = geo.add_basemap_arguments(argparse.ArgumentParser()).parse_args(['--no-cache'])
+    projection = get_projection('utm', geo.MAP_EXTENT)
+    shaded = geo.load_basemap(geo.MAP_EXTENT, args, projection)['shaded']
+    registry = load_registry()
+
+    def run():
+        fig, _ = geo.draw_map(shaded, registry, 'benchmark', projection=projection)
+        fig.canvas.draw()
+        plt.close(fig)
+    return run
+
+
+def case_draw_simple():
+    import matplotlib.pyplot as plt
+    import create_territory_map as simple
+    from territories import load_registry
+    registry = load_registry()
+
+    def run():
+        fig, _ = simple.draw_map(registry)
+        fig.canvas.draw()
+        plt.close(fig)
+    return run
+
+
+def case_draw_layers():
+    """Replace and re-draw the polygon, fault, place and label layers over the cached basemap."""
+    import create_territory_map_geo as geo
+    from layers import LayeredFigure, registry_artists
+    from territories import load_registry
+    registry = load_registry()
+    fig, ax = _geo_figure()
+    layered = LayeredFigure(fig, registry_artists(ax))
+    layered.frame(100)
+
+    def run():
+        layered.remove_dynamic(*registry_artists(ax))
+        layered.add_dynamic(*geo.draw_registry(ax, registry))
+        layered.frame(100)
+    return run
+
+
+def case_export(fmt, dpi):
+    from export import export_figure
+    fig, _ = _geo_figure()
+    out_dir = tempfile.mkdtemp(prefix='benchmark-')
+    return lambda: export_figure(fig, 'benchmark', out_dir, [fmt], [dpi], workers=0)
+
+
+CASES = {
+    **{f'dem.{size}': (lambda size=size: case_dem(size), 1 if size == '8k' else None)
+       for size in DEM_SIZES},
+    'dem.smooth.2k': (case_smooth, None),
+    'shade.hillshade.2k': (case_hillshade, None),
+    'shade.rgb.2k': (case_shade_rgb, None),
+    'draw.geo': (case_draw_geo, None),
+    'draw.geo.utm': (case_draw_geo_projected, None),
+    'draw.simple': (case_draw_simple, None),
+    'draw.layers': (case_draw_layers, None),
+    **{f'export.{fmt}.{dpi}dpi': (lambda fmt=fmt, dpi=dpi: case_export(fmt, dpi),
+                                  1 if dpi == 600 else None)
+       for fmt in ('png', 'pdf') for dpi in EXPORT_DPIS},
+}
+
+
+def run_case(name, repeat=DEFAULT_REPEAT):
+    """Set up and time one case in this process: {seconds, runs, peak_rss_bytes}."""
+    import matplotlib
+    matplotlib.use('Agg')
+    setup, case_repeat = CASES[name]
+    run = setup()
+    repeat = case_repeat or repeat
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+    return dict(seconds=min(times), runs=times, peak_rss_bytes=max_rss_bytes())
+
+
+def run_isolated(name, repeat=DEFAULT_REPEAT):
+    """Run one case in a fresh interpreter, so its peak RSS is not shared with others."""
+    cmd = [sys.executable, os.path.abspath(__file__), '--run-case', name,
+           '--repeat', str(repeat)]
+    result = subprocess.run(cmd, cwd=FIGURES_DIR, capture_output=True, text=True,
+                            env=dict(os.environ, MPLBACKEND='Agg'))
+    if result.returncode != 0:
+        raise RuntimeError(f"{name} failed:\n{result.stderr.strip()}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def machine():
+    import matplotlib
+    import numpy
+    import scipy
+    return dict(platform=platform.platform(), processor=platform.processor(),
+                cpus=os.cpu_count(), python=platform.python_version(),
+                numpy=numpy.__version__, scipy=scipy.__version__,
+                matplotlib=matplotlib.__version__)
+
+
+def load_baseline(path=BASELINE_PATH):
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def compare(results, baseline, time_threshold=TIME_THRESHOLD,
+            memory_threshold=MEMORY_THRESHOLD):
+    """Return [(case, message)] for every regression against baseline."""
+    regressions = []
+    for name, result in results.items():
+        base = baseline['cases'].get(name)
+        if base is None:
+            continue
+        limit = max(base['seconds'] * (1 + time_threshold), base['seconds'] + MIN_SECONDS_DELTA)
+        if result['seconds'] > limit:
+            regressions.append((name, f"{result['seconds']:.3f} s vs {base['seconds']:.3f} s "
+                                      f"(+{result['seconds'] / base['seconds'] - 1:.0%})"))
+        # Peak RSS is None where the resource module is unavailable
+        rss, base_rss = result['peak_rss_bytes'], base['peak_rss_bytes']
+        if rss and base_rss and rss > base_rss * (1 + memory_threshold):
+            regressions.append((name, f"peak RSS {result['peak_rss_bytes'] / 1e6:.0f} MB vs "
+                                      f"{base['peak_rss_bytes'] / 1e6:.0f} MB"))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('cases', nargs='*',
+                        help='cases to run, or prefixes such as "export" (default: all)')
+    parser.add_argument('--quick', action='store_true',
+                        help=f"skip {', '.join(SLOW_CASES)}")
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT,
+                        help='timed runs per case; the best counts')
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--update', action='store_true',
+                        help='record the results as the new baseline for these cases')
+    parser.add_argument('--threshold', type=float, default=TIME_THRESHOLD,
+                        help='allowed slowdown as a fraction of the baseline time')
+    parser.add_argument('--memory-threshold', type=float, default=MEMORY_THRESHOLD,
+                        help='allowed peak RSS growth as a fraction of the baseline')
+    parser.add_argument('--output', metavar='JSON', help='also write the results here')
+    parser.add_argument('--list', action='store_true', help='list the cases')
+    parser.add_argument('--run-case', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_case:
+        print(json.dumps(run_case(args.run_case, args.repeat)))
+        return 0
+    names = [n for n in CASES
+             if not args.cases or any(n == c or n.startswith(c + '.') for c in args.cases)]
+    if args.quick:
+        names = [n for n in names if n not in SLOW_CASES]
+    if args.list:
+        print('\n'.join(names))
+        return 0
+    if not names:
+        parser.error(f"no cases match {args.cases}")
+
+    baseline = load_baseline(args.baseline)
+    if baseline is not None and baseline.get('version') != BENCHMARK_VERSION:
+        print(f"Baseline is version {baseline.get('version')}, benchmarks are "
+              f"version {BENCHMARK_VERSION}; not comparing")
+        baseline = None
+    if baseline is not None and baseline['machine'] != machine():
+        print("Warning: the baseline was recorded on a different machine or library versions")
+
+    results = {}
+    for name in names:
+        results[name] = result = run_isolated(name, args.repeat)
+        base = (baseline or {}).get('cases', {}).get(name)
+        change = f" ({result['seconds'] / base['seconds'] - 1:+.0%})" if base else ''
+        rss = result['peak_rss_bytes']
+        print(f"{name:22s} {result['seconds'] * 1e3:10.1f} ms{change:8s} "
+              f"peak RSS {f'{rss / 1e6:7.0f} MB' if rss else '    n/a'}", flush=True)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(dict(version=BENCHMARK_VERSION, machine=machine(), cases=results),
+                      f, indent=1)
+    if args.update:
+        if baseline is None:
+            baseline = dict(version=BENCHMARK_VERSION, cases={})
+        baseline['machine'] = machine()
+        baseline['recorded'] = time.strftime('%Y-%m-%d')
+        baseline['cases'].update({name: dict(seconds=round(r['seconds'], 5),
+                                             peak_rss_bytes=r['peak_rss_bytes'])
+                                  for name, r in results.items()})
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(baseline, f, indent=1, sort_keys=True)
+            f.write('\n')
+        print(f"Baseline updated: {args.baseline}")
+        return 0
+    if baseline is None:
+        print("No baseline to compare with; record one with --update")
+        return 0
+    regressions = compare(results, baseline, args.threshold, args.memory_threshold)
+    for name, message in regressions:
+        print(f"REGRESSION {name}: {message}")
+    if not regressions:
+        print(f"No regressions against {os.path.relpath(args.baseline)}")
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+"""
+Incremental build of the figures referenced by the LaTeX documents.
+
+Scans the .tex files in the repository root for \\includegraphics (resolved
+through \\graphicspath the way LaTeX does) and maps each figure to its
+producer in figures.json: a map script, a page rendered from a source PDF
+(with poppler's pdftoppm), an image extracted from a source PDF (with
+pdf_images.py), or, if it has no entry, a static file that must already
+exist. A producer's key is the SHA-256 of its parameters and the
+contents of its inputs; for scripts these include every sibling module they
+import, found with ast. A figure is rebuilt only when its key or its output
+file changed since the last build, and stale figures are built concurrently
+in subprocesses.
+
+File hashes are cached in .build_state.json by (size, mtime), so a no-op
+build only stats files and finishes in a few tens of milliseconds. After a
+successful build, print_sizes.py makes the documents' print-size variants.
+"""
+
+import argparse
+import ast
+import hashlib
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+FIGURES_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(FIGURES_DIR)
+MANIFEST_PATH = os.path.join(FIGURES_DIR, 'figures.json')
+STATE_PATH = os.path.join(FIGURES_DIR, '.build_state.json')
+PDF_IMAGES_SCRIPT = 'figures/pdf_images.py'
+# Print-size variants (print_sizes.py); documents list their directory first
+# in \graphicspath, but the figures they stand in for are what gets built
+PRINT_DIR = 'figures/print'
+
+# Bump when producers change in a way their parameters don't capture
+BUILD_VERSION = 1
+
+# Extensions pdflatex tries for \includegraphics{name} without one, in order
+GRAPHICS_EXTENSIONS = ('.pdf', '.png', '.jpg', '.jpeg')
+
+_INCLUDE = re.compile(r'\\includegraphics\s*(?:\[([^\]]*)\])?\s*\{([^}]+)\}')
+_GRAPHICSPATH = re.compile(r'\\graphicspath\s*\{((?:\s*\{[^}]*\})*)\s*\}')
+_COMMENT = re.compile(r'(?<!\\)%.*')
+
+
+def scan_documents(root=ROOT):
+    """Yield (tex_path, name, graphicspath dirs, options) for every \\includegraphics."""
+    for tex in sorted(f for f in os.listdir(root) if f.endswith('.tex')):
+        with open(os.path.join(root, tex), encoding='utf-8') as f:
+            text = _COMMENT.sub('', f.read())
+        dirs = []
+        for match in _GRAPHICSPATH.finditer(text):
+            dirs += [d for d in re.findall(r'\{([^}]*)\}', match.group(1))
+                     if not os.path.normpath(d).startswith(PRINT_DIR)]
+        for match in _INCLUDE.finditer(text):
+            yield tex, match.group(2).strip(), dirs, match.group(1) or ''
+
+
+def resolve(name, dirs, manifest, root=ROOT):
+    """
+    Repository-relative path LaTeX would pick for name: the first candidate
+    over graphicspath dirs and extensions that exists or has a producer.
+    """
+    extensions = [''] if os.path.splitext(name)[1] else GRAPHICS_EXTENSIONS
+    for d in dirs + ['']:
+        for ext in extensions:
+            path = os.path.normpath(os.path.join(d, name + ext))
+            if path in manifest or os.path.exists(os.path.join(root, path)):
+                return path
+    return None
+
+
+class FileHashes:
+    """SHA-256 of files, cached by (size, mtime_ns) across builds."""
+
+    def __init__(self, cache, root=ROOT):
+        self.cache = cache
+        self.root = root
+
+    def stat(self, path):
+        st = os.stat(os.path.join(self.root, path))
+        return [st.st_size, st.st_mtime_ns]
+
+    def digest(self, path):
+        stat = self.stat(path)
+        cached = self.cache.get(path)
+        if cached and cached[:2] == stat:
+            return cached[2]
+        h = hashlib.sha256()
+        with open(os.path.join(self.root, path), 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                h.update(block)
+        self.cache[path] = stat + [h.hexdigest()]
+        return h.hexdigest()
+
+
+def local_imports(script, hashes, cache):
+    """Sibling modules imported by script, recursively (repository-relative paths)."""
+    found, todo = set(), [script]
+    while todo:
+        path = todo.pop()
+        digest = hashes.digest(path)
+        if cache.get(path, [None])[0] != digest:
+            with open(os.path.join(ROOT, path), encoding='utf-8') as f:
+                tree = ast.parse(f.read(), path)
+            names = set()
+            for node in ast.walk(tree):
+                if isinstance(node, ast.Import):
+                    names.update(alias.name.split('.')[0] for alias in node.names)
+                elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+                    names.add(node.module.split('.')[0])
+            cache[path] = [digest, sorted(names)]
+        for name in cache[path][1]:
+            module = os.path.join(os.path.dirname(path), f'{name}.py')
+            if module not in found and os.path.exists(os.path.join(ROOT, module)):
+                found.add(module)
+                todo.append(module)
+    return sorted(found)
+
+
+def rule_inputs(spec, hashes, import_cache):
+    if spec['producer'] == 'script':
+        return ([spec['script']] + local_imports(spec['script'], hashes, import_cache)
+                + spec.get('inputs', []))
+    if spec['producer'] == 'pdf_page':
+        return [spec['pdf']]
+    if spec['producer'] == 'pdf_image':
+        return [spec['pdf'], PDF_IMAGES_SCRIPT]
+    return []
+
+
+def rule_key(target, spec, inputs, hashes):
+    payload = json.dumps({'version': BUILD_VERSION, 'target': target, 'spec': spec,
+                          'inputs': {path: hashes.digest(path) for path in inputs}},
+                         sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def produce(target, spec):
+    """Run the producer for target; raise RuntimeError with its output on failure."""
+    out = os.path.join(ROOT, target)
+    os.makedirs(os.path.dirname(out), exist_ok=True)
+    if spec['producer'] == 'script':
+        cmd = [sys.executable, os.path.join(ROOT, spec['script'])] + spec.get('args', [])
+        cwd = os.path.dirname(os.path.join(ROOT, spec['script']))
+    elif spec['producer'] == 'pdf_page':
+        page = str(spec['page'])
+        cmd = ['pdftoppm', '-png', '-r', str(spec.get('dpi', 150)), '-f', page, '-l', page,
+               '-singlefile', os.path.join(ROOT, spec['pdf']), os.path.splitext(out)[0]]
+        cwd = ROOT
+    elif spec['producer'] == 'pdf_image':
+        cmd = [sys.executable, os.path.join(ROOT, PDF_IMAGES_SCRIPT), '--force', target]
+        cwd = ROOT
+    else:
+        raise ValueError(f"{target}: unknown producer '{spec['producer']}'")
+    env = dict(os.environ, MPLBACKEND='Agg')
+    try:
+        result = subprocess.run(cmd, cwd=cwd, env=env, capture_output=True, text=True)
+    except FileNotFoundError as e:
+        raise RuntimeError(f"{target}: {e.filename} not found") from e
+    if result.returncode != 0:
+        raise RuntimeError(f"{target}: {' '.join(cmd)} exited with {result.returncode}\n"
+                           f"{result.stderr.strip()}")
+    if not os.path.exists(out):
+        raise RuntimeError(f"{target}: producer did not write the file")
+
+
+def load_manifest(path=MANIFEST_PATH):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def load_state(path=STATE_PATH):
+    try:
+        with open(path, encoding='utf-8') as f:
+            state = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        state = {}
+    if state.get('version') != BUILD_VERSION:
+        state = {'version': BUILD_VERSION}
+    for section in ('files', 'imports', 'targets'):
+        state.setdefault(section, {})
+    return state
+
+
+def save_state(state, path=STATE_PATH):
+    tmp = f'{path}.tmp-{os.getpid()}'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(state, f, indent=1, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def referenced_figures(manifest, root=ROOT):
+    """{repository-relative path: [documents]} for every figure the .tex files use."""
+    figures, missing = {}, []
+    for tex, name, dirs, _ in scan_documents(root):
+        path = resolve(name, dirs, manifest, root)
+        if path is None:
+            missing.append(f"{tex}: {name}")
+        else:
+            figures.setdefault(path, []).append(tex)
+    if missing:
+        raise ValueError("Figures with no file and no producer:\n  " + '\n  '.join(missing))
+    return figures
+
+
+def build(targets, manifest, state, jobs=None, force=False, dry_run=False, adopt=False,
+          log=print):
+    """
+    Bring targets up to date. Returns (built, failed) lists of targets.
+
+    With adopt, existing outputs are recorded as up to date without running
+    their producers (e.g. for figures made before the build tool existed).
+    """
+    hashes = FileHashes(state['files'])
+    keys, stale = {}, []
+    for target in targets:
+        spec = manifest.get(target, {'producer': 'static'})
+        if spec['producer'] == 'static':
+            if not os.path.exists(os.path.join(ROOT, target)):
+                raise ValueError(f"{target}: static figure is missing")
+            continue
+        inputs = rule_inputs(spec, hashes, state['imports'])
+        keys[target] = rule_key(target, spec, inputs, hashes)
+        recorded = state['targets'].get(target)
+        out = os.path.join(ROOT, target)
+        if (force or recorded is None or recorded['key'] != keys[target]
+                or not os.path.exists(out) or recorded['stat'] != hashes.stat(target)):
+            stale.append(target)
+
+    if adopt:
+        stale = [t for t in stale if not os.path.exists(os.path.join(ROOT, t))]
+        for target in set(keys) - set(stale):
+            state['targets'][target] = {'key': keys[target], 'stat': hashes.stat(target)}
+    if dry_run or not stale:
+        return stale, []
+
+    def run(target):
+        start = time.perf_counter()
+        produce(target, manifest[target])
+        return time.perf_counter() - start
+
+    built, failed = [], []
+    with ThreadPoolExecutor(max_workers=jobs or os.cpu_count()) as pool:
+        futures = {target: pool.submit(run, target) for target in stale}
+        for target, future in futures.items():
+            try:
+                seconds = future.result()
+            except (RuntimeError, ValueError, OSError) as e:
+                failed.append(target)
+                log(f"FAILED {e}")
+                continue
+            state['targets'][target] = {'key': keys[target], 'stat': hashes.stat(target)}
+            built.append(target)
+            log(f"built  {target} ({seconds:.1f} s)")
+    return built, failed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('targets', nargs='*',
+                        help='figures to build, by path or file name (default: all referenced)')
+    parser.add_argument('--all', action='store_true',
+                        help='also build manifest figures no document references')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='concurrent producers (default: all cores)')
+    parser.add_argument('--force', action='store_true', help='rebuild even if up to date')
+    parser.add_argument('-n', '--dry-run', action='store_true', help='only list stale figures')
+    parser.add_argument('--adopt', action='store_true',
+                        help='record existing outputs as up to date without rebuilding them')
+    parser.add_argument('--list', action='store_true',
+                        help='list referenced figures and their producers')
+    parser.add_argument('--no-print-sizes', action='store_true',
+                        help='skip making print-size variants (see print_sizes.py)')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    manifest = load_manifest()
+    figures = referenced_figures(manifest)
+    if args.all:
+        for target in manifest:
+            figures.setdefault(target, [])
+    if args.targets:
+        figures = {path: docs for path, docs in figures.items()
+                   if path in args.targets or os.path.basename(path) in args.targets}
+        unknown = set(args.targets) - set(figures) - {os.path.basename(p) for p in figures}
+        if unknown:
+            parser.error(f"unknown figures: {', '.join(sorted(unknown))}")
+
+    if args.list:
+        for path, docs in sorted(figures.items()):
+            producer = manifest.get(path, {'producer': 'static'})['producer']
+            print(f"{path:55s} {producer:9s} {', '.join(sorted(set(docs)))}")
+        sys.exit(0)
+
+    state = load_state()
+    try:
+        built, failed = build(sorted(figures), manifest, state, args.jobs, args.force,
+                              args.dry_run, args.adopt)
+    finally:
+        if not args.dry_run:
+            save_state(state)
+    if not (args.dry_run or failed or args.no_print_sizes):
+        from print_sizes import run as make_print_sizes
+        make_print_sizes(jobs=args.jobs)
+    elapsed = time.perf_counter() - start
+    if args.dry_run:
+        print('\n'.join(f"stale  {t}" for t in built) or 'Nothing to build')
+    elif not built and not failed:
+        print(f"{len(figures)} figures up to date ({elapsed * 1000:.0f} ms)")
+    else:
+        print(f"Built {len(built)}, failed {len(failed)} in {elapsed:.1f} s")
+    sys.exit(1 if failed else 0)
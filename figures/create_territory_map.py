@@ -5,216 +5,212 @@ Territories based on ethnographic sources: Kroeber (1925), Steward (1933, 1938),
 Zigmond (1981), and Native Land Digital.
 """
 
+import argparse
+
 import matplotlib.pyplot as plt
 import matplotlib.patches as mpatches
-from matplotlib.patches import Polygon, FancyBboxPatch
-from matplotlib.collections import PatchCollection
+from matplotlib.patches import Polygon
+from matplotlib.collections import LineCollection, PatchCollection
 import numpy as np
 
-# Set up the figure
-fig, ax = plt.subplots(1, 1, figsize=(10, 12))
-
-# Define the map extent (longitude, latitude)
-# Centered on Saline Valley region
-lon_min, lon_max = -118.6, -116.8
-lat_min, lat_max = 35.8, 37.8
-
-# Territory polygons (simplified boundaries based on ethnographic sources)
-# Coordinates as (longitude, latitude) pairs
-
-# Kawaiisu - Tehachapi Mountains and southern Sierra Nevada foothills
-# Southern portion of map
-kawaiisu = np.array([
-    [-118.6, 35.8],
-    [-118.6, 36.2],
-    [-118.3, 36.4],
-    [-117.8, 36.3],
-    [-117.5, 36.0],
-    [-117.2, 35.8],
-    [-118.6, 35.8]
-])
-
-# Tubatulabal - Upper Kern River Valley (west-central)
-tubatulabal = np.array([
-    [-118.6, 36.2],
-    [-118.6, 36.7],
-    [-118.3, 36.8],
-    [-118.0, 36.6],
-    [-118.3, 36.4],
-    [-118.6, 36.2]
-])
-
-# Western Shoshone (Newe Sogobia) - Death Valley, Saline Valley, eastern portion
-# This is the Timbisha/Panamint Shoshone territory
-western_shoshone = np.array([
-    [-117.8, 36.3],
-    [-118.0, 36.6],
-    [-117.8, 37.0],
-    [-117.5, 37.3],
-    [-117.2, 37.5],
-    [-116.8, 37.5],
-    [-116.8, 36.2],
-    [-117.2, 35.8],
-    [-117.5, 36.0],
-    [-117.8, 36.3]
-])
-
-# Eastern Mono/Monache (Nuumu Witu) - Owens Valley and eastern Sierra
-nuumu_witu = np.array([
-    [-118.3, 36.8],
-    [-118.6, 36.7],
-    [-118.6, 37.4],
-    [-118.4, 37.6],
-    [-118.0, 37.5],
-    [-117.8, 37.0],
-    [-118.0, 36.6],
-    [-118.3, 36.8]
-])
-
-# Northern Paiute (Nuumu) - Northern Owens Valley extending north
-nuumu = np.array([
-    [-118.6, 37.4],
-    [-118.6, 37.8],
-    [-117.8, 37.8],
-    [-117.2, 37.5],
-    [-117.5, 37.3],
-    [-117.8, 37.0],
-    [-118.0, 37.5],
-    [-118.4, 37.6],
-    [-118.6, 37.4]
-])
-
-# Colors with transparency
-colors = {
-    'kawaiisu': '#E6550D',      # Orange
-    'tubatulabal': '#31A354',   # Green
-    'western_shoshone': '#756BB1',  # Purple
-    'nuumu_witu': '#3182BD',    # Blue
-    'nuumu': '#E7298A'          # Pink
-}
-
-alpha = 0.4
-
-# Plot territories
-territories = [
-    (kawaiisu, 'kawaiisu', 'Kawaiisu'),
-    (tubatulabal, 'tubatulabal', 'Tubatulabal'),
-    (western_shoshone, 'western_shoshone', 'Newe Sogobia\n(Western Shoshone)'),
-    (nuumu_witu, 'nuumu_witu', 'Nüümü Witü\n(Eastern Mono)'),
-    (nuumu, 'nuumu', 'Nüümü\n(Northern Paiute)')
-]
-
-for coords, key, label in territories:
-    poly = Polygon(coords, closed=True, facecolor=colors[key],
-                   edgecolor='black', linewidth=1.5, alpha=alpha)
-    ax.add_patch(poly)
-
-# Add key geographic features as points
-places = {
-    'Saline Valley': (-117.85, 36.75),
-    'Death Valley': (-117.0, 36.5),
-    'Owens Lake': (-117.95, 36.45),
-    'Mono Lake': (-119.0, 38.0),  # Off map but direction indicated
-    'Panamint Valley': (-117.4, 36.1),
-    'Eureka Valley': (-117.65, 37.1),
-}
-
-# Plot places within map bounds
-for name, (lon, lat) in places.items():
-    if lon_min <= lon <= lon_max and lat_min <= lat <= lat_max:
-        ax.plot(lon, lat, 'ko', markersize=6)
+from export import add_export_arguments, export_figure
+from layers import registry_layer
+from profiling import add_profiling_arguments, profiled, stage, staged
+from projection import (Geographic, PROJECTIONS, get_projection, graticule, map_bounds,
+                        point, project_rings, scale_bar)
+from territories import load_registry
+
+# Map extent (lon_min, lon_max, lat_min, lat_max), centered on the Saline Valley region
+MAP_EXTENT = (-118.6, -116.8, 35.8, 37.8)
+
+# Scale bar (true length on the ground at its latitude) and graticule
+# spacing of the projected map
+SCALE_BAR_KM = 50
+GRATICULE_STEP = 0.5
+
+
+def format_lon(x, pos):
+    return f'{abs(x):.1f}°W'
+
+
+def format_lat(y, pos):
+    return f'{y:.1f}°N'
+
+
+def format_km(v, pos):
+    return f'{v / 1000:.0f}'
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--projection', choices=PROJECTIONS,
+                        help='draw in projected coordinates instead of degrees')
+    add_export_arguments(parser)
+    add_profiling_arguments(parser)
+    return parser.parse_args()
+
+
+@staged('draw.registry')
+def draw_registry(ax, registry, extent=MAP_EXTENT, projection=None):
+    """
+    Draw the registry layers (territories, places and the legend) on ax;
+    returns their artists so the watch mode can replace them.
+    Coordinates are transformed by projection (default: plain degrees).
+    """
+    lon_min, lon_max, lat_min, lat_max = extent
+    places = [place for place in registry.places
+              if lon_min <= place['lon'] <= lon_max and lat_min <= place['lat'] <= lat_max]
+
+    # Territory rings and places, projected in one batch
+    rings = project_rings(projection or Geographic(),
+                          [territory['coords'] for territory in registry.territories]
+                          + [np.array([[place['lon'], place['lat']] for place in places])
+                             .reshape(-1, 2)])
+    place_xy = rings.pop()
+
+    alpha = 0.4
+
+    # Plot territories, batched into one collection
+    artists = [ax.add_collection(PatchCollection(
+        [Polygon(ring, closed=True, facecolor=territory['color'],
+                 edgecolor='black', linewidth=1.5, alpha=alpha)
+         for territory, ring in zip(registry.territories, rings)],
+        match_original=True))]
+
+    # Plot places within map bounds: one marker artist, then the labels
+    artists += ax.plot(place_xy[:, 0], place_xy[:, 1], 'ko', markersize=6, linestyle='none')
+    for place, (lon, lat) in zip(places, place_xy):
+        name = place['name']
         # Adjust text position based on location
         if name == 'Saline Valley':
-            ax.annotate(name, (lon, lat), xytext=(5, 5),
+            artists.append(ax.annotate(name, (lon, lat), xytext=(5, 5),
                        textcoords='offset points', fontsize=9, fontweight='bold',
                        bbox=dict(boxstyle='round,pad=0.3', facecolor='white',
-                                edgecolor='none', alpha=0.8))
+                                edgecolor='none', alpha=0.8)))
         elif name == 'Owens Lake':
-            ax.annotate(name, (lon, lat), xytext=(-40, -15),
+            artists.append(ax.annotate(name, (lon, lat), xytext=(-40, -15),
                        textcoords='offset points', fontsize=8,
                        bbox=dict(boxstyle='round,pad=0.2', facecolor='white',
-                                edgecolor='none', alpha=0.7))
+                                edgecolor='none', alpha=0.7)))
         else:
-            ax.annotate(name, (lon, lat), xytext=(5, -10),
+            artists.append(ax.annotate(name, (lon, lat), xytext=(5, -10),
                        textcoords='offset points', fontsize=8,
                        bbox=dict(boxstyle='round,pad=0.2', facecolor='white',
-                                edgecolor='none', alpha=0.7))
-
-# Add mountain ranges as text labels (rotated)
-ax.text(-118.5, 37.1, 'Sierra Nevada', fontsize=8, fontstyle='italic',
-        rotation=70, ha='center', va='center', color='#555555')
-ax.text(-117.35, 36.9, 'Inyo\nMountains', fontsize=7, fontstyle='italic',
-        ha='center', va='center', color='#555555')
-ax.text(-117.15, 36.35, 'Panamint\nRange', fontsize=7, fontstyle='italic',
-        ha='center', va='center', color='#555555')
-
-# Create legend
-legend_patches = [
-    mpatches.Patch(facecolor=colors['kawaiisu'], edgecolor='black',
-                   alpha=alpha, label='Kawaiisu'),
-    mpatches.Patch(facecolor=colors['tubatulabal'], edgecolor='black',
-                   alpha=alpha, label='Tubatulabal'),
-    mpatches.Patch(facecolor=colors['western_shoshone'], edgecolor='black',
-                   alpha=alpha, label='Newe Sogobia (Western Shoshone)'),
-    mpatches.Patch(facecolor=colors['nuumu_witu'], edgecolor='black',
-                   alpha=alpha, label='Nüümü Witü (Eastern Mono)'),
-    mpatches.Patch(facecolor=colors['nuumu'], edgecolor='black',
-                   alpha=alpha, label='Nüümü (Northern Paiute)'),
-]
-
-ax.legend(handles=legend_patches, loc='lower right', fontsize=9,
-          framealpha=0.95, edgecolor='black')
-
-# Set axis properties
-ax.set_xlim(lon_min, lon_max)
-ax.set_ylim(lat_min, lat_max)
-ax.set_aspect('equal')
-
-# Add gridlines
-ax.grid(True, linestyle='--', alpha=0.3)
-
-# Labels
-ax.set_xlabel('Longitude (°W)', fontsize=10)
-ax.set_ylabel('Latitude (°N)', fontsize=10)
-
-# Format tick labels
-ax.xaxis.set_major_formatter(plt.FuncFormatter(lambda x, p: f'{abs(x):.1f}°W'))
-ax.yaxis.set_major_formatter(plt.FuncFormatter(lambda x, p: f'{x:.1f}°N'))
-
-# Title
-ax.set_title('Indigenous Territories of the Saline Valley Region\n'
-             'Simplified boundaries based on ethnographic sources',
-             fontsize=12, fontweight='bold', pad=15)
-
-# Add source note
-fig.text(0.5, 0.02,
-         'Sources: Kroeber (1925), Steward (1933, 1938), Zigmond (1981), Native Land Digital',
-         ha='center', fontsize=8, fontstyle='italic', color='#666666')
-
-# Add north arrow
-ax.annotate('', xy=(-116.95, 37.65), xytext=(-116.95, 37.45),
-            arrowprops=dict(arrowstyle='->', lw=2, color='black'))
-ax.text(-116.95, 37.7, 'N', fontsize=12, fontweight='bold', ha='center')
-
-# Add scale bar (approximate at this latitude)
-# 1 degree longitude ≈ 85 km at 37°N
-scale_lon = -118.4
-scale_lat = 35.95
-scale_length = 0.5  # degrees, roughly 42 km
-ax.plot([scale_lon, scale_lon + scale_length], [scale_lat, scale_lat],
-        'k-', linewidth=3)
-ax.text(scale_lon + scale_length/2, scale_lat - 0.08, '~42 km',
-        ha='center', fontsize=8)
-
-plt.tight_layout()
-plt.subplots_adjust(bottom=0.08)
-
-# Save in multiple formats
-plt.savefig('/Users/isaac/Documents/Courses/Ge136/figures/maps/saline_valley_territories.pdf',
-            dpi=300, bbox_inches='tight')
-plt.savefig('/Users/isaac/Documents/Courses/Ge136/figures/maps/saline_valley_territories.png',
-            dpi=300, bbox_inches='tight')
-
-print("Map saved to:")
-print("  figures/maps/saline_valley_territories.pdf")
-print("  figures/maps/saline_valley_territories.png")
+                                edgecolor='none', alpha=0.7)))
+
+    # Create legend
+    legend_patches = [
+        mpatches.Patch(facecolor=territory['color'], edgecolor='black',
+                       alpha=alpha, label=territory['label'].replace('\n', ' '))
+        for territory in registry.territories
+    ]
+
+    artists.append(ax.legend(handles=legend_patches, loc='lower right', fontsize=9,
+                             framealpha=0.95, edgecolor='black'))
+    return registry_layer(artists)
+
+
+@staged('draw')
+def draw_map(registry, extent=MAP_EXTENT, projection=None):
+    """Draw the simplified territory map; returns (fig, ax)."""
+    projection = projection or Geographic()
+    projected = not isinstance(projection, Geographic)
+    view = map_bounds(projection, extent)
+
+    # Set up the figure
+    fig, ax = plt.subplots(1, 1, figsize=(10, 12))
+
+    # Add mountain ranges as text labels (rotated)
+    ax.text(*point(projection, -118.5, 37.1), 'Sierra Nevada', fontsize=8, fontstyle='italic',
+            rotation=70, ha='center', va='center', color='#555555')
+    ax.text(*point(projection, -117.35, 36.9), 'Inyo\nMountains', fontsize=7, fontstyle='italic',
+            ha='center', va='center', color='#555555')
+    ax.text(*point(projection, -117.15, 36.35), 'Panamint\nRange', fontsize=7, fontstyle='italic',
+            ha='center', va='center', color='#555555')
+
+    # Set axis properties
+    ax.set_xlim(view[0], view[1])
+    ax.set_ylim(view[2], view[3])
+    ax.set_aspect('equal')
+
+    if projected:
+        # Graticule of meridians and parallels; the axes are in projected km
+        meridians, parallels = graticule(extent, GRATICULE_STEP)
+        ax.add_collection(LineCollection(project_rings(projection, meridians + parallels),
+                                         colors='black', linewidths=0.8, linestyles='--',
+                                         alpha=0.3, zorder=1.5))
+        ax.set_xlabel('Easting (km)', fontsize=10)
+        ax.set_ylabel('Northing (km)', fontsize=10)
+        ax.xaxis.set_major_formatter(plt.FuncFormatter(format_km))
+        ax.yaxis.set_major_formatter(plt.FuncFormatter(format_km))
+    else:
+        # Add gridlines
+        ax.grid(True, linestyle='--', alpha=0.3)
+
+        # Labels
+        ax.set_xlabel('Longitude (°W)', fontsize=10)
+        ax.set_ylabel('Latitude (°N)', fontsize=10)
+
+        # Format tick labels
+        ax.xaxis.set_major_formatter(plt.FuncFormatter(format_lon))
+        ax.yaxis.set_major_formatter(plt.FuncFormatter(format_lat))
+
+    # Title
+    ax.set_title('Indigenous Territories of the Saline Valley Region\n'
+                 'Simplified boundaries based on ethnographic sources',
+                 fontsize=12, fontweight='bold', pad=15)
+
+    # Add source note
+    fig.text(0.5, 0.02,
+             'Sources: Kroeber (1925), Steward (1933, 1938), Zigmond (1981), Native Land Digital'
+             + (f' | {projection.description}' if projected else ''),
+             ha='center', fontsize=8, fontstyle='italic', color='#666666')
+
+    # Add north arrow, along the meridian (true north)
+    ax.annotate('', xy=point(projection, -116.95, 37.65),
+                xytext=point(projection, -116.95, 37.45),
+                arrowprops=dict(arrowstyle='->', lw=2, color='black'))
+    ax.text(*point(projection, -116.95, 37.7), 'N', fontsize=12, fontweight='bold',
+            ha='center')
+
+    # Add scale bar, true length on the ground; in degrees that only holds
+    # at its own latitude
+    scale_lon, scale_lat = -118.4, 35.95
+    x0, y0, x1, y1 = scale_bar(projection, scale_lon, scale_lat, SCALE_BAR_KM)
+    ax.plot([x0, x1], [y0, y1], 'k-', linewidth=3)
+    ax.annotate(f'{SCALE_BAR_KM} km' + ('' if projected else f' (at {scale_lat:.1f}°N)'),
+                ((x0 + x1) / 2, y0), xytext=(0, -6), textcoords='offset points',
+                ha='center', va='top', fontsize=8)
+
+    # Territories, places and the legend from the shared registry,
+    # drawn last: the watch mode re-adds these artists at the end of the
+    # axes, so this keeps its drawing order the same as a fresh draw
+    draw_registry(ax, registry, extent, projection)
+
+    with stage('draw.tight_layout'):
+        plt.tight_layout()
+        plt.subplots_adjust(bottom=0.08)
+    return fig, ax
+
+
+def main():
+    args = parse_args()
+
+    # Territory polygons and places (simplified boundaries based on ethnographic
+    # sources) from the shared registry in territories.geojson
+    with profiled(args):
+        projection = get_projection(args.projection, MAP_EXTENT) if args.projection else None
+        fig, ax = draw_map(load_registry(), projection=projection)
+
+        # Save in multiple formats
+        name = 'saline_valley_territories' + (f'_{args.projection}' if projection else '')
+        paths = export_figure(fig, name, args.output_dir,
+                              args.formats, args.dpi, args.export_workers)
+
+    print("Map saved to:")
+    for path in paths:
+        print(f"  {path}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+"""
+Synthetic DEM representing Basin and Range topography for the Saline Valley maps.
+
+Landforms (ranges and basins) are declared as data in LANDFORMS and applied in
+order onto a base elevation. Each landform is evaluated only inside its own
+lon/lat bounding window and written into the elevation array in place, so the
+cost grows with the area a landform covers rather than with the full grid.
+
+build_terrain() adds the smoothing and the procedural texture (noise.py, keyed
+by seed and lon/lat, so every run and every tile is reproducible). With
+low_memory=True it works in float32 with 1-D broadcast coordinates, row-chunked
+landform and texture evaluation and in-place filtering, so peak memory stays within
+LOW_MEMORY_BYTES_PER_PIXEL (run `python dem.py --check-memory` to verify).
+"""
+
+import argparse
+import tracemalloc
+
+import numpy as np
+from scipy import ndimage
+
+from noise import value_noise_grid
+from profiling import stage
+
+# Map extent (lon_min, lon_max, lat_min, lat_max) and default grid
+# Resolution: ~500m per pixel
+EXTENT = (-118.6, -116.8, 35.8, 37.8)
+NX, NY = 360, 400
+
+# Base elevation (meters) - starts at ~1000m for valleys
+BASE_ELEVATION = 1000
+
+# Smoothing applied to the landforms, then value-noise texture on top:
+# amplitude (m), lattice cell (degrees) and octaves. Hillshading responds to
+# the texture's slope, so these match the original filtered white noise in
+# gradient (std ~4 m per pixel along each axis at the default grid) rather
+# than in height. The cell spans ~3.5 default pixels; a cell near one pixel
+# aliases into grid-aligned hatching
+SMOOTH_SIGMA = 2
+TEXTURE_SEED = 0
+TEXTURE_AMPLITUDE = 20
+TEXTURE_CELL = 0.0175
+TEXTURE_OCTAVES = 1
+
+# Landform windows and texture are evaluated in row chunks of at most this
+# many pixels, which bounds the size of the temporaries
+CHUNK_PIXELS = 1 << 17
+
+# Peak memory budget of build_terrain(low_memory=True): the float32 elevation
+# grid takes 4 bytes per pixel; the remainder covers the smoothing pass.
+# 12 bytes/pixel is ~12 MB per megapixel (~770 MB at 8k x 8k), plus a fixed
+# allowance for the float64 chunk temporaries (~8 MB)
+LOW_MEMORY_BYTES_PER_PIXEL = 12
+LOW_MEMORY_CHUNK_BYTES = 64 * CHUNK_PIXELS
+
+# Landforms, applied in order.
+#
+# 'ridge' profiles vary across longitude only:
+#     elev = base + amp * exp(-((lon - center)**2) / width)
+# optionally multiplied by a latitude taper clip(1 - rate*|lat - lat0|, lo, hi).
+# 'bowl' profiles are elliptical ramps around (cx, cy):
+#     dist = sqrt(((lon - cx)/sx)**2 + ((lat - cy)/sy)**2)
+#     elev = base + amp * dist / scale
+# 'offset' is added last. 'op' combines the landform with the current
+# elevation (max raises ranges, min cuts basins). The landform applies where
+# the open 'lon'/'lat' intervals hold, and additionally within 'halfwidth'
+# of a ridge center or within 'radius' (in dist units) of a bowl center.
+LANDFORMS = [
+    # Sierra Nevada (western edge) - rises to ~4000m
+    dict(name='sierra', op='max', profile='ridge',
+         center=-118.5, base=1500, amp=2500, width=0.02,
+         lon=(None, -118.3)),
+
+    # Inyo Mountains (ridge between Owens Valley and Saline Valley)
+    # Centered around -117.9 to -117.7, running N-S, tapering at the ends
+    dict(name='inyo', op='max', profile='ridge',
+         center=-117.85, base=1200, amp=2000, width=0.008,
+         halfwidth=0.3, taper=(36.8, 0.3, 0.5, 1)),
+
+    # Panamint Range (between Panamint Valley and Death Valley)
+    dict(name='panamint', op='max', profile='ridge',
+         center=-117.15, base=1000, amp=2200, width=0.012,
+         lon=(-117.4, -116.9), lat=(None, 36.8)),
+
+    # White Mountains (northeastern)
+    dict(name='white', op='max', profile='ridge',
+         center=-118.15, base=1500, amp=2200, width=0.015,
+         lon=(-118.4, -117.9), lat=(37.3, None)),
+
+    # Valleys/Basins (grabens) - lower elevations
+
+    # Owens Valley (deep graben, -100m at Owens Lake)
+    dict(name='owens', op='min', profile='ridge',
+         center=-118.05, base=800, amp=-400, width=0.01, offset=400,
+         lon=(-118.25, -117.9), lat=(36.0, 37.0)),
+
+    # Saline Valley (closed basin, ~300m floor)
+    dict(name='saline', op='min', profile='bowl',
+         cx=-117.85, cy=36.75, sx=1, sy=1.5,
+         base=400, amp=300, scale=0.25, radius=0.25),
+
+    # Eureka Valley
+    dict(name='eureka', op='min', profile='bowl',
+         cx=-117.65, cy=37.1, sx=1, sy=1.2,
+         base=900, amp=200, scale=0.15, radius=0.15),
+
+    # Death Valley (below sea level, -86m at Badwater)
+    dict(name='death_valley', op='min', profile='bowl',
+         cx=-116.95, cy=36.4, sx=0.8, sy=1.5,
+         base=-50, amp=500, scale=1, offset=200,
+         lon=(-117.2, -116.8), lat=(35.8, 37.0)),
+
+    # Panamint Valley
+    dict(name='panamint_valley', op='min', profile='bowl',
+         cx=-117.4, cy=36.1, sx=1, sy=0.8,
+         base=500, amp=400, scale=0.2, radius=0.2),
+]
+
+
+def grid_coords(extent=EXTENT, nx=NX, ny=NY):
+    """Return the 1-D longitude and latitude pixel centers of the DEM grid."""
+    lon_min, lon_max, lat_min, lat_max = extent
+    x = np.linspace(lon_min, lon_max, nx)
+    y = np.linspace(lat_min, lat_max, ny)
+    return x, y
+
+
+def _interval_mask(v, bounds):
+    lo, hi = bounds
+    mask = np.ones(v.shape, dtype=bool)
+    if lo is not None:
+        mask &= v > lo
+    if hi is not None:
+        mask &= v < hi
+    return mask
+
+
+def _axis_terms(lf, x, y):
+    """Per-axis bowl distance terms ((lon - cx)/sx)**2 and ((lat - cy)/sy)**2."""
+    dx2 = ((x - lf['cx']) / lf['sx'])**2
+    dy2 = ((y - lf['cy']) / lf['sy'])**2
+    return dx2, dy2
+
+
+def landform_window(lf, x, y):
+    """
+    Return (rows, cols) slices bounding where a landform can apply, or None.
+
+    The window is derived from 1-D tests on the grid coordinates. For bowls
+    the per-axis test sqrt(term) < radius is a necessary condition for
+    dist < radius, so the window never clips pixels the landform touches.
+    """
+    cols = _interval_mask(x, lf.get('lon', (None, None)))
+    rows = _interval_mask(y, lf.get('lat', (None, None)))
+    if lf['profile'] == 'ridge' and 'halfwidth' in lf:
+        cols &= np.abs(x - lf['center']) < lf['halfwidth']
+    if lf['profile'] == 'bowl' and 'radius' in lf:
+        dx2, dy2 = _axis_terms(lf, x, y)
+        cols &= np.sqrt(dx2) < lf['radius']
+        rows &= np.sqrt(dy2) < lf['radius']
+    if not cols.any() or not rows.any():
+        return None
+    c = np.flatnonzero(cols)
+    r = np.flatnonzero(rows)
+    return slice(r[0], r[-1] + 1), slice(c[0], c[-1] + 1)
+
+
+def landform_field(lf, xs, ys, dtype=np.float64):
+    """
+    Evaluate a landform on window coordinates xs (lon) and ys (lat).
+
+    Returns (elev, mask), both broadcastable to (len(ys), len(xs)). Per-axis
+    terms are computed in float64 on the 1-D coordinates and only the 2-D
+    combination is done in dtype.
+    """
+    mask = (_interval_mask(ys, lf.get('lat', (None, None)))[:, np.newaxis]
+            & _interval_mask(xs, lf.get('lon', (None, None)))[np.newaxis, :])
+
+    if lf['profile'] == 'ridge':
+        elev = lf['base'] + lf['amp'] * np.exp(-((xs - lf['center'])**2) / lf['width'])
+        elev = elev.astype(dtype)[np.newaxis, :]
+        if 'taper' in lf:
+            lat0, rate, lo, hi = lf['taper']
+            taper = 1 - rate * np.abs(ys - lat0)
+            elev = elev * np.clip(taper, lo, hi).astype(dtype)[:, np.newaxis]
+        if 'halfwidth' in lf:
+            mask = mask & (np.abs(xs - lf['center']) < lf['halfwidth'])[np.newaxis, :]
+    elif lf['profile'] == 'bowl':
+        dx2, dy2 = _axis_terms(lf, xs, ys)
+        dist = np.sqrt(dx2.astype(dtype)[np.newaxis, :] + dy2.astype(dtype)[:, np.newaxis])
+        elev = lf['base'] + lf['amp'] * dist / lf['scale']
+        if 'radius' in lf:
+            mask = mask & (dist < lf['radius'])
+    else:
+        raise ValueError(f"Unknown landform profile: {lf['profile']!r}")
+
+    if 'offset' in lf:
+        elev = elev + lf['offset']
+    return elev, mask
+
+
+def apply_landform(elevation, lf, x, y):
+    """Combine one landform into elevation in place, inside its window only."""
+    window = landform_window(lf, x, y)
+    if window is None:
+        return
+    rows, cols = window
+    if lf['op'] == 'max':
+        combine = np.maximum
+    elif lf['op'] == 'min':
+        combine = np.minimum
+    else:
+        raise ValueError(f"Unknown landform op: {lf['op']!r}")
+
+    xs = x[cols]
+    step = max(1, CHUNK_PIXELS // len(xs))
+    for r0 in range(rows.start, rows.stop, step):
+        r1 = min(r0 + step, rows.stop)
+        sub = elevation[r0:r1, cols]
+        elev, mask = landform_field(lf, xs, y[r0:r1], elevation.dtype)
+        combine(sub, elev, out=sub, where=mask)
+
+
+def build_dem(extent=EXTENT, nx=NX, ny=NY, landforms=LANDFORMS,
+              base=BASE_ELEVATION, dtype=np.float64, window=None):
+    """
+    Build the (unsmoothed) synthetic elevation grid, shape (ny, nx).
+
+    Row 0 is the southern edge (lat_min), matching imshow(origin='lower').
+    If window=(rows, cols) slices is given, only that part of the grid is
+    built; the values are identical to the same slice of the full grid.
+    """
+    x, y = grid_coords(extent, nx, ny)
+    if window is not None:
+        rows, cols = window
+        x, y = x[cols], y[rows]
+    elevation = np.full((len(y), len(x)), base, dtype=dtype)
+    for lf in landforms:
+        with stage(f"dem.landform.{lf['name']}"):
+            apply_landform(elevation, lf, x, y)
+    return elevation
+
+
+def add_texture(elevation, x, y, seed=TEXTURE_SEED):
+    """Add the procedural texture to elevation in place, in row chunks."""
+    step = max(1, CHUNK_PIXELS // len(x))
+    for r0 in range(0, len(y), step):
+        texture = value_noise_grid(x, y[r0:r0 + step], seed, TEXTURE_CELL,
+                                   TEXTURE_OCTAVES)
+        texture *= TEXTURE_AMPLITUDE
+        elevation[r0:r0 + step] += texture
+
+
+def build_terrain(extent=EXTENT, nx=NX, ny=NY, landforms=LANDFORMS,
+                  low_memory=False, seed=TEXTURE_SEED, window=None):
+    """
+    Build the smoothed, textured elevation grid used for the basemap.
+
+    The output is deterministic for a given seed. low_memory=True switches
+    from float64 to float32 storage with in-place smoothing; see
+    LOW_MEMORY_BYTES_PER_PIXEL. A window is smoothed on its own, so values
+    within the smoothing radius of a window edge that is not a map edge
+    differ from the full grid (see dem_tiles for halo handling).
+    """
+    with stage('dem.grid'):
+        x, y = grid_coords(extent, nx, ny)
+        if window is not None:
+            rows, cols = window
+            x, y = x[cols], y[rows]
+    dtype = np.float32 if low_memory else np.float64
+    elevation = build_dem(extent, nx, ny, landforms, dtype=dtype, window=window)
+    with stage('dem.smooth'):
+        ndimage.gaussian_filter(elevation, sigma=SMOOTH_SIGMA, output=elevation)
+    with stage('dem.texture'):
+        add_texture(elevation, x, y, seed)
+    return elevation
+
+
+def check_memory_budget(nx=2000, ny=2000):
+    """
+    Build a low-memory terrain under tracemalloc and check the peak allocation
+    against LOW_MEMORY_BYTES_PER_PIXEL per pixel plus LOW_MEMORY_CHUNK_BYTES.
+    Returns (peak_bytes, budget_bytes).
+    """
+    budget = LOW_MEMORY_BYTES_PER_PIXEL * nx * ny + LOW_MEMORY_CHUNK_BYTES
+    tracemalloc.start()
+    try:
+        build_terrain(nx=nx, ny=ny, low_memory=True)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    if peak > budget:
+        raise AssertionError(f"Low-memory DEM peaked at {peak / 1e6:.1f} MB, "
+                             f"budget is {budget / 1e6:.1f} MB for {nx}x{ny}")
+    return peak, budget
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--check-memory', action='store_true',
+                        help='verify the low-memory mode peak-memory budget')
+    parser.add_argument('--nx', type=int, default=2000)
+    parser.add_argument('--ny', type=int, default=2000)
+    args = parser.parse_args()
+
+    if args.check_memory:
+        peak, budget = check_memory_budget(args.nx, args.ny)
+        print(f"Low-memory DEM {args.nx}x{args.ny}: peak {peak / 1e6:.1f} MB "
+              f"(budget {budget / 1e6:.1f} MB, "
+              f"{peak / (args.nx * args.ny):.2f} bytes/pixel)")
+    else:
+        parser.print_help()
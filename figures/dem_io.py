@@ -0,0 +1,467 @@
+#!/usr/bin/env python3
+"""
+Memory-mapped ingestion of real elevation rasters for the basemap.
+
+Reads SRTM .hgt tiles and uncompressed GeoTIFFs (stripped or tiled, one band)
+from local disk as an alternative to the synthetic DEM. Only the window of
+each file that covers the map extent is touched: pixels are read through
+np.memmap views of the file (per strip or per tile for GeoTIFFs), a block of
+rows at a time, and block-averaged onto the target (ny, nx) grid. Adjacent
+files are mosaicked by accumulating into the same grid. Where the target grid
+is finer than the source, empty cells take the nearest source pixel.
+
+The output follows dem.build_dem: pixel centers at np.linspace(lon_min,
+lon_max, nx) and np.linspace(lat_min, lat_max, ny), row 0 at lat_min.
+
+Run `python dem_io.py --check` to verify against small fabricated tiles.
+"""
+
+import argparse
+import os
+import re
+import struct
+import tempfile
+
+import numpy as np
+
+# SRTM .hgt tiles are big-endian int16 with -32768 marking voids
+HGT_NODATA = -32768
+
+CHUNK_ROWS = 256
+
+# TIFF tags used here
+_TAGS = {
+    256: 'width', 257: 'height', 258: 'bits', 259: 'compression',
+    273: 'strip_offsets', 277: 'samples', 278: 'rows_per_strip',
+    279: 'strip_counts', 284: 'planar', 322: 'tile_width', 323: 'tile_height',
+    324: 'tile_offsets', 325: 'tile_counts', 339: 'sample_format',
+    33550: 'pixel_scale', 33922: 'tiepoint', 34735: 'geokeys', 42113: 'nodata',
+}
+# TIFF field type -> struct code
+_TYPES = {1: 'B', 2: 's', 3: 'H', 4: 'I', 6: 'b', 8: 'h', 9: 'i',
+          11: 'f', 12: 'd', 16: 'Q', 17: 'q'}
+_SAMPLE_KINDS = {1: 'u', 2: 'i', 3: 'f'}
+# GeoKey for raster type: 1 = PixelIsArea, 2 = PixelIsPoint
+_GT_RASTER_TYPE = 1025
+
+
+class RasterSource:
+    """
+    A north-up, single-band raster on disk.
+
+    Pixel (r, c) is centered at (lon0 + c*dlon, lat0 + r*dlat); dlat is
+    negative for north-up files. read(rows, cols) returns float32 with nodata
+    as NaN and reads only the requested window.
+    """
+
+    def __init__(self, path, width, height, lon0, lat0, dlon, dlat, nodata):
+        self.path = path
+        self.width, self.height = width, height
+        self.lon0, self.lat0 = lon0, lat0
+        self.dlon, self.dlat = dlon, dlat
+        self.nodata = nodata
+
+    def lon(self, cols):
+        return self.lon0 + np.asarray(cols) * self.dlon
+
+    def lat(self, rows):
+        return self.lat0 + np.asarray(rows) * self.dlat
+
+    def _read_raw(self, rows, cols):
+        raise NotImplementedError
+
+    def read(self, rows, cols):
+        block = np.asarray(self._read_raw(rows, cols), dtype=np.float32)
+        if self.nodata is not None:
+            block[block == np.float32(self.nodata)] = np.nan
+        return block
+
+
+class MemmapSource(RasterSource):
+    """A raster stored as one contiguous row-major array (.hgt, single-strip TIFF)."""
+
+    def __init__(self, path, dtype, offset, **geo):
+        super().__init__(path, **geo)
+        self.array = np.memmap(path, dtype=dtype, mode='r', offset=offset,
+                               shape=(self.height, self.width))
+
+    def _read_raw(self, rows, cols):
+        return self.array[rows, cols]
+
+
+class TiledTiffSource(RasterSource):
+    """
+    An uncompressed TIFF stored as strips (block_width == width) or tiles.
+
+    Each block is memory-mapped on demand, so a window read only touches the
+    blocks it overlaps.
+    """
+
+    def __init__(self, path, dtype, offsets, block_width, block_height, **geo):
+        super().__init__(path, **geo)
+        self.dtype = np.dtype(dtype)
+        self.offsets = offsets
+        self.block_width, self.block_height = block_width, block_height
+        self.blocks_across = -(-self.width // block_width)
+
+    def _block(self, br, bc):
+        rows = self.block_height
+        if self.block_width == self.width:
+            # Strips: the last one may be short
+            rows = min(rows, self.height - br * self.block_height)
+        offset = self.offsets[br * self.blocks_across + bc]
+        return np.memmap(self.path, dtype=self.dtype, mode='r', offset=offset,
+                         shape=(rows, self.block_width))
+
+    def _read_raw(self, rows, cols):
+        out = np.empty((rows.stop - rows.start, cols.stop - cols.start), dtype=self.dtype)
+        bh, bw = self.block_height, self.block_width
+        for br in range(rows.start // bh, (rows.stop - 1) // bh + 1):
+            for bc in range(cols.start // bw, (cols.stop - 1) // bw + 1):
+                block = self._block(br, bc)
+                r0, r1 = max(rows.start, br * bh), min(rows.stop, (br + 1) * bh)
+                c0, c1 = max(cols.start, bc * bw), min(cols.stop, (bc + 1) * bw)
+                out[r0 - rows.start:r1 - rows.start, c0 - cols.start:c1 - cols.start] = \
+                    block[r0 - br * bh:r1 - br * bh, c0 - bc * bw:c1 - bc * bw]
+        return out
+
+
+def open_hgt(path):
+    """Open an SRTM .hgt tile; its name (e.g. N36W118.hgt) gives the SW corner."""
+    match = re.match(r'([NS])(\d+)([EW])(\d+)', os.path.basename(path).upper())
+    if match is None:
+        raise ValueError(f"Cannot parse SRTM tile name: {path}")
+    lat = int(match.group(2)) * (1 if match.group(1) == 'N' else -1)
+    lon = int(match.group(4)) * (1 if match.group(3) == 'E' else -1)
+    size = int(round(np.sqrt(os.path.getsize(path) / 2)))
+    if size * size * 2 != os.path.getsize(path):
+        raise ValueError(f"Not a square int16 SRTM tile: {path}")
+    # Samples sit on the tile edges (pixel-is-point), first row at the north edge
+    step = 1.0 / (size - 1)
+    return MemmapSource(path, '>i2', 0, width=size, height=size,
+                        lon0=float(lon), lat0=float(lat + 1),
+                        dlon=step, dlat=-step, nodata=HGT_NODATA)
+
+
+def _read_ifd(f, endian):
+    """Read the first IFD of a classic TIFF into {name: tuple or str}."""
+    f.seek(4)
+    (ifd_offset,) = struct.unpack(endian + 'I', f.read(4))
+    f.seek(ifd_offset)
+    (count,) = struct.unpack(endian + 'H', f.read(2))
+    tags = {}
+    for _ in range(count):
+        tag, ftype, n, raw = struct.unpack(endian + 'HHI4s', f.read(12))
+        if tag not in _TAGS or ftype not in _TYPES:
+            continue
+        code = _TYPES[ftype]
+        size = struct.calcsize(code) * n
+        if size <= 4:
+            data = raw[:size]
+        else:
+            here = f.tell()
+            f.seek(struct.unpack(endian + 'I', raw)[0])
+            data = f.read(size)
+            f.seek(here)
+        if code == 's':
+            tags[_TAGS[tag]] = data.rstrip(b'\0').decode('ascii')
+        else:
+            tags[_TAGS[tag]] = struct.unpack(endian + code * n, data)
+    return tags
+
+
+def open_geotiff(path):
+    """Open an uncompressed, single-band, north-up GeoTIFF."""
+    with open(path, 'rb') as f:
+        order = f.read(2)
+        endian = {b'II': '<', b'MM': '>'}.get(order)
+        if endian is None or struct.unpack(endian + 'H', f.read(2))[0] != 42:
+            raise ValueError(f"Not a classic TIFF file: {path}")
+        tags = _read_ifd(f, endian)
+
+    if tags.get('compression', (1,))[0] != 1:
+        raise ValueError(f"Compressed TIFFs are not supported (memory mapping "
+                         f"needs raw pixels): {path}")
+    if tags.get('samples', (1,))[0] != 1:
+        raise ValueError(f"Expected a single-band elevation raster: {path}")
+    if 'pixel_scale' not in tags or 'tiepoint' not in tags:
+        raise ValueError(f"Missing GeoTIFF georeferencing tags: {path}")
+
+    width, height = tags['width'][0], tags['height'][0]
+    kind = _SAMPLE_KINDS[tags.get('sample_format', (1,))[0]]
+    dtype = np.dtype(f"{endian}{kind}{tags['bits'][0] // 8}")
+
+    sx, sy = tags['pixel_scale'][:2]
+    i, j, _, x, y, _ = tags['tiepoint'][:6]
+    pixel_is_point = False
+    keys = tags.get('geokeys', ())
+    for k in range(4, len(keys), 4):
+        if keys[k] == _GT_RASTER_TYPE and keys[k + 1] == 0:
+            pixel_is_point = keys[k + 3] == 2
+    center = 0.0 if pixel_is_point else 0.5
+    geo = dict(width=width, height=height,
+               lon0=x + (center - i) * sx, lat0=y - (center - j) * sy,
+               dlon=sx, dlat=-sy,
+               nodata=float(tags['nodata']) if 'nodata' in tags else None)
+
+    if 'tile_offsets' in tags:
+        return TiledTiffSource(path, dtype, tags['tile_offsets'],
+                               tags['tile_width'][0], tags['tile_height'][0], **geo)
+    offsets = tags['strip_offsets']
+    counts = tags['strip_counts']
+    contiguous = all(offsets[k] + counts[k] == offsets[k + 1]
+                     for k in range(len(offsets) - 1))
+    if contiguous:
+        return MemmapSource(path, dtype, offsets[0], **geo)
+    rows_per_strip = tags.get('rows_per_strip', (height,))[0]
+    return TiledTiffSource(path, dtype, offsets, width, rows_per_strip, **geo)
+
+
+def open_raster(path):
+    """Open a .hgt or GeoTIFF raster by extension."""
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.hgt':
+        return open_hgt(path)
+    if ext in ('.tif', '.tiff'):
+        return open_geotiff(path)
+    raise ValueError(f"Unsupported DEM format: {path}")
+
+
+def _target_index(v, v_min, step, n):
+    """Index of the target cell whose center is nearest to v, or -1 outside."""
+    idx = np.floor((v - v_min) / step + 0.5).astype(np.int64)
+    idx[(idx < 0) | (idx >= n)] = -1
+    return idx
+
+
+def _span(idx):
+    """Slice covering the entries of idx that fall on the target grid."""
+    hit = np.flatnonzero(idx >= 0)
+    if len(hit) == 0:
+        return None
+    return slice(hit[0], hit[-1] + 1)
+
+
+def load_dem(paths, extent, nx, ny, chunk_rows=CHUNK_ROWS):
+    """
+    Mosaic and resample DEM files onto the (ny, nx) map grid.
+
+    Returns float32 elevations with NaN where no file covers a cell.
+    """
+    lon_min, lon_max, lat_min, lat_max = extent
+    dx = (lon_max - lon_min) / (nx - 1)
+    dy = (lat_max - lat_min) / (ny - 1)
+    total = np.zeros(ny * nx)
+    count = np.zeros(ny * nx)
+    sources = [open_raster(p) for p in paths]
+
+    # Block averaging: every source pixel adds to the cell its center falls in
+    for src in sources:
+        tcols = _target_index(src.lon(np.arange(src.width)), lon_min, dx, nx)
+        trows = _target_index(src.lat(np.arange(src.height)), lat_min, dy, ny)
+        cols, rows = _span(tcols), _span(trows)
+        if cols is None or rows is None:
+            continue
+        for r0 in range(rows.start, rows.stop, chunk_rows):
+            r1 = min(r0 + chunk_rows, rows.stop)
+            block = src.read(slice(r0, r1), cols)
+            # Only the target rows this chunk falls in are accumulated
+            hit = trows[r0:r1][trows[r0:r1] >= 0]
+            if len(hit) == 0:
+                continue
+            span = slice(hit.min() * nx, (hit.max() + 1) * nx)
+            flat = trows[r0:r1, np.newaxis] * nx + tcols[np.newaxis, cols] - span.start
+            valid = ((trows[r0:r1, np.newaxis] >= 0) & (tcols[np.newaxis, cols] >= 0)
+                     & ~np.isnan(block))
+            size = span.stop - span.start
+            total[span] += np.bincount(flat[valid], weights=block[valid], minlength=size)
+            count[span] += np.bincount(flat[valid], minlength=size)
+
+    elevation = np.full(ny * nx, np.nan, dtype=np.float32)
+    np.divide(total, count, out=total, where=count > 0)
+    elevation[count > 0] = total[count > 0]
+    elevation = elevation.reshape(ny, nx)
+
+    # Upsampling: cells no source pixel fell into take the nearest pixel
+    empty = count.reshape(ny, nx) == 0
+    if empty.any():
+        x = np.linspace(lon_min, lon_max, nx)
+        y = np.linspace(lat_min, lat_max, ny)
+        for src in sources:
+            scols = np.rint((x - src.lon0) / src.dlon).astype(np.int64)
+            srows = np.rint((y - src.lat0) / src.dlat).astype(np.int64)
+            in_cols = np.flatnonzero((scols >= 0) & (scols < src.width))
+            in_rows = np.flatnonzero((srows >= 0) & (srows < src.height))
+            if len(in_cols) == 0 or len(in_rows) == 0:
+                continue
+            c_lo, c_hi = scols[in_cols].min(), scols[in_cols].max() + 1
+            for t0 in range(0, len(in_rows), chunk_rows):
+                trs = in_rows[t0:t0 + chunk_rows]
+                sub = empty[np.ix_(trs, in_cols)]
+                if not sub.any():
+                    continue
+                r_lo, r_hi = srows[trs].min(), srows[trs].max() + 1
+                block = src.read(slice(r_lo, r_hi), slice(c_lo, c_hi))
+                sample = block[np.ix_(srows[trs] - r_lo, scols[in_cols] - c_lo)]
+                target = elevation[np.ix_(trs, in_cols)]
+                fill = sub & ~np.isnan(sample)
+                target[fill] = sample[fill]
+                elevation[np.ix_(trs, in_cols)] = target
+                empty[np.ix_(trs, in_cols)] &= ~fill
+    return elevation
+
+
+def fill_voids(elevation):
+    """Fill NaN cells in place with the value of the nearest valid cell."""
+    voids = np.isnan(elevation)
+    if voids.any() and not voids.all():
+        from scipy import ndimage
+        idx = ndimage.distance_transform_edt(voids, return_distances=False,
+                                             return_indices=True)
+        elevation[voids] = elevation[tuple(i[voids] for i in idx)]
+    return elevation
+
+
+def dem_caption(paths):
+    """Source note for the map caption."""
+    if all(p.lower().endswith('.hgt') for p in paths):
+        return 'SRTM elevation data'
+    return 'DEM ' + ', '.join(os.path.basename(p) for p in paths)
+
+
+def dem_signature(paths):
+    """Identity of DEM inputs for cache keys: (path, size, mtime) per file."""
+    return [[os.path.abspath(p), os.path.getsize(p), os.path.getmtime(p)]
+            for p in paths]
+
+
+def _write_test_geotiff(path, data, lon_left, lat_top, step, tile=None):
+    """Write an uncompressed float32 little-endian GeoTIFF (PixelIsArea)."""
+    height, width = data.shape
+    data = np.ascontiguousarray(data, dtype='<f4')
+    if tile:
+        across, down = -(-width // tile), -(-height // tile)
+        blocks = []
+        for br in range(down):
+            for bc in range(across):
+                block = np.zeros((tile, tile), dtype='<f4')
+                part = data[br * tile:(br + 1) * tile, bc * tile:(bc + 1) * tile]
+                block[:part.shape[0], :part.shape[1]] = part
+                blocks.append(block.tobytes())
+    else:
+        # One strip per 3 rows, so the strips are laid out non-contiguously below
+        blocks = [data[r:r + 3].tobytes() for r in range(0, height, 3)]
+    entries = [(256, 4, [width]), (257, 4, [height]), (258, 3, [32]), (259, 3, [1]),
+               (277, 3, [1]), (339, 3, [3]),
+               (33550, 12, [step, step, 0.0]),
+               (33922, 12, [0.0, 0.0, 0.0, lon_left, lat_top, 0.0]),
+               (42113, 2, b'-9999\0')]
+    if tile:
+        entries += [(322, 3, [tile]), (323, 3, [tile])]
+        offset_tag, count_tag = 324, 325
+    else:
+        entries += [(278, 3, [3])]
+        offset_tag, count_tag = 273, 279
+
+    header = 8
+    ifd_size = 2 + 12 * (len(entries) + 2) + 4
+    extra = bytearray()
+    data_start = header + ifd_size + 1024
+    offsets, pos = [], data_start
+    for block in blocks:
+        offsets.append(pos)
+        pos += len(block) + 16  # gaps between blocks
+    entries += [(offset_tag, 4, offsets), (count_tag, 4, [len(b) for b in blocks])]
+    entries.sort()
+
+    ifd = struct.pack('<H', len(entries))
+    for tag, ftype, values in entries:
+        code = _TYPES[ftype]
+        payload = values if code == 's' else struct.pack('<' + code * len(values), *values)
+        n = len(values)
+        if len(payload) <= 4:
+            ifd += struct.pack('<HHI', tag, ftype, n) + payload.ljust(4, b'\0')
+        else:
+            ifd += struct.pack('<HHII', tag, ftype, n, header + ifd_size + len(extra))
+            extra += payload
+    ifd += struct.pack('<I', 0)
+    with open(path, 'wb') as f:
+        f.write(b'II' + struct.pack('<HI', 42, header))
+        f.write(ifd)
+        f.write(bytes(extra).ljust(1024, b'\0'))
+        for block in blocks:
+            f.write(block + b'\0' * 16)
+
+
+def check_fabricated():
+    """
+    Load fabricated .hgt and GeoTIFF tiles holding the plane
+    elevation = 1000*(lon + 119) + 500*(lat - 36) and compare against it.
+    """
+    def plane(lon, lat):
+        return 1000.0 * (lon + 119) + 500.0 * (lat - 36)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        # Two adjacent 121x121 .hgt tiles (0.5' spacing) with one void
+        size = 121
+        step = 1.0 / (size - 1)
+        paths = []
+        for name, lon, lat in [('N36W119.hgt', -119, 36), ('N36W118.hgt', -118, 36)]:
+            lons = lon + np.arange(size) * step
+            lats = lat + 1 - np.arange(size) * step
+            tile = np.rint(plane(lons[np.newaxis, :], lats[:, np.newaxis])).astype('>i2')
+            tile[60, 60] = HGT_NODATA
+            path = os.path.join(tmp, name)
+            tile.tofile(path)
+            paths.append(path)
+        extent = (-118.6, -117.4, 36.2, 36.8)
+        elevation = load_dem(paths, extent, 40, 30)
+        x, y = np.linspace(-118.6, -117.4, 40), np.linspace(36.2, 36.8, 30)
+        results['hgt mosaic'] = float(np.abs(elevation - plane(x, y[:, np.newaxis])).max())
+
+        # Upsampled crop (finer than the source grid) falls back to nearest pixels
+        elevation = load_dem(paths, (-118.1, -117.9, 36.4, 36.5), 101, 51)
+        x, y = np.linspace(-118.1, -117.9, 101), np.linspace(36.4, 36.5, 51)
+        results['hgt upsampled'] = float(np.abs(elevation - plane(x, y[:, np.newaxis])).max())
+
+        # Tiled and non-contiguous stripped GeoTIFFs, 0.01 degree pixels
+        step = 0.01
+        lons = -118.5 + (np.arange(70) + 0.5) * step
+        lats = 37.0 - (np.arange(50) + 0.5) * step
+        data = plane(lons[np.newaxis, :], lats[:, np.newaxis]).astype(np.float32)
+        for label, tile in [('geotiff tiled', 16), ('geotiff strips', None)]:
+            path = os.path.join(tmp, f"{label.replace(' ', '_')}.tif")
+            _write_test_geotiff(path, data, -118.5, 37.0, step, tile=tile)
+            extent = (-118.4, -118.0, 36.6, 36.9)
+            elevation = load_dem([path], extent, 20, 15)
+            x, y = np.linspace(-118.4, -118.0, 20), np.linspace(36.6, 36.9, 15)
+            results[label] = float(np.abs(elevation - plane(x, y[:, np.newaxis])).max())
+
+    # Block means of a plane equal the plane at the cell center up to the
+    # rounding to int16 and the cell-center offsets of the source pixels
+    for label, err in results.items():
+        if not err < 10:
+            raise AssertionError(f"{label}: max error {err:g} m")
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('paths', nargs='*', help='.hgt or GeoTIFF files')
+    parser.add_argument('--check', action='store_true',
+                        help='verify loading against fabricated tiles')
+    parser.add_argument('--resolution', type=int, nargs=2, default=(360, 400),
+                        metavar=('NX', 'NY'))
+    args = parser.parse_args()
+
+    if args.check:
+        for label, err in check_fabricated().items():
+            print(f"{label:15s} max |error| = {err:.2f} m")
+    elif args.paths:
+        from dem import EXTENT
+        elevation = load_dem(args.paths, EXTENT, *args.resolution)
+        print(f"Loaded {len(args.paths)} file(s): {np.isnan(elevation).mean():.1%} "
+              f"no data, elevation {np.nanmin(elevation):.0f}..{np.nanmax(elevation):.0f} m")
+    else:
+        parser.print_help()
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+Tiled, multi-process terrain and hillshade generation for high-resolution basemaps.
+
+The lon/lat extent is split into tiles that are built independently in a
+process pool. Each worker evaluates the landforms (dem.build_dem with a
+window) on its tile plus a halo wide enough for the smoothing filter and the
+hillshade gradient, smooths them, adds the procedural texture (which is keyed
+by lon/lat and needs no halo), then writes only
+the tile interior into shared .npy memmaps. Memory per worker therefore
+depends on the tile size, not the map size, and the stitched result matches
+terrain_window() evaluated on the whole grid.
+
+The hillshade (shading.py) uses the same contrast stretch as matplotlib's
+LightSource.hillshade, which depends on the global intensity range, so raw
+intensities are written per tile and normalized in a second chunked pass.
+"""
+
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import dem
+from shading import raw_intensity, row_chunks, stretch
+
+# Gaussian kernels are truncated at truncate * sigma (scipy's default)
+GAUSSIAN_TRUNCATE = 4.0
+
+DEFAULT_TILE = 1024
+
+
+def filter_radius(sigma, truncate=GAUSSIAN_TRUNCATE):
+    """Kernel radius in pixels of scipy's gaussian_filter for this sigma."""
+    return int(truncate * float(sigma) + 0.5)
+
+
+def terrain_halo():
+    """Halo in pixels needed so tile interiors (and their gradients) are exact."""
+    return filter_radius(dem.SMOOTH_SIGMA) + 1
+
+
+def terrain_window(extent, nx, ny, rows, cols, seed=dem.TEXTURE_SEED):
+    """
+    Smoothed, textured float32 terrain on a window of the (ny, nx) grid.
+
+    Values within the smoothing radius of window edges that are not map
+    edges are affected by the filter boundary; callers pad the window by
+    terrain_halo() and crop.
+    """
+    return dem.build_terrain(extent, nx, ny, low_memory=True, seed=seed,
+                             window=(rows, cols))
+
+
+def tile_windows(nx, ny, tile=DEFAULT_TILE):
+    """Yield (rows, cols) slices covering the grid in tile x tile blocks."""
+    for r0 in range(0, ny, tile):
+        for c0 in range(0, nx, tile):
+            yield slice(r0, min(r0 + tile, ny)), slice(c0, min(c0 + tile, nx))
+
+
+def _pad(s, halo, n):
+    return slice(max(0, s.start - halo), min(n, s.stop + halo))
+
+
+def _build_tile(job):
+    """Worker: build one tile into the shared memmaps, return its intensity range."""
+    (extent, nx, ny, rows, cols, seed, elev_path, shade_path, light) = job
+    halo = terrain_halo()
+    prows, pcols = _pad(rows, halo, ny), _pad(cols, halo, nx)
+    elevation = terrain_window(extent, nx, ny, prows, pcols, seed)
+    inner = (slice(rows.start - prows.start, rows.stop - prows.start),
+             slice(cols.start - pcols.start, cols.stop - pcols.start))
+
+    out = np.load(elev_path, mmap_mode='r+')
+    out[rows, cols] = elevation[inner]
+    out.flush()
+    del out
+
+    if shade_path is None:
+        return None
+    intensity = raw_intensity(elevation, **light)[inner]
+    out = np.load(shade_path, mmap_mode='r+')
+    out[rows, cols] = intensity
+    out.flush()
+    return float(intensity.min()), float(intensity.max())
+
+
+def normalize_hillshade(path, imin, imax, fraction=1.0, chunk_rows=1024):
+    """Apply LightSource's contrast stretch to a memmapped hillshade."""
+    shade = np.load(path, mmap_mode='r+')
+    for r0, r1 in row_chunks(shade.shape[0], chunk_rows):
+        stretch(shade[r0:r1], imin, imax, fraction)
+    shade.flush()
+
+
+def build_tiled(extent, nx, ny, out_dir, tile=DEFAULT_TILE, workers=None,
+                seed=dem.TEXTURE_SEED, light=None):
+    """
+    Build terrain (and optionally hillshade) tile by tile in a process pool.
+
+    light is None or a dict(azdeg=, altdeg=, vert_exag=, dx=, dy=) for the
+    hillshade. Returns (elevation, hillshade) as read-only memmaps of
+    float32 .npy files in out_dir; hillshade is None without light.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    elev_path = os.path.join(out_dir, 'elevation.npy')
+    np.lib.format.open_memmap(elev_path, mode='w+', dtype=np.float32, shape=(ny, nx)).flush()
+    shade_path = None
+    if light is not None:
+        shade_path = os.path.join(out_dir, 'hillshade.npy')
+        np.lib.format.open_memmap(shade_path, mode='w+', dtype=np.float32, shape=(ny, nx)).flush()
+
+    jobs = [(extent, nx, ny, rows, cols, seed, elev_path, shade_path, light)
+            for rows, cols in tile_windows(nx, ny, tile)]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        ranges = list(pool.map(_build_tile, jobs))
+
+    hillshade = None
+    if light is not None:
+        imin = min(lo for lo, _ in ranges)
+        imax = max(hi for _, hi in ranges)
+        normalize_hillshade(shade_path, imin, imax)
+        hillshade = np.load(shade_path, mmap_mode='r')
+    return np.load(elev_path, mmap_mode='r'), hillshade
+
+
+def check_stitching(out_dir, nx=900, ny=700, tile=256, workers=2):
+    """Compare a tiled build against terrain_window() on the whole grid."""
+    light = dict(azdeg=315, altdeg=35, vert_exag=2)
+    elevation, hillshade = build_tiled(dem.EXTENT, nx, ny, out_dir, tile=tile,
+                                       workers=workers, light=light)
+    full = terrain_window(dem.EXTENT, nx, ny, slice(0, ny), slice(0, nx))
+    intensity = raw_intensity(full, **light)
+    shade_ref = np.clip((intensity - intensity.min())
+                                      / (intensity.max() - intensity.min()), 0, 1)
+    elev_err = float(np.abs(elevation - full).max())
+    shade_err = float(np.abs(hillshade - shade_ref).max())
+    # Tiles see the same inputs as the whole grid, so elevation is exact;
+    # the hillshade stretch runs in chunks and is allowed float rounding
+    if not (np.array_equal(elevation, full)
+            and np.allclose(hillshade, shade_ref, rtol=0, atol=1e-7)):
+        raise AssertionError(f"Tiled result differs from single array: "
+                             f"elevation {elev_err:g} m, hillshade {shade_err:g}")
+    return elev_err, shade_err
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('out_dir', help='directory for elevation.npy / hillshade.npy')
+    parser.add_argument('--nx', type=int, default=8000)
+    parser.add_argument('--ny', type=int, default=8000)
+    parser.add_argument('--tile', type=int, default=DEFAULT_TILE)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=dem.TEXTURE_SEED)
+    parser.add_argument('--check', action='store_true',
+                        help='verify tiles stitch to the single-array result')
+    args = parser.parse_args()
+
+    if args.check:
+        elev_err, shade_err = check_stitching(args.out_dir)
+        print(f"Tiled vs single array: max |d elevation| = {elev_err:g} m, "
+              f"max |d hillshade| = {shade_err:g}")
+    else:
+        start = time.perf_counter()
+        build_tiled(dem.EXTENT, args.nx, args.ny, args.out_dir, tile=args.tile,
+                    workers=args.workers, seed=args.seed,
+                    light=dict(azdeg=315, altdeg=35, vert_exag=2))
+        elapsed = time.perf_counter() - start
+        print(f"Built {args.nx}x{args.ny} terrain + hillshade in {elapsed:.1f} s "
+              f"({args.nx * args.ny / elapsed / 1e6:.1f} Mpx/s) -> {args.out_dir}")
@@ -0,0 +1,518 @@
+#!/usr/bin/env python3
+"""
+Download the public-domain source documents listed in downloads.json.
+
+Each manifest entry gives a URL, a destination under figures/ and, where
+known, the expected SHA-256. Files are fetched concurrently by a bounded
+pool of workers, with at most --per-host connections to one host. A slow
+or failing host only delays its own files, and failures are reported at
+the end instead of aborting the run.
+
+When a file is skipped or re-fetched:
+- A file that already matches its SHA-256 is skipped without a request.
+- A file fetched before without a known checksum is re-requested
+  conditionally, with If-None-Match (its ETag) and If-Modified-Since (its
+  Last-Modified). A 304 keeps it.
+- Downloads stream into <dest>.part. An interrupted one resumes from there
+  with a Range request, guarded by If-Range so a changed file restarts.
+- Timeouts, resets, 429 and 5xx responses are retried with exponential
+  backoff and jitter, resuming the partial file.
+
+A finished file is checked against its SHA-256. A .pdf must also start with
+the PDF header; some servers answer with an HTML error page and a 200. Only
+a file that passes replaces the destination.
+
+ETags, Last-Modified dates and file hashes are kept in .download_state.json.
+Run `python download.py --check` to exercise all of this against a local
+HTTP server stand-in.
+"""
+
+import argparse
+import datetime
+import email.utils
+import hashlib
+import http.client
+import http.server
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+FIGURES_DIR = os.path.dirname(os.path.abspath(__file__))
+MANIFEST_PATH = os.path.join(FIGURES_DIR, 'downloads.json')
+STATE_PATH = os.path.join(FIGURES_DIR, '.download_state.json')
+
+DEFAULT_JOBS = 4
+DEFAULT_PER_HOST = 2
+DEFAULT_RETRIES = 4
+TIMEOUT_SECONDS = 30
+
+# Exponential backoff: BACKOFF_SECONDS * 2**attempt, capped, times a random
+# factor in [0.5, 1) so retries against one host spread out
+BACKOFF_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 30.0
+
+BLOCK_SIZE = 1 << 16
+USER_AGENT = 'saline-valley-figures-download/1.0'
+
+# HTTP statuses worth retrying
+RETRY_STATUSES = {408, 425, 429, 500, 502, 503, 504}
+
+# Leading bytes a downloaded file must start with, by destination extension
+MAGIC = {'.pdf': b'%PDF-'}
+
+
+class _Transient(Exception):
+    """A failure worth retrying; retry_after is the server's Retry-After in seconds."""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def sha256_file(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def load_manifest(path=MANIFEST_PATH):
+    with open(path, encoding='utf-8') as f:
+        manifest = json.load(f)
+    dests = [entry['dest'] for entry in manifest['files']]
+    if len(set(dests)) != len(dests):
+        raise ValueError(f"{path}: duplicate destinations")
+    return manifest
+
+
+def load_state(path=STATE_PATH):
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def save_state(state, path=STATE_PATH):
+    tmp = f'{path}.tmp-{os.getpid()}'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(state, f, indent=1, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def _retry_after(headers):
+    """
+    Seconds to wait from a Retry-After header (delay or HTTP date), or None
+    when it is missing or unparsable, which falls back to the usual backoff.
+    """
+    value = headers.get('Retry-After') if headers else None
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        # HTTP dates are always GMT
+        when = when.replace(tzinfo=datetime.timezone.utc)
+    return max(0.0, when.timestamp() - time.time())
+
+
+class Downloader:
+    """Fetch manifest entries into root, sharing validators through state."""
+
+    def __init__(self, root=FIGURES_DIR, state=None, jobs=DEFAULT_JOBS,
+                 per_host=DEFAULT_PER_HOST, retries=DEFAULT_RETRIES,
+                 timeout=TIMEOUT_SECONDS, backoff=BACKOFF_SECONDS, force=False, log=print):
+        self.root = root
+        self.state = {} if state is None else state
+        self.jobs = jobs
+        self.per_host = per_host
+        self.retries = retries
+        self.timeout = timeout
+        self.backoff = backoff
+        self.force = force
+        self.log = log
+        self._lock = threading.Lock()
+        self._hosts = {}
+
+    def _host_slot(self, url):
+        host = urllib.parse.urlsplit(url).netloc
+        with self._lock:
+            return self._hosts.setdefault(host, threading.BoundedSemaphore(self.per_host))
+
+    def _record(self, dest, **fields):
+        with self._lock:
+            self.state.setdefault(dest, {}).update(fields)
+
+    def _digest(self, entry, path):
+        """SHA-256 of the file at path, reusing the recorded one if size and mtime match."""
+        st = os.stat(path)
+        recorded = self.state.get(entry['dest'], {})
+        if recorded.get('stat') == [st.st_size, st.st_mtime_ns] and recorded.get('sha256'):
+            return recorded['sha256']
+        digest = sha256_file(path)
+        self._record(entry['dest'], sha256=digest, stat=[st.st_size, st.st_mtime_ns])
+        return digest
+
+    def fetch(self, entry):
+        """Bring one entry up to date; returns a status line. Raises on permanent failure."""
+        path = os.path.join(self.root, entry['dest'])
+        expected = entry.get('sha256')
+        if not self.force and os.path.exists(path) and expected:
+            if self._digest(entry, path) == expected:
+                return 'up to date (checksum)'
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        slot = self._host_slot(entry['url'])
+        for attempt in range(self.retries + 1):
+            try:
+                with slot:
+                    return self._attempt(entry, path)
+            except _Transient as e:
+                if attempt == self.retries:
+                    raise RuntimeError(f"{e} (gave up after {attempt + 1} attempts)") from e
+                delay = e.retry_after
+                if delay is None:
+                    delay = (min(BACKOFF_MAX_SECONDS, self.backoff * 2**attempt)
+                             * random.uniform(0.5, 1))
+                self.log(f"retry  {entry['dest']} in {delay:.1f} s: {e}")
+                time.sleep(delay)
+
+    def _attempt(self, entry, path):
+        url, dest, expected = entry['url'], entry['dest'], entry.get('sha256')
+        part = path + '.part'
+        recorded = self.state.get(dest, {})
+        headers = {'User-Agent': USER_AGENT}
+
+        # Resume a partial file only if a validator can confirm it is the same version
+        offset = 0
+        part_validator = recorded.get('part_etag') or recorded.get('part_last_modified')
+        if os.path.exists(part) and part_validator:
+            offset = os.path.getsize(part)
+        if offset:
+            headers['Range'] = f'bytes={offset}-'
+            headers['If-Range'] = part_validator
+        elif (os.path.exists(path) and not self.force and not expected
+              and recorded.get('url') == url):
+            if recorded.get('etag'):
+                headers['If-None-Match'] = recorded['etag']
+            if recorded.get('last_modified'):
+                headers['If-Modified-Since'] = recorded['last_modified']
+
+        start = time.perf_counter()
+        try:
+            response = urllib.request.urlopen(urllib.request.Request(url, headers=headers),
+                                              timeout=self.timeout)
+        except urllib.error.HTTPError as e:
+            if e.code == 304:
+                return 'not modified'
+            if e.code == 416:
+                # The partial file no longer fits the remote one
+                os.remove(part)
+                raise _Transient("range not satisfiable; restarting") from e
+            if e.code in RETRY_STATUSES:
+                raise _Transient(f"HTTP {e.code} {e.reason}", _retry_after(e.headers)) from e
+            raise RuntimeError(f"HTTP {e.code} {e.reason}") from e
+        except (urllib.error.URLError, http.client.HTTPException, OSError) as e:
+            raise _Transient(str(getattr(e, 'reason', e))) from e
+
+        with response:
+            etag = response.headers.get('ETag')
+            last_modified = response.headers.get('Last-Modified')
+            if response.status == 206:
+                content_range = response.headers.get('Content-Range', '')
+                if not content_range.startswith(f'bytes {offset}-'):
+                    os.remove(part)
+                    raise _Transient(f"unexpected Content-Range '{content_range}'; restarting")
+            else:
+                offset = 0
+            self._record(dest, part_etag=etag, part_last_modified=last_modified)
+            length = response.headers.get('Content-Length')
+            total = offset + int(length) if length is not None else None
+
+            h = hashlib.sha256()
+            if offset:
+                with open(part, 'rb') as f:
+                    for block in iter(lambda: f.read(1 << 20), b''):
+                        h.update(block)
+            with open(part, 'ab' if offset else 'wb') as f:
+                try:
+                    for block in iter(lambda: response.read(BLOCK_SIZE), b''):
+                        f.write(block)
+                        h.update(block)
+                except (http.client.HTTPException, OSError) as e:
+                    raise _Transient(f"interrupted after {f.tell()} bytes: {e}") from e
+                size = f.tell()
+            if total is not None and size != total:
+                raise _Transient(f"connection closed after {size} of {total} bytes")
+            content_type = response.headers.get('Content-Type', 'unknown')
+
+        magic = MAGIC.get(os.path.splitext(path)[1].lower())
+        if magic:
+            with open(part, 'rb') as f:
+                head = f.read(len(magic))
+            if head != magic:
+                os.remove(part)
+                raise ValueError(f"not a {magic.decode().strip('%-')} file "
+                                 f"(Content-Type {content_type})")
+        digest = h.hexdigest()
+        if expected and digest != expected:
+            os.remove(part)
+            raise ValueError(f"SHA-256 mismatch: got {digest}, expected {expected}")
+        os.replace(part, path)
+        st = os.stat(path)
+        with self._lock:
+            self.state[dest] = dict(url=url, etag=etag, last_modified=last_modified,
+                                    sha256=digest, stat=[st.st_size, st.st_mtime_ns])
+        seconds = time.perf_counter() - start
+        how = f"resumed at {offset} bytes" if offset else 'downloaded'
+        return f"{how}, {size / 1e6:.1f} MB in {seconds:.1f} s"
+
+    def run(self, entries):
+        """Fetch entries concurrently. Returns ({dest: status}, {dest: error})."""
+        # Interleave hosts so waiting on one host's slots doesn't idle the pool
+        by_host = {}
+        for entry in entries:
+            by_host.setdefault(urllib.parse.urlsplit(entry['url']).netloc, []).append(entry)
+        queues = list(by_host.values())
+        ordered = [q[i] for i in range(max(map(len, queues), default=0))
+                   for q in queues if i < len(q)]
+
+        done, failed = {}, {}
+        with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+            futures = {entry['dest']: pool.submit(self.fetch, entry) for entry in ordered}
+            for entry in entries:
+                dest = entry['dest']
+                try:
+                    done[dest] = futures[dest].result()
+                except (RuntimeError, ValueError, OSError) as e:
+                    failed[dest] = str(e)
+                    self.log(f"FAILED {dest}: {e}")
+                else:
+                    self.log(f"ok     {dest}: {done[dest]}")
+        return done, failed
+
+
+def record_checksums(manifest_path, digests):
+    """
+    Fill in "sha256": null entries of the manifest in place, keeping its
+    layout. Entries without a null slot are left alone. Returns the
+    destinations whose checksum was recorded.
+    """
+    with open(manifest_path, encoding='utf-8') as f:
+        text = f.read()
+    recorded = []
+    for dest, digest in digests.items():
+        start = text.find(json.dumps(dest))
+        slot = text.find('"sha256": null', start)
+        if start < 0 or slot < 0 or slot > text.find('}', start):
+            continue
+        text = text[:slot] + f'"sha256": "{digest}"' + text[slot + len('"sha256": null'):]
+        recorded.append(dest)
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    return recorded
+
+
+# --- Local HTTP stand-in for --check -------------------------------------------
+
+class _StandInHandler(http.server.BaseHTTPRequestHandler):
+    """Static files with ETag/Last-Modified, conditional and Range requests, and faults."""
+
+    files = {}
+    faults = {}
+    requests = []
+    last_modified = email.utils.formatdate(0, usegmt=True)
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        type(self).requests.append((self.path, dict(self.headers)))
+        body = self.files.get(self.path)
+        if body is None:
+            self.send_error(404)
+            return
+        fault = self.faults.get(self.path, []).pop(0) if self.faults.get(self.path) else None
+        if fault == 'unavailable':
+            self.send_response(503)
+            self.send_header('Retry-After', '0')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        if fault == 'html':
+            body = b'<!DOCTYPE html><html><body>Service moved</body></html>'
+        start = 0
+        range_header = self.headers.get('Range')
+        if range_header and self.headers.get('If-Range') in (etag, self.last_modified):
+            start = int(range_header.split('=')[1].split('-')[0])
+        self.send_response(206 if start else 200)
+        if start:
+            self.send_header('Content-Range', f'bytes {start}-{len(body) - 1}/{len(body)}')
+        self.send_header('Content-Type', 'text/html' if fault == 'html' else 'application/pdf')
+        self.send_header('Content-Length', str(len(body) - start))
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', self.last_modified)
+        self.end_headers()
+        if fault == 'truncate':
+            self.wfile.write(body[start:start + (len(body) - start) // 2])
+            self.close_connection = True
+            return
+        self.wfile.write(body[start:])
+
+
+def check():
+    """Exercise retries, resume, checksum and conditional skips against a local server."""
+    rng = random.Random(0)
+    files = {f'/{name}.pdf': b'%PDF-1.4\n' + rng.randbytes(300_000)
+             for name in ('plain', 'flaky', 'truncated', 'html', 'corrupt', 'unhashed')}
+    handler = _StandInHandler
+    handler.files = files
+    handler.faults = {'/flaky.pdf': ['unavailable'], '/truncated.pdf': ['truncate'],
+                      '/html.pdf': ['html']}
+    handler.requests = []
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f'http://127.0.0.1:{server.server_address[1]}'
+
+    def entry(name, sha256=True):
+        body = files[f'/{name}.pdf']
+        digest = hashlib.sha256(body).hexdigest() if sha256 else None
+        if name == 'corrupt':
+            digest = '0' * 64
+        return dict(dest=f'docs/{name}.pdf', url=f'{base}/{name}.pdf', sha256=digest)
+
+    entries = [entry(name) for name in ('plain', 'flaky', 'truncated', 'html', 'corrupt')]
+    entries.append(entry('unhashed', sha256=False))
+    quiet = lambda *args: None
+    try:
+        with tempfile.TemporaryDirectory() as root:
+            state = {}
+            done, failed = Downloader(root, state, backoff=0.01, log=quiet).run(entries)
+            assert set(failed) == {'docs/html.pdf', 'docs/corrupt.pdf'}, failed
+            assert 'not a PDF' in failed['docs/html.pdf'], failed
+            assert 'SHA-256 mismatch' in failed['docs/corrupt.pdf'], failed
+            for name in ('plain', 'flaky', 'truncated', 'unhashed'):
+                with open(os.path.join(root, 'docs', f'{name}.pdf'), 'rb') as f:
+                    assert f.read() == files[f'/{name}.pdf'], name
+            assert done['docs/truncated.pdf'].startswith('resumed at 150'), done
+            ranges = [h for p, h in handler.requests if p == '/truncated.pdf' and 'Range' in h]
+            assert ranges, "the truncated download was not resumed with Range"
+            flaky = [p for p, _ in handler.requests if p == '/flaky.pdf']
+            assert len(flaky) == 2, flaky
+            print(f"First run: {len(done)} downloaded (one retried after a 503, "
+                  f"one resumed with Range), {len(failed)} rejected "
+                  f"(HTML error page, checksum mismatch)")
+
+            handler.requests = []
+            done, failed = Downloader(root, state, log=quiet).run(
+                [e for e in entries if e['dest'] in done])
+            assert not failed, failed
+            paths = [p for p, _ in handler.requests]
+            assert paths == ['/unhashed.pdf'], paths
+            assert 'If-None-Match' in handler.requests[0][1]
+            assert done['docs/unhashed.pdf'] == 'not modified', done
+            print(f"Second run: {sum(s.startswith('up to date') for s in done.values())} "
+                  f"skipped by checksum with no request, 1 by ETag (304)")
+
+            # Only null slots are filled; entries already hashed or without
+            # the key are skipped
+            manifest_path = os.path.join(root, 'downloads.json')
+            listed = [dict(dest='docs/a.pdf', sha256='1' * 64), dict(dest='docs/b.pdf'),
+                      dict(dest='docs/c.pdf', sha256=None)]
+            with open(manifest_path, 'w', encoding='utf-8') as f:
+                json.dump({'files': listed}, f, indent=2)
+            recorded = record_checksums(manifest_path, {e['dest']: '2' * 64 for e in listed})
+            assert recorded == ['docs/c.pdf'], recorded
+            sums = [e.get('sha256') for e in load_manifest(manifest_path)['files']]
+            assert sums == ['1' * 64, None, '2' * 64], sums
+            print("Checksums recorded only into null slots")
+    finally:
+        server.shutdown()
+
+    # Retry-After: delays, GMT dates, dates without a zone (read as GMT) and
+    # garbage, which falls back to the usual backoff
+    later = time.time() + 120
+    for value, expected in [('30', 30), (email.utils.formatdate(later, usegmt=True), 120),
+                            (time.strftime('%a, %d %b %Y %H:%M:%S', time.gmtime(later)), 120),
+                            ('soon', None), ('Fri, 99 Foo 2026', None)]:
+        got = _retry_after({'Retry-After': value})
+        assert (got is None if expected is None
+                else got is not None and abs(got - expected) < 5), (value, got)
+    print("Retry-After parsed, unparsable values fall back to backoff")
+    print("Downloader check passed")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('files', nargs='*',
+                        help='destinations or file names to fetch (default: all)')
+    parser.add_argument('--manifest', default=MANIFEST_PATH)
+    parser.add_argument('-j', '--jobs', type=int, default=DEFAULT_JOBS,
+                        help='concurrent downloads')
+    parser.add_argument('--per-host', type=int, default=DEFAULT_PER_HOST,
+                        help='concurrent downloads from one host')
+    parser.add_argument('--retries', type=int, default=DEFAULT_RETRIES)
+    parser.add_argument('--timeout', type=float, default=TIMEOUT_SECONDS,
+                        help='seconds without data before a connection counts as failed')
+    parser.add_argument('--force', action='store_true',
+                        help='download even if the files are up to date')
+    parser.add_argument('--record-checksums', action='store_true',
+                        help='write the SHA-256 of files without one into the manifest')
+    parser.add_argument('--check', action='store_true',
+                        help='test the downloader against a local HTTP server')
+    args = parser.parse_args()
+
+    if args.check:
+        check()
+        sys.exit(0)
+
+    manifest = load_manifest(args.manifest)
+    entries = manifest['files']
+    if args.files:
+        entries = [e for e in entries
+                   if e['dest'] in args.files or os.path.basename(e['dest']) in args.files]
+        if not entries:
+            parser.error(f"no manifest entries match {args.files}")
+
+    state = load_state()
+    start = time.perf_counter()
+    downloader = Downloader(FIGURES_DIR, state, args.jobs, args.per_host, args.retries,
+                            args.timeout, force=args.force)
+    try:
+        done, failed = downloader.run(entries)
+    finally:
+        save_state(state)
+    if args.record_checksums:
+        new = {e['dest']: state[e['dest']]['sha256'] for e in entries
+               if not e.get('sha256') and e['dest'] in done}
+        recorded = record_checksums(args.manifest, new)
+        print(f"Recorded {len(recorded)} checksums in {args.manifest}")
+    print(f"{len(done)} up to date, {len(failed)} failed in "
+          f"{time.perf_counter() - start:.1f} s")
+
+    if manifest.get('manual') and not args.files:
+        print("\nThese resources need a manual download or have usage restrictions:")
+        for item in manifest['manual']:
+            print(f"  {item['title']}: {item['url']}")
+            for note in item['notes']:
+                print(f"    - {note}")
+    sys.exit(1 if failed else 0)
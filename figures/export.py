@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""
+Render-once, multi-format figure export for the map scripts.
+
+savefig(..., bbox_inches='tight') draws the figure once to measure it and
+again to write it, for every file. Here the tight bounding box is measured
+once per dpi (text extents depend on it) with drawing disabled, as savefig
+does, and reused for every format. Raster formats (PNG, WebP) are drawn with Agg
+once per dpi and that pixel buffer is encoded to every raster format, with
+the encoders running in threads. Vector formats (PDF, SVG) each need their
+own backend, so the figure is pickled once and they are written in worker
+processes.
+
+Files are written as <out_dir>/<name>.<ext> at the first dpi, and as
+<name>@<dpi>dpi.<ext> for any further raster dpi.
+"""
+
+import argparse
+import io
+import math
+import os
+import pickle
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import matplotlib
+import matplotlib.pyplot as plt
+from PIL import Image
+
+from profiling import stage, staged
+
+DEFAULT_OUTPUT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'maps')
+DEFAULT_FORMATS = ('pdf', 'png')
+DEFAULT_DPI = (300,)
+
+RASTER_FORMATS = ('png', 'webp')
+VECTOR_FORMATS = ('pdf', 'svg')
+
+# savefig's default padding around the tight bounding box, in inches
+TIGHT_PAD_INCHES = 0.1
+
+WEBP_QUALITY = 90
+
+
+def add_export_arguments(parser):
+    """Add --output-dir, --formats, --dpi and --export-workers to a script's parser."""
+    parser.add_argument('--output-dir', default=DEFAULT_OUTPUT_DIR,
+                        help='directory for the exported figures')
+    parser.add_argument('--formats', nargs='+', default=list(DEFAULT_FORMATS),
+                        choices=RASTER_FORMATS + VECTOR_FORMATS)
+    parser.add_argument('--dpi', type=int, nargs='+', default=list(DEFAULT_DPI),
+                        help='raster resolutions; the first is also used for vector output')
+    parser.add_argument('--export-workers', type=int, default=None,
+                        help='processes for vector formats '
+                             '(default: one per format; 0 to write them in this process)')
+    return parser
+
+
+def output_path(out_dir, name, fmt, dpi, primary_dpi):
+    suffix = '' if dpi == primary_dpi else f'@{dpi}dpi'
+    return os.path.join(out_dir, f'{name}{suffix}.{fmt}')
+
+
+@staged('export.tight_bbox')
+def tight_bbox(fig, dpi=None, pad_inches=TIGHT_PAD_INCHES):
+    """
+    Tight bounding box in inches as savefig(bbox_inches='tight', dpi=dpi)
+    measures it (default: at the figure's dpi).
+    """
+    saved_dpi = fig.dpi
+    if dpi is not None:
+        fig.set_dpi(dpi)
+    try:
+        renderer = fig.canvas.get_renderer()
+        # The layout pass savefig makes before measuring, without rasterizing
+        with getattr(renderer, '_draw_disabled', nullcontext)():
+            fig.draw(renderer)
+        return fig.get_tightbbox(renderer).padded(pad_inches)
+    finally:
+        fig.set_dpi(saved_dpi)
+
+
+def render_rgba(fig, dpi, bbox):
+    """Draw the figure once with Agg, cropped to bbox, and return an RGBA image."""
+    buf = io.BytesIO()
+    with stage(f'export.render.{dpi}dpi'):
+        fig.savefig(buf, format='rgba', dpi=dpi, bbox_inches=bbox)
+    # The canvas size is bbox * dpi truncated after floating-point rounding,
+    # so take whichever neighbouring integer size matches the buffer
+    n_pixels = len(buf.getbuffer()) // 4
+    sizes = [(w, h) for w in {math.floor(bbox.width * dpi), math.ceil(bbox.width * dpi)}
+             for h in {math.floor(bbox.height * dpi), math.ceil(bbox.height * dpi)}
+             if w * h == n_pixels]
+    if len(sizes) != 1:
+        raise ValueError(f"Cannot infer the Agg buffer size at {dpi} dpi for {bbox}")
+    width, height = sizes[0]
+    return Image.frombuffer('RGBA', (width, height), buf.getbuffer(), 'raw', 'RGBA', 0, 1)
+
+
+def encode_image(image, path, fmt, dpi):
+    """Write a PIL image as PNG or WebP."""
+    if fmt == 'png':
+        image.save(path, format='PNG', dpi=(dpi, dpi))
+    elif fmt == 'webp':
+        image.save(path, format='WEBP', quality=WEBP_QUALITY, method=4)
+    return path
+
+
+def _save_vector(job):
+    """Worker: unpickle the figure and write one vector format."""
+    payload, path, fmt, dpi, bbox = job
+    matplotlib.use('Agg')
+    fig = pickle.loads(payload)
+    fig.savefig(path, format=fmt, dpi=dpi, bbox_inches=bbox)
+    plt.close(fig)
+    return path
+
+
+@staged('export')
+def export_figure(fig, name, out_dir=DEFAULT_OUTPUT_DIR, formats=DEFAULT_FORMATS,
+                  dpis=DEFAULT_DPI, workers=None):
+    """
+    Write fig as name.<fmt> in out_dir for each format and dpi.
+
+    The figure must already be laid out (e.g. after tight_layout). Returns
+    the paths written. Vector formats are written by worker processes
+    (default: one per format) while this process draws the raster formats;
+    workers=0 writes everything in this process.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    dpis = list(dpis)
+    primary = dpis[0]
+    raster = [f for f in formats if f in RASTER_FORMATS]
+    vector = [f for f in formats if f in VECTOR_FORMATS]
+    unknown = set(formats) - set(raster) - set(vector)
+    if unknown:
+        raise ValueError(f"Unsupported formats: {sorted(unknown)}")
+    bboxes = {dpi: tight_bbox(fig, dpi) for dpi in (dpis if raster else dpis[:1])}
+    bbox = bboxes[primary]
+
+    jobs = [(output_path(out_dir, name, fmt, primary, primary), fmt) for fmt in vector]
+    if workers is None:
+        workers = len(jobs)
+    paths = []
+    pool = payload = None
+    if workers > 0 and (len(jobs) > 1 or (jobs and raster)):
+        try:
+            payload = pickle.dumps(fig)
+        except (AttributeError, pickle.PicklingError, TypeError):
+            # e.g. lambda tick formatters; the vector formats are written here instead
+            payload = None
+    if payload is not None:
+        pool = ProcessPoolExecutor(max_workers=workers)
+        vector_futures = [pool.submit(_save_vector, (payload, path, fmt, primary, bbox))
+                          for path, fmt in jobs]
+    try:
+        with ThreadPoolExecutor(max_workers=max(len(raster), 1)) as encoders:
+            encoded = []
+            for dpi in dpis if raster else []:
+                image = render_rgba(fig, dpi, bboxes[dpi])
+                encoded += [encoders.submit(encode_image, image,
+                                            output_path(out_dir, name, fmt, dpi, primary),
+                                            fmt, dpi)
+                            for fmt in raster]
+            if pool is None:
+                for path, fmt in jobs:
+                    with stage(f'export.savefig.{fmt}'):
+                        fig.savefig(path, format=fmt, dpi=primary, bbox_inches=bbox)
+                    paths.append(path)
+            with stage('export.encode_wait'):
+                paths += [future.result() for future in encoded]
+        if pool is not None:
+            with stage('export.vector_wait'):
+                paths += [future.result() for future in vector_futures]
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    return paths
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--check', action='store_true',
+                        help='export a small test figure in every format and compare '
+                             'the PNG with savefig(bbox_inches="tight")')
+    add_export_arguments(parser)
+    args = parser.parse_args()
+
+    if args.check:
+        import tempfile
+
+        import numpy as np
+        matplotlib.use('Agg')
+        fig, ax = plt.subplots(figsize=(4, 3))
+        ax.imshow(np.random.default_rng(0).random((50, 60)), extent=(0, 6, 0, 5))
+        ax.set_title('export check')
+        plt.tight_layout()
+        with tempfile.TemporaryDirectory() as tmp:
+            paths = export_figure(fig, 'check', tmp, RASTER_FORMATS + VECTOR_FORMATS,
+                                  [300, 50], workers=args.export_workers)
+            for dpi, name in ((300, 'check.png'), (50, 'check@50dpi.png')):
+                ref = os.path.join(tmp, f'ref{dpi}.png')
+                fig.savefig(ref, dpi=dpi, bbox_inches='tight')
+                ours = np.asarray(Image.open(os.path.join(tmp, name)).convert('RGBA'))
+                theirs = np.asarray(Image.open(ref).convert('RGBA'))
+                if ours.shape != theirs.shape or not np.array_equal(ours, theirs):
+                    raise AssertionError(f"{dpi}-dpi PNG differs from savefig: "
+                                         f"{ours.shape} vs {theirs.shape}")
+            print('\n'.join(sorted(os.path.basename(p) for p in paths)))
+        print("PNGs at 300 and 50 dpi match savefig(bbox_inches='tight')")
+    else:
+        parser.print_help()
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+Static/dynamic layer split for fast re-draws of the territory maps.
+
+A map is drawn as a static background (basemap image, territory and fault
+collections, place markers, axes and graticule) plus a few dynamic artists
+(labels, highlights, occurrence points, legend, title). LayeredFigure marks
+the dynamic artists as animated, renders the static layers once with Agg,
+keeps that buffer, and for each frame restores it and draws only the dynamic
+artists on top, which is matplotlib's blitting technique applied to off-screen
+rendering. The background is redrawn only when the dpi or figure size
+changes or invalidate() is called after a static layer was edited.
+
+Run `python layers.py --benchmark` to compare a full draw with a blitted
+frame on the geo map.
+"""
+
+import argparse
+import math
+import time
+from contextlib import contextmanager
+
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+# Label given to the artists a map script draws from the territory registry,
+# so the watch mode can find and replace them (legends skip '_' labels)
+REGISTRY_LABEL = '_registry'
+
+
+def registry_layer(artists):
+    """Tag artists drawn from the territory registry; returns them."""
+    for artist in artists:
+        artist.set_label(REGISTRY_LABEL)
+    return artists
+
+
+def registry_artists(ax):
+    """Artists of ax tagged by registry_layer(), in drawing order."""
+    return [artist for artist in ax.get_children() if artist.get_label() == REGISTRY_LABEL]
+
+
+def overlying_artists(ax, artists):
+    """
+    artists plus every other artist of ax drawn above the lowest of them
+    (zorder at or above its zorder), in drawing order. Making all of these
+    dynamic keeps a blitted frame's z-order identical to a full draw.
+    """
+    lowest = min(artist.get_zorder() for artist in artists)
+    chosen = set(map(id, artists))
+    return [artist for artist in ax.get_children()
+            if artist is not ax.patch
+            and (id(artist) in chosen or artist.get_zorder() >= lowest)]
+
+
+def label_artists(ax):
+    """Text-like artists of ax (annotations, labels, legend, title) that change between variants."""
+    artists = list(ax.texts) + [ax.title]
+    if ax.get_legend() is not None:
+        artists.append(ax.get_legend())
+    return artists
+
+
+class LayeredFigure:
+    """A figure whose static layers are rendered once and re-blitted under dynamic ones."""
+
+    def __init__(self, fig, dynamic=()):
+        self.fig = fig
+        if not hasattr(fig.canvas, 'copy_from_bbox'):
+            FigureCanvasAgg(fig)
+        self.canvas = fig.canvas
+        self.dynamic = []
+        self._background = None
+        self._background_key = None
+        self.add_dynamic(*dynamic)
+
+    def add_dynamic(self, *artists):
+        """Mark artists (already added to the figure) as dynamic layers."""
+        for artist in artists:
+            artist.set_animated(True)
+            self.dynamic.append(artist)
+
+    def remove_dynamic(self, *artists):
+        """Remove dynamic artists from the figure."""
+        for artist in artists:
+            self.dynamic.remove(artist)
+            artist.remove()
+
+    @contextmanager
+    def drawn_in_full(self):
+        """Temporarily un-animate the dynamic artists, e.g. for savefig to vector formats."""
+        for artist in self.dynamic:
+            artist.set_animated(False)
+        try:
+            yield self.fig
+        finally:
+            for artist in self.dynamic:
+                artist.set_animated(True)
+
+    def invalidate(self):
+        """Forget the cached background; call after editing a static layer."""
+        self._background = None
+
+    def frame(self, dpi=None):
+        """
+        Render a frame and return the canvas RGBA buffer as an (h, w, 4) uint8 view.
+
+        The view is overwritten by the next frame; copy it to keep it.
+        """
+        if dpi is not None:
+            self.fig.set_dpi(dpi)
+        key = (self.fig.dpi, tuple(self.fig.get_size_inches()))
+        if self._background is None or key != self._background_key:
+            self.canvas.draw()
+            self._background = self.canvas.copy_from_bbox(self.fig.bbox)
+            self._background_key = key
+        else:
+            self.canvas.restore_region(self._background)
+        renderer = self.canvas.get_renderer()
+        for artist in sorted(self.dynamic, key=lambda a: a.get_zorder()):
+            if artist.get_visible():
+                artist.draw(renderer)
+        return np.asarray(self.canvas.buffer_rgba())
+
+
+def crop_pixels(bbox, dpi, height):
+    """(top, bottom, left, right) pixel slice of a figure canvas for a bbox in inches."""
+    left = max(math.floor(bbox.x0 * dpi), 0)
+    right = math.ceil(bbox.x1 * dpi)
+    top = max(height - math.ceil(bbox.y1 * dpi), 0)
+    bottom = height - math.floor(bbox.y0 * dpi)
+    return top, bottom, left, right
+
+
+def benchmark(dpi=150, frames=10):
+    """Seconds for a full draw vs a blitted frame with a changing title, on the geo map."""
+    import matplotlib
+    matplotlib.use('Agg')
+    from create_territory_map_geo import (MAP_EXTENT, add_basemap_arguments, draw_map,
+                                          load_basemap)
+    from territories import load_registry
+
+    args = add_basemap_arguments(argparse.ArgumentParser()).parse_args([])
+    shaded = load_basemap(MAP_EXTENT, args)['shaded']
+    fig, ax = draw_map(shaded, load_registry(), 'benchmark')
+    fig.set_dpi(dpi)
+
+    start = time.perf_counter()
+    for _ in range(3):
+        fig.canvas.draw()
+    full = (time.perf_counter() - start) / 3
+    reference = np.array(fig.canvas.buffer_rgba())
+
+    layered = LayeredFigure(fig, label_artists(ax))
+    first = layered.frame()
+    mismatch = np.any(first != reference, axis=-1).mean()
+    start = time.perf_counter()
+    for k in range(frames):
+        ax.title.set_text(f'frame {k}')
+        layered.frame()
+    blit = (time.perf_counter() - start) / frames
+    return full, blit, mismatch
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--benchmark', action='store_true',
+                        help='time a full draw against a blitted frame')
+    parser.add_argument('--dpi', type=int, default=150)
+    args = parser.parse_args()
+
+    if args.benchmark:
+        full, blit, mismatch = benchmark(args.dpi)
+        print(f"{args.dpi} dpi: full draw {full * 1000:.0f} ms, "
+              f"blitted frame {blit * 1000:.0f} ms ({full / blit:.0f}x); "
+              f"{mismatch:.3%} of pixels differ from the full draw")
+    else:
+        parser.print_help()
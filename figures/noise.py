@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Deterministic, seekable procedural noise for terrain texture.
+
+Value noise on a hashed lon/lat lattice: each lattice corner gets a
+pseudo-random value from a 64-bit integer hash of (seed, octave, ix, iy), and
+points in between are blended with a smoothstep. A point's value depends only
+on its own coordinates and the seed, so any tile or zoom level can be computed
+on its own and neighbouring tiles line up exactly at the seams.
+
+Only integer hashing, floor, + and * are used (no exp/sin), so the output is
+byte-identical for a given seed on any IEEE-754 platform.
+"""
+
+import argparse
+import hashlib
+
+import numpy as np
+
+_M1 = np.uint64(0xBF58476D1CE4E5B9)
+_M2 = np.uint64(0x94D049BB133111EB)
+_GOLDEN = np.uint64(0x9E3779B97F4A7C15)
+_PRIME_X = np.uint64(0x632BE59BD9B4E019)
+_PRIME_Y = np.uint64(0x85157AF5D1C5A1A9)
+
+
+def _mix(h):
+    """splitmix64 finalizer on a uint64 array."""
+    h = (h ^ (h >> np.uint64(30))) * _M1
+    h = (h ^ (h >> np.uint64(27))) * _M2
+    return h ^ (h >> np.uint64(31))
+
+
+def lattice_values(ix, iy, seed, octave=0):
+    """
+    Pseudo-random values in [-1, 1) at integer lattice points.
+
+    ix and iy are int64 arrays broadcastable against each other.
+    """
+    # uint64 arithmetic wraps modulo 2**64 by design
+    with np.errstate(over='ignore'):
+        key = _mix(np.uint64(seed) * _GOLDEN + np.uint64(octave))
+        h = _mix(key
+                 ^ (np.asarray(ix, dtype=np.int64).view(np.uint64) * _PRIME_X)
+                 ^ (np.asarray(iy, dtype=np.int64).view(np.uint64) * _PRIME_Y))
+    return (h >> np.uint64(11)).astype(np.float64) * (2.0 / 2**53) - 1.0
+
+
+def _smoothstep(t):
+    return t * t * (3.0 - 2.0 * t)
+
+
+def _lattice_coords(v, cell):
+    u = np.asarray(v, dtype=np.float64) / cell
+    i = np.floor(u)
+    return i.astype(np.int64), _smoothstep(u - i)
+
+
+def value_noise_grid(lon, lat, seed=0, cell=0.01, octaves=1, gain=0.5):
+    """
+    Noise on the grid spanned by 1-D lon (columns) and lat (rows) arrays.
+
+    Returns shape (len(lat), len(lon)); each octave halves the cell size and
+    multiplies the amplitude by gain. Lattice values are hashed once per
+    window and gathered, then blended along lon and then along lat.
+    """
+    total = np.zeros((len(lat), len(lon)))
+    amp = 1.0
+    for octave in range(octaves):
+        ix, sx = _lattice_coords(lon, cell)
+        iy, sy = _lattice_coords(lat, cell)
+        jx = ix - ix.min()
+        jy = iy - iy.min()
+        lattice = lattice_values(np.arange(ix.min(), ix.max() + 2)[np.newaxis, :],
+                                 np.arange(iy.min(), iy.max() + 2)[:, np.newaxis],
+                                 seed, octave)
+        along = lattice[:, jx] * (1 - sx) + lattice[:, jx + 1] * sx
+        layer = (along[jy] * (1 - sy)[:, np.newaxis]
+                 + along[jy + 1] * sy[:, np.newaxis])
+        total += amp * layer
+        amp *= gain
+        cell /= 2
+    return total
+
+
+def value_noise(lon, lat, seed=0, cell=0.01, octaves=1, gain=0.5):
+    """Noise at scattered points; same values as value_noise_grid at the same coordinates."""
+    lon, lat = np.broadcast_arrays(np.asarray(lon, dtype=np.float64),
+                                   np.asarray(lat, dtype=np.float64))
+    total = np.zeros(lon.shape)
+    amp = 1.0
+    for octave in range(octaves):
+        ix, sx = _lattice_coords(lon, cell)
+        iy, sy = _lattice_coords(lat, cell)
+        v0 = (lattice_values(ix, iy, seed, octave) * (1 - sx)
+              + lattice_values(ix + 1, iy, seed, octave) * sx)
+        v1 = (lattice_values(ix, iy + 1, seed, octave) * (1 - sx)
+              + lattice_values(ix + 1, iy + 1, seed, octave) * sx)
+        total += amp * (v0 * (1 - sy) + v1 * sy)
+        amp *= gain
+        cell /= 2
+    return total
+
+
+def check_consistency(seed=0, nx=700, ny=500):
+    """
+    Check that tiles, scattered points and repeated runs agree exactly.
+
+    Returns the SHA-256 of the full grid's bytes for this seed.
+    """
+    lon = np.linspace(-118.6, -116.8, nx)
+    lat = np.linspace(35.8, 37.8, ny)
+    kw = dict(seed=seed, cell=0.01, octaves=3)
+    full = value_noise_grid(lon, lat, **kw)
+    tiled = np.block([[value_noise_grid(lon[c:c + 128], lat[r:r + 128], **kw)
+                       for c in range(0, nx, 128)] for r in range(0, ny, 128)])
+    if not np.array_equal(full, tiled):
+        raise AssertionError("Tiled noise differs from the full grid")
+    rows = np.arange(0, ny, 37)
+    cols = np.arange(0, nx, 53)
+    points = value_noise(lon[cols][np.newaxis, :], lat[rows][:, np.newaxis], **kw)
+    if not np.array_equal(full[np.ix_(rows, cols)], points):
+        raise AssertionError("Point noise differs from the grid")
+    digest = hashlib.sha256(full.tobytes()).hexdigest()
+    if digest != hashlib.sha256(value_noise_grid(lon, lat, **kw).tobytes()).hexdigest():
+        raise AssertionError("Noise is not reproducible")
+    return digest
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    print(f"Noise tiles/points/reruns agree; seed {args.seed} "
+          f"sha256 {check_consistency(args.seed)}")
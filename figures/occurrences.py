@@ -0,0 +1,465 @@
+#!/usr/bin/env python3
+"""
+Streaming species-occurrence counts that regenerate species_verification.md.
+
+Reads an observation export (iNaturalist CSV, or a GBIF/Darwin Core table)
+a chunk of rows at a time and keeps only rows whose binomial is on the
+checklist in species_checklist.json (subspecies and listed synonyms count
+towards their species). Each chunk is dropped outside the latitude band of
+the search circles, indexed with a KD-tree on unit vectors, queried for every
+center at once and confirmed with a vectorized haversine distance. Counts
+are accumulated per center, species and quality grade in a single pass, so
+memory stays constant however large the export is, and the quality filter is
+applied when the tables are written.
+
+The CONFIRMED / NOT CONFIRMED tables and the search header are rewritten;
+the hand-written sections after them are kept as they are.
+
+Run `python occurrences.py --check` to compare against a brute-force count
+on a fabricated export.
+"""
+
+import argparse
+import csv
+import datetime
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+CHECKLIST_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                              'species_checklist.json')
+REPORT_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                           'species_verification.md')
+
+# Mean Earth radius (IUGG)
+EARTH_RADIUS_KM = 6371.0088
+
+# Matched rows held in memory at once
+CHUNK_ROWS = 100_000
+
+# iNaturalist quality grades; exports without a grade column count as 'research'.
+# Captive/cultivated observations are tallied in their own slot after these.
+QUALITY_GRADES = ('research', 'needs_id', 'casual')
+DEFAULT_QUALITY = ('research', 'needs_id')
+_CAPTIVE = len(QUALITY_GRADES)
+
+# Accepted column names, iNaturalist first, then Darwin Core
+COLUMNS = {
+    'name': ('scientific_name', 'species', 'scientificName'),
+    'lat': ('latitude', 'decimalLatitude'),
+    'lon': ('longitude', 'decimalLongitude'),
+    'quality': ('quality_grade',),
+    'captive': ('captive_cultivated',),
+}
+
+_GENERATED_HEADINGS = ('## CONFIRMED PRESENT', '## NOT CONFIRMED')
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Great-circle distance in km, vectorized over broadcastable arrays of degrees."""
+    lat1, lon1, lat2, lon2 = (np.radians(v) for v in (lat1, lon1, lat2, lon2))
+    a = (np.sin((lat2 - lat1) / 2)**2
+         + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2)**2)
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def unit_vectors(lat, lon):
+    """(n, 3) unit vectors for points in degrees; chord length grows with arc length."""
+    lat, lon = np.radians(lat), np.radians(lon)
+    return np.column_stack([np.cos(lat) * np.cos(lon),
+                            np.cos(lat) * np.sin(lon),
+                            np.sin(lat)])
+
+
+def _binomial(name):
+    return ' '.join(name.split()[:2]).lower()
+
+
+def load_checklist(path=CHECKLIST_PATH):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def taxon_lookup(species):
+    """
+    Map lower-case binomials to checklist indices. Synonyms map to their
+    entry; entries that only record an outdated name get no observations.
+    """
+    lookup = {}
+    for i, entry in enumerate(species):
+        if 'outdated_name_of' in entry:
+            continue
+        for name in [entry['name']] + entry.get('synonyms', []):
+            lookup[_binomial(name)] = i
+    return lookup
+
+
+def _column_index(header, field):
+    for name in COLUMNS[field]:
+        if name in header:
+            return header.index(name)
+    return None
+
+
+def sniff_delimiter(path):
+    """
+    Tab if the header line of an export has one, else ','. GBIF "simple"
+    downloads are tab-separated even when they are named .csv.
+    """
+    with open(path, newline='', encoding='utf-8') as f:
+        return '\t' if '\t' in f.readline() else ','
+
+
+def read_chunks(path, lookup, chunk_rows=CHUNK_ROWS, delimiter=None):
+    """
+    Yield (species, lat, lon, grade, rows_read, rows_skipped) for chunks of
+    checklist rows.
+
+    The first four are arrays; grade indexes QUALITY_GRADES, or is _CAPTIVE
+    for captive/cultivated observations. Rows with other taxa or missing
+    coordinates are left out before they are buffered. Malformed rows (too
+    few fields, such as a truncated last line, or coordinates that are not
+    numbers) are skipped. rows_read and rows_skipped are running counts.
+
+    delimiter defaults to sniff_delimiter(path). Tab-separated exports are
+    read unquoted, as GBIF writes them.
+    """
+    if delimiter is None:
+        delimiter = sniff_delimiter(path)
+    quoting = csv.QUOTE_NONE if delimiter == '\t' else csv.QUOTE_MINIMAL
+    with open(path, newline='', encoding='utf-8') as f:
+        reader = csv.reader(f, delimiter=delimiter, quoting=quoting)
+        header = next(reader)
+        cols = {field: _column_index(header, field) for field in COLUMNS}
+        for field in ('name', 'lat', 'lon'):
+            if cols[field] is None:
+                raise ValueError(f"{path}: no column for {field} (tried {COLUMNS[field]})")
+        i_name, i_lat, i_lon = cols['name'], cols['lat'], cols['lon']
+        i_quality, i_captive = cols['quality'], cols['captive']
+        n_fields = max(i for i in cols.values() if i is not None) + 1
+        grade_index = {g: k for k, g in enumerate(QUALITY_GRADES)}
+
+        species, lat, lon, grade = [], [], [], []
+        rows_read = rows_skipped = 0
+        for row in reader:
+            rows_read += 1
+            if len(row) < n_fields:
+                rows_skipped += 1
+                continue
+            idx = lookup.get(_binomial(row[i_name]))
+            if idx is None or not row[i_lat] or not row[i_lon]:
+                continue
+            try:
+                row_lat, row_lon = float(row[i_lat]), float(row[i_lon])
+            except ValueError:
+                rows_skipped += 1
+                continue
+            species.append(idx)
+            lat.append(row_lat)
+            lon.append(row_lon)
+            if i_captive is not None and row[i_captive].lower() == 'true':
+                grade.append(_CAPTIVE)
+            elif i_quality is not None:
+                grade.append(grade_index.get(row[i_quality], grade_index['casual']))
+            else:
+                grade.append(0)
+            if len(species) == chunk_rows:
+                yield (np.array(species, dtype=np.int64), np.array(lat, dtype=np.float64),
+                       np.array(lon, dtype=np.float64), np.array(grade, dtype=np.int64),
+                       rows_read, rows_skipped)
+                species, lat, lon, grade = [], [], [], []
+        yield (np.array(species, dtype=np.int64), np.array(lat, dtype=np.float64),
+               np.array(lon, dtype=np.float64), np.array(grade, dtype=np.int64),
+               rows_read, rows_skipped)
+
+
+class OccurrenceCounts:
+    """
+    Accumulates observation counts within radius_km of each center.
+
+    per_center has shape (centers, species, grades + captive); union counts
+    each observation once if it is within radius of any center.
+    """
+
+    def __init__(self, centers, radius_km, n_species):
+        self.centers = np.asarray(centers, dtype=np.float64).reshape(-1, 2)
+        self.radius_km = radius_km
+        self._center_xyz = unit_vectors(self.centers[:, 0], self.centers[:, 1])
+        # Chord length for the radius, padded so the haversine test decides the edge
+        self._chord = 2 * np.sin(radius_km / (2 * EARTH_RADIUS_KM)) * (1 + 1e-9)
+        dlat = np.degrees(radius_km / EARTH_RADIUS_KM)
+        self._lat_band = (self.centers[:, 0].min() - dlat, self.centers[:, 0].max() + dlat)
+        shape = (n_species, len(QUALITY_GRADES) + 1)
+        self.per_center = np.zeros((len(self.centers),) + shape, dtype=np.int64)
+        self.union = np.zeros(shape, dtype=np.int64)
+        self.rows_read = 0
+        self.rows_skipped = 0
+        self.rows_matched = 0
+
+    def add(self, species, lat, lon, grade):
+        self.rows_matched += len(species)
+        band = np.flatnonzero((lat >= self._lat_band[0]) & (lat <= self._lat_band[1]))
+        if not len(band):
+            return
+        species, lat, lon, grade = species[band], lat[band], lon[band], grade[band]
+        n_slots = self.union.size
+        slot = species * self.union.shape[1] + grade
+        tree = cKDTree(unit_vectors(lat, lon))
+        within_any = np.zeros(len(species), dtype=bool)
+        for c, candidates in enumerate(tree.query_ball_point(self._center_xyz, self._chord)):
+            candidates = np.asarray(candidates, dtype=np.int64)
+            lat_c, lon_c = self.centers[c]
+            hit = candidates[haversine_km(lat_c, lon_c, lat[candidates], lon[candidates])
+                             <= self.radius_km]
+            within_any[hit] = True
+            self.per_center[c] += np.bincount(slot[hit], minlength=n_slots).reshape(
+                self.union.shape)
+        self.union += np.bincount(slot[within_any], minlength=n_slots).reshape(
+            self.union.shape)
+
+    def observations(self, quality=DEFAULT_QUALITY, counts=None):
+        """Per-species totals over the given quality grades."""
+        counts = self.union if counts is None else counts
+        return counts[..., [QUALITY_GRADES.index(q) for q in quality]].sum(axis=-1)
+
+    def captive(self, counts=None):
+        counts = self.union if counts is None else counts
+        return counts[..., _CAPTIVE]
+
+
+def scan(path, checklist, centers=None, radius_km=None, chunk_rows=CHUNK_ROWS,
+         delimiter=None):
+    """Stream an export once and return the OccurrenceCounts for every checklist species."""
+    if centers is None:
+        centers = [(c['lat'], c['lon']) for c in checklist['centers']]
+    if radius_km is None:
+        radius_km = checklist['radius_km']
+    species = checklist['species']
+    counts = OccurrenceCounts(centers, radius_km, len(species))
+    for sp, lat, lon, grade, rows_read, rows_skipped in read_chunks(
+            path, taxon_lookup(species), chunk_rows, delimiter):
+        counts.add(sp, lat, lon, grade)
+        counts.rows_read, counts.rows_skipped = rows_read, rows_skipped
+    return counts
+
+
+def _format_center(lat, lon, name=None):
+    text = (f"{abs(lat):.2f}°{'N' if lat >= 0 else 'S'}, "
+            f"{abs(lon):.2f}°{'E' if lon >= 0 else 'W'}")
+    return f"{text} ({name})" if name else text
+
+
+def _cell(text):
+    return text.replace('|', '\\|')
+
+
+def render_tables(checklist, counts, quality=DEFAULT_QUALITY, min_count=1,
+                  date=None, source=None, centers=None):
+    """Markdown for the title, search header and the two verification tables."""
+    species = checklist['species']
+    totals = counts.observations(quality)
+    captive = counts.captive()
+    if centers is None:
+        centers = [(c['lat'], c['lon'], c.get('name')) for c in checklist['centers']]
+    date = date or datetime.date.today().strftime('%B %Y')
+
+    lines = [f"# {checklist['title']}", '',
+             f"Search parameters: {counts.radius_km:g}km radius from "
+             + '; '.join(_format_center(*c) for c in centers)]
+    if source:
+        lines.append(f"Source: {source} (quality grades: {', '.join(quality)})")
+    lines += [f"Date verified: {date}", '']
+
+    confirmed, missing = [], []
+    for i, entry in enumerate(species):
+        label = entry.get('label', f"*{entry['name']}*")
+        if 'outdated_name_of' in entry:
+            n_obs = '-'
+        elif totals[i] == 0 and captive[i]:
+            n_obs = f"{captive[i]} (captive)"
+        else:
+            n_obs = str(totals[i])
+        if 'outdated_name_of' not in entry and totals[i] >= min_count:
+            notes = entry.get('notes', entry.get('issue', ''))
+            confirmed.append(f"| {label} | {_cell(entry['common'])} | {n_obs} | {_cell(notes)} |")
+        else:
+            missing.append(f"| {label} | {_cell(entry['common'])} | {n_obs} | "
+                           f"{_cell(entry.get('issue', ''))} | "
+                           f"{_cell(entry.get('recommendation', ''))} |")
+
+    lines += ['## CONFIRMED PRESENT', '',
+              '| Species | Common Name | iNat Observations | Notes |',
+              '|---------|-------------|-------------------|-------|']
+    lines += confirmed
+    lines += ['', '## NOT CONFIRMED - Require manuscript correction', '',
+              '| Species | Common Name | iNat Obs | Issue | Recommendation |',
+              '|---------|-------------|----------|-------|----------------|']
+    lines += missing
+    return '\n'.join(lines) + '\n'
+
+
+def manual_sections(path):
+    """Text of an existing report from the first hand-written '## ' section on."""
+    if not os.path.exists(path):
+        return ''
+    with open(path, encoding='utf-8') as f:
+        lines = f.readlines()
+    for k, line in enumerate(lines):
+        if line.startswith('## ') and not line.startswith(_GENERATED_HEADINGS):
+            return ''.join(lines[k:])
+    return ''
+
+
+def write_report(path, tables):
+    tail = manual_sections(path)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(tables)
+        if tail:
+            f.write('\n' + tail)
+
+
+def _write_test_export(path, checklist, n, seed):
+    """Fabricated iNaturalist-style export scattered around the checklist centers."""
+    rng = np.random.default_rng(seed)
+    names = []
+    for entry in checklist['species']:
+        names += [entry['name'], entry['name'] + ' ssp. test'] + entry.get('synonyms', [])
+    names += ['Pinus', 'Larrea divaricata', 'Homo sapiens']
+    center = checklist['centers'][0]
+    lat = center['lat'] + rng.uniform(-0.6, 0.6, n)
+    lon = center['lon'] + rng.uniform(-0.8, 0.8, n)
+    name = rng.choice(np.array(names, dtype=object), n)
+    grade = rng.choice(np.array(QUALITY_GRADES + ('',), dtype=object), n)
+    captive = rng.random(n) < 0.05
+    missing = rng.random(n) < 0.01
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['id', 'observed_on', 'quality_grade', 'latitude', 'longitude',
+                         'scientific_name', 'captive_cultivated'])
+        for k in range(n):
+            writer.writerow([k, '2025-05-01', grade[k],
+                             '' if missing[k] else f'{lat[k]:.6f}', f'{lon[k]:.6f}', name[k],
+                             'true' if captive[k] else 'false'])
+
+
+def check_counts(n=200_000, seed=0):
+    """
+    Compare a chunked scan with a brute-force count over the whole fabricated
+    export, for two overlapping centers. Returns rows per second of the scan.
+    """
+    checklist = load_checklist()
+    centers = [(36.75, -117.85), (36.6, -117.6)]
+    radius_km = 30
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'observations.csv')
+        _write_test_export(path, checklist, n, seed)
+        start = time.perf_counter()
+        counts = scan(path, checklist, centers, radius_km, chunk_rows=997)
+        rate = n / (time.perf_counter() - start)
+
+        lookup = taxon_lookup(checklist['species'])
+        grade_index = {g: k for k, g in enumerate(QUALITY_GRADES)}
+        with open(path, newline='', encoding='utf-8') as f:
+            rows = [r for r in csv.DictReader(f)
+                    if r['latitude'] and _binomial(r['scientific_name']) in lookup]
+    sp = np.array([lookup[_binomial(r['scientific_name'])] for r in rows])
+    lat = np.array([float(r['latitude']) for r in rows])
+    lon = np.array([float(r['longitude']) for r in rows])
+    grade = np.array([_CAPTIVE if r['captive_cultivated'] == 'true'
+                      else grade_index.get(r['quality_grade'], 2) for r in rows])
+    # '' grades are non-iNaturalist rows in this fabrication only; scan treats them as casual
+    dist = haversine_km(np.array(centers)[:, :1], np.array(centers)[:, 1:],
+                        lat[np.newaxis], lon[np.newaxis])
+    expected = np.zeros_like(counts.union)
+    np.add.at(expected, (sp[(dist <= radius_km).any(axis=0)],
+                         grade[(dist <= radius_km).any(axis=0)]), 1)
+    if not np.array_equal(expected, counts.union):
+        raise AssertionError("Union counts differ from brute force")
+    for c in range(len(centers)):
+        expected = np.zeros_like(counts.union)
+        np.add.at(expected, (sp[dist[c] <= radius_km], grade[dist[c] <= radius_km]), 1)
+        if not np.array_equal(expected, counts.per_center[c]):
+            raise AssertionError(f"Counts for center {c} differ from brute force")
+    if counts.rows_read != n:
+        raise AssertionError(f"Read {counts.rows_read} rows, expected {n}")
+    return rate
+
+
+def check_malformed():
+    """
+    Scan a GBIF-style export (tab-separated, unquoted, named .csv) with a
+    non-numeric coordinate, a short row and a truncated last line; the bad
+    rows are skipped and counted, not fatal.
+    """
+    checklist = load_checklist()
+    name = checklist['species'][0]['name']
+    lines = ['gbifID\tscientificName\tdecimalLatitude\tdecimalLongitude\tlocality',
+             f'1\t{name}\t36.75\t-117.85\t"Saline Valley',
+             f'2\t{name}\tNA\t-117.85\tMarble Canyon',
+             '3',
+             f'4\t{name}\t36.7']
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'gbif_simple.csv')
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            f.write('\n'.join(lines))
+        counts = scan(path, checklist, radius_km=10)
+    got = (counts.rows_read, counts.rows_skipped, int(counts.observations().sum()))
+    if got != (4, 3, 1):
+        raise AssertionError(f"(read, skipped, counted) = {got}, expected (4, 3, 1)")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('export', nargs='?', help='observation CSV/TSV export')
+    parser.add_argument('--checklist', default=CHECKLIST_PATH)
+    parser.add_argument('--output', default=REPORT_PATH,
+                        help='report to rewrite (default: species_verification.md)')
+    parser.add_argument('--center', nargs=2, type=float, action='append',
+                        metavar=('LAT', 'LON'),
+                        help='search center (repeatable; default: from the checklist)')
+    parser.add_argument('--radius-km', type=float)
+    parser.add_argument('--quality', nargs='+', default=list(DEFAULT_QUALITY),
+                        choices=QUALITY_GRADES)
+    parser.add_argument('--min-count', type=int, default=1,
+                        help='observations needed to count a species as confirmed')
+    parser.add_argument('--delimiter', default=None,
+                        help="field separator (default: tab if the header has one, "
+                             "else ',')")
+    parser.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS)
+    parser.add_argument('--date', help="'Date verified' text (default: this month)")
+    parser.add_argument('--dry-run', action='store_true',
+                        help='print the tables instead of rewriting the report')
+    parser.add_argument('--check', action='store_true',
+                        help='verify against brute force on a fabricated export')
+    args = parser.parse_args()
+
+    if args.check:
+        print(f"Chunked counts match brute force; {check_counts() / 1e3:.0f} k rows/s")
+        check_malformed()
+        print("Malformed rows in a tab-separated .csv are skipped and counted")
+    elif args.export:
+        checklist = load_checklist(args.checklist)
+        centers = None
+        if args.center:
+            centers = [(lat, lon, None) for lat, lon in args.center]
+        start = time.perf_counter()
+        counts = scan(args.export, checklist,
+                      centers and [c[:2] for c in centers], args.radius_km,
+                      args.chunk_rows, args.delimiter)
+        elapsed = time.perf_counter() - start
+        tables = render_tables(checklist, counts, args.quality, args.min_count, args.date,
+                               os.path.basename(args.export), centers)
+        if args.dry_run:
+            print(tables)
+        else:
+            write_report(args.output, tables)
+            print(f"Wrote {args.output}")
+        print(f"{counts.rows_read} rows read ({counts.rows_skipped} malformed, skipped), "
+              f"{counts.rows_matched} on the checklist, "
+              f"{elapsed:.1f} s")
+    else:
+        parser.print_help()
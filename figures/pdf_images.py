@@ -0,0 +1,1202 @@
+#!/usr/bin/env python3
+"""
+Extract embedded images from the source PDFs, without rasterizing pages.
+
+figures.json entries with the pdf_image producer name a PDF, a page (from 1)
+and the image to take from it:
+
+    "figures/extracted/images/pinyon-cones.jpg": {
+      "producer": "pdf_image", "pdf": "figures/botanical/...pdf",
+      "page": 1, "image": 0
+    }
+
+"image" counts the page's images in the order the content stream paints
+them, Form XObjects included (`--list` shows them). Instead of an index, a
+"crop" box [x0, y0, x1, y1] in PDF points (origin at the bottom left of the
+unrotated page) selects the image covering most of the box and cuts out the
+part under it. The crop is done on the image's own pixels, by inverting the
+placement matrix, so nothing is resampled. Both can be given together.
+
+The PDF is memory-mapped and only the objects the requested pages reach are
+parsed: the cross-reference table (classic or stream) is read, and object
+streams are decoded on first use. A JPEG stream written to a .jpg target is
+copied byte for byte. Everything else is decoded and saved as PNG or JPEG:
+Flate/LZW data with PNG or TIFF predictors, DeviceGray/RGB/CMYK, ICCBased,
+Indexed and Separation color, 1-16 bit samples, and soft masks as alpha.
+
+PDFs are processed in parallel, one worker per PDF opening the file once for
+all of its images. A target is re-extracted only if the SHA-256 of its PDF,
+its entry or EXTRACT_VERSION changed, or its output file did. Hashes are
+cached by (size, mtime) in .extract_state.json as build.py does, so adding
+one figure reads only its own PDF. build.py runs this script for pdf_image
+targets. `python pdf_images.py --check` runs a self-test on synthetic PDFs.
+"""
+
+import argparse
+import base64
+import hashlib
+import io
+import json
+import mmap
+import os
+import re
+import sys
+import tempfile
+import time
+import zlib
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from build import ROOT, FileHashes, load_manifest
+
+FIGURES_DIR = os.path.dirname(os.path.abspath(__file__))
+STATE_PATH = os.path.join(FIGURES_DIR, '.extract_state.json')
+
+# Bump when extraction changes in a way the manifest entries don't capture
+EXTRACT_VERSION = 1
+
+JPEG_QUALITY = 95
+
+# Form XObjects nested deeper than this are not searched for images
+MAX_FORM_DEPTH = 8
+
+# Bytes from the end of the file searched for startxref
+STARTXREF_WINDOW = 2048
+
+IDENTITY = (1.0, 0.0, 0.0, 1.0, 0.0, 0.0)
+
+Ref = namedtuple('Ref', 'num gen')
+
+# An image painted on a page: its reference, resource name, stream and the
+# matrix mapping the image's unit square onto the page
+Placement = namedtuple('Placement', 'ref name stream ctm')
+
+
+class Name(str):
+    """A PDF name object (the /-prefixed kind), as opposed to a string."""
+
+
+class Keyword(str):
+    """A bare token: an operator in a content stream, or obj/stream/R/... in a file."""
+
+
+class Stream:
+    def __init__(self, attrs, data):
+        self.attrs = attrs
+        self.data = data
+
+    def get(self, key, default=None):
+        return self.attrs.get(key, default)
+
+
+_WHITESPACE = re.compile(rb'(?:[\x00\t\n\x0c\r ]+|%[^\r\n]*)*')
+_REGULAR = re.compile(rb'[^\x00\t\n\x0c\r ()<>\[\]{}/%]+')
+_NUMBER = re.compile(rb'[+-]?(?:\d+\.?\d*|\.\d+)$')
+_INTEGER = re.compile(rb'[+-]?\d+$')
+_REF_TAIL = re.compile(rb'[\x00\t\n\x0c\r ]+(\d+)[\x00\t\n\x0c\r ]+R(?![^\x00\t\n\x0c\r ()<>\[\]{}/%])')
+_NAME_ESCAPE = re.compile(rb'#([0-9A-Fa-f]{2})')
+_STRING_SPECIAL = re.compile(rb'[()\\]')
+_STRING_ESCAPES = {b'n': b'\n', b'r': b'\r', b't': b'\t', b'b': b'\b', b'f': b'\f'}
+_OBJ_HEADER = re.compile(rb'[\x00\t\n\x0c\r ]*(\d+)[\x00\t\n\x0c\r ]+(\d+)[\x00\t\n\x0c\r ]+obj')
+_STREAM_START = re.compile(rb'[\x00\t\n\x0c\r ]*stream(?:\r\n|\n|\r)?')
+_STREAM_END = re.compile(rb'[\x00\t\n\x0c\r ]*endstream')
+_XREF_SECTION = re.compile(rb'(\d+)[\x00\t\n\x0c\r ]+(\d+)')
+_XREF_ENTRY = re.compile(rb'[\x00\t\n\x0c\r ]*(\d{1,10})[\x00\t\n\x0c\r ]+(\d{1,5})[\x00\t\n\x0c\r ]+([nf])')
+_ANY_OBJ = re.compile(rb'(?<![0-9])(\d+)[\x00\t\n\x0c\r ]+(\d+)[\x00\t\n\x0c\r ]+obj\b')
+_INLINE_IMAGE_END = re.compile(rb'[\x00\t\n\x0c\r ]EI(?=[\x00\t\n\x0c\r ]|$)')
+
+
+def _literal_string(buf, pos):
+    """Parse a (...) string starting after its opening parenthesis."""
+    out, depth = bytearray(), 1
+    while True:
+        m = _STRING_SPECIAL.search(buf, pos)
+        if m is None:
+            raise ValueError("unterminated string")
+        out += buf[pos:m.start()]
+        c, pos = buf[m.start():m.start() + 1], m.end()
+        if c == b'\\':
+            e = buf[pos:pos + 1]
+            pos += 1
+            if e in _STRING_ESCAPES:
+                out += _STRING_ESCAPES[e]
+            elif e in b'01234567' and e:
+                digits = re.match(rb'[0-7]{1,3}', buf[pos - 1:pos + 2]).group()
+                out.append(int(digits, 8) & 0xFF)
+                pos += len(digits) - 1
+            elif e == b'\r':
+                pos += buf[pos:pos + 1] == b'\n'
+            elif e != b'\n':
+                out += e
+        elif c == b'(':
+            depth += 1
+            out += c
+        else:
+            depth -= 1
+            if depth == 0:
+                return bytes(out), pos
+            out += c
+
+
+def parse_object(buf, pos):
+    """Parse one PDF object at pos: (object, position after it)."""
+    pos = _WHITESPACE.match(buf, pos).end()
+    c = buf[pos:pos + 1]
+    if c == b'/':
+        m = _REGULAR.match(buf, pos + 1)
+        raw = m.group() if m else b''
+        raw = _NAME_ESCAPE.sub(lambda e: bytes([int(e.group(1), 16)]), raw)
+        return Name(raw.decode('latin-1')), pos + 1 + (len(m.group()) if m else 0)
+    if c == b'<':
+        if buf[pos + 1:pos + 2] == b'<':
+            d, pos = {}, pos + 2
+            while True:
+                pos = _WHITESPACE.match(buf, pos).end()
+                if buf[pos:pos + 2] == b'>>':
+                    return d, pos + 2
+                key, pos = parse_object(buf, pos)
+                if not isinstance(key, Name):
+                    raise ValueError(f"dictionary key {key!r} at {pos} is not a name")
+                d[key], pos = parse_object(buf, pos)
+        end = buf.find(b'>', pos)
+        if end < 0:
+            raise ValueError("unterminated hex string")
+        digits = re.sub(rb'[^0-9A-Fa-f]', b'', buf[pos + 1:end])
+        return bytes.fromhex((digits + b'0' * (len(digits) % 2)).decode('ascii')), end + 1
+    if c == b'[':
+        items, pos = [], pos + 1
+        while True:
+            pos = _WHITESPACE.match(buf, pos).end()
+            if buf[pos:pos + 1] == b']':
+                return items, pos + 1
+            if pos >= len(buf):
+                raise ValueError("unterminated array")
+            item, pos = parse_object(buf, pos)
+            items.append(item)
+    if c == b'(':
+        return _literal_string(buf, pos + 1)
+    m = _REGULAR.match(buf, pos)
+    if m is None:
+        raise ValueError(f"unexpected {c!r} at {pos}")
+    token, end = m.group(), m.end()
+    if _INTEGER.match(token):
+        ref = _REF_TAIL.match(buf, end)
+        if ref:
+            return Ref(int(token), int(ref.group(1))), ref.end()
+        return int(token), end
+    if _NUMBER.match(token):
+        return float(token), end
+    if token in (b'true', b'false'):
+        return token == b'true', end
+    if token == b'null':
+        return None, end
+    return Keyword(token.decode('latin-1')), end
+
+
+def content_tokens(data):
+    """Yield the operands and operators of a content stream; inline images are skipped."""
+    pos, n = 0, len(data)
+    while True:
+        pos = _WHITESPACE.match(data, pos).end()
+        if pos >= n:
+            return
+        try:
+            token, pos = parse_object(data, pos)
+        except (ValueError, IndexError):
+            pos += 1
+            continue
+        if token == 'BI' and isinstance(token, Keyword):
+            start = data.find(b'ID', pos)
+            m = _INLINE_IMAGE_END.search(data, start + 3) if start >= 0 else None
+            if m is None:
+                return
+            pos = m.end()
+            continue
+        yield token
+
+
+def multiply(m, n):
+    """Matrix product m x n of PDF matrices [a b c d e f]."""
+    a, b, c, d, e, f = m
+    A, B, C, D, E, F = n
+    return (a * A + b * C, a * B + b * D, c * A + d * C, c * B + d * D,
+            e * A + f * C + E, e * B + f * D + F)
+
+
+def placement_bbox(ctm):
+    """Page-space bounding box (x0, y0, x1, y1) of the unit square under ctm."""
+    a, b, c, d, e, f = ctm
+    xs = [e, a + e, c + e, a + c + e]
+    ys = [f, b + f, d + f, b + d + f]
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def _inflate(data):
+    try:
+        return zlib.decompressobj().decompress(data)
+    except zlib.error as e:
+        raise ValueError(f"FlateDecode: {e}") from e
+
+
+def _lzw(data, early_change=1):
+    out, table = bytearray(), None
+    bits, buffer, width, prev = 0, 0, 9, None
+    for byte in data:
+        buffer, bits = (buffer << 8) | byte, bits + 8
+        while bits >= width:
+            bits -= width
+            code = (buffer >> bits) & ((1 << width) - 1)
+            if code == 256:
+                table, width, prev = [bytes([i]) for i in range(256)] + [None, None], 9, None
+                continue
+            if code == 257:
+                return bytes(out)
+            if table is None:
+                table = [bytes([i]) for i in range(256)] + [None, None]
+            if prev is None:
+                entry = table[code]
+            else:
+                entry = table[code] if code < len(table) else prev + prev[:1]
+                table.append(prev + entry[:1])
+            out += entry
+            prev = entry
+            if len(table) + early_change >= (1 << width) and width < 12:
+                width += 1
+    return bytes(out)
+
+
+def _ascii85(data):
+    data = re.sub(rb'[\x00\t\n\x0c\r ]', b'', data)
+    if data.startswith(b'<~'):
+        data = data[2:]
+    return base64.a85decode(data.split(b'~>')[0])
+
+
+def _run_length(data):
+    out, pos = bytearray(), 0
+    while pos < len(data):
+        n = data[pos]
+        if n == 128:
+            break
+        if n < 128:
+            out += data[pos + 1:pos + n + 2]
+            pos += n + 2
+        else:
+            out += data[pos + 1:pos + 2] * (257 - n)
+            pos += 2
+    return bytes(out)
+
+
+def unpredict(data, parms):
+    """Undo a PNG (10-15) or TIFF (2) predictor from a Flate/LZW DecodeParms."""
+    predictor = parms.get('Predictor', 1)
+    if predictor < 2:
+        return data
+    colors, bpc = parms.get('Colors', 1), parms.get('BitsPerComponent', 8)
+    columns = parms.get('Columns', 1)
+    row_bytes = (colors * bpc * columns + 7) // 8
+    bpp = max(1, colors * bpc // 8)
+    if predictor == 2:
+        if bpc != 8:
+            raise ValueError(f"TIFF predictor with {bpc} bits per component")
+        rows = len(data) // row_bytes
+        samples = np.frombuffer(data, np.uint8, rows * row_bytes).reshape(rows, columns, colors)
+        return np.cumsum(samples, axis=1, dtype=np.uint8).tobytes()
+    stride = row_bytes + 1
+    rows = len(data) // stride
+    raw = np.frombuffer(data, np.uint8, rows * stride).reshape(rows, stride)
+    out = np.empty((rows, row_bytes), np.uint8)
+    prev = np.zeros(row_bytes, np.uint8)
+    for r in range(rows):
+        kind, line = raw[r, 0], raw[r, 1:]
+        if kind == 0:
+            cur = line
+        elif kind == 1:
+            cur = np.cumsum(line.reshape(-1, bpp), axis=0, dtype=np.uint8).ravel()
+        elif kind == 2:
+            cur = line + prev
+        elif kind in (3, 4):
+            # Average and Paeth depend on the decoded byte to the left
+            cur, up = bytearray(line.tobytes()), prev.tobytes()
+            for i in range(row_bytes):
+                left = cur[i - bpp] if i >= bpp else 0
+                if kind == 3:
+                    cur[i] = (cur[i] + ((left + up[i]) >> 1)) & 0xFF
+                    continue
+                upper_left = up[i - bpp] if i >= bpp else 0
+                p = left + up[i] - upper_left
+                pa, pb, pc = abs(p - left), abs(p - up[i]), abs(p - upper_left)
+                pred = left if pa <= pb and pa <= pc else up[i] if pb <= pc else upper_left
+                cur[i] = (cur[i] + pred) & 0xFF
+            cur = np.frombuffer(bytes(cur), np.uint8)
+        else:
+            raise ValueError(f"unknown PNG predictor filter type {kind} in row {r}")
+        out[r] = cur
+        prev = out[r]
+    return out.tobytes()
+
+
+# Filters that decode to image samples rather than bytes; they end a chain
+IMAGE_CODECS = {'DCTDecode': 'DCTDecode', 'DCT': 'DCTDecode', 'JPXDecode': 'JPXDecode',
+                'CCITTFaxDecode': 'CCITTFaxDecode', 'CCF': 'CCITTFaxDecode',
+                'JBIG2Decode': 'JBIG2Decode'}
+
+
+class PdfDocument:
+    """A memory-mapped PDF whose objects are parsed on first access."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if not self.buf[:1024].lstrip().startswith(b'%PDF-'):
+            raise ValueError("not a PDF file")
+        self.xref = {}
+        self.trailer = None
+        self._objects = {}
+        self._object_streams = {}
+        self._pages = None
+        try:
+            self._read_xref()
+        except (ValueError, IndexError, KeyError, TypeError, zlib.error):
+            self._reconstruct_xref()
+        if self.trailer.get('Encrypt') is not None:
+            raise ValueError(f"{path}: encrypted PDFs are not supported")
+
+    def close(self):
+        self.buf.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # Cross-reference table
+
+    def _read_xref(self):
+        tail = self.buf[-STARTXREF_WINDOW:]
+        at = tail.rfind(b'startxref')
+        if at < 0:
+            raise ValueError("no startxref")
+        offset, seen = int(tail[at + 9:].split()[0]), set()
+        while offset is not None and offset not in seen:
+            seen.add(offset)
+            pos = _WHITESPACE.match(self.buf, offset).end()
+            if self.buf[pos:pos + 4] == b'xref':
+                entries, trailer = self._read_xref_table(pos + 4)
+                # A hybrid file's table marks the objects its xref stream holds as free
+                if isinstance(trailer.get('XRefStm'), int):
+                    self._read_xref_stream(trailer['XRefStm'])
+                for num, entry in entries:
+                    self.xref.setdefault(num, entry)
+            else:
+                trailer = self._read_xref_stream(offset)
+            if self.trailer is None:
+                self.trailer = trailer
+            offset = trailer.get('Prev')
+        self.resolve(self.trailer['Root'])['Pages']
+
+    def _read_xref_table(self, pos):
+        """Entries [(num, entry)] of a classic table and its trailer."""
+        buf, entries = self.buf, []
+        while True:
+            pos = _WHITESPACE.match(buf, pos).end()
+            if buf[pos:pos + 7] == b'trailer':
+                trailer, _ = parse_object(buf, pos + 7)
+                return entries, trailer
+            m = _XREF_SECTION.match(buf, pos)
+            if m is None:
+                raise ValueError(f"bad xref section at {pos}")
+            start, count, pos = int(m.group(1)), int(m.group(2)), m.end()
+            for num in range(start, start + count):
+                m = _XREF_ENTRY.match(buf, pos)
+                if m is None:
+                    raise ValueError(f"bad xref entry at {pos}")
+                pos = m.end()
+                entries.append((num, ('offset', int(m.group(1))) if m.group(3) == b'n' else None))
+
+    def _read_xref_stream(self, offset):
+        stream = self._object_at(offset)
+        if not isinstance(stream, Stream) or stream.get('Type') != 'XRef':
+            raise ValueError(f"no xref stream at {offset}")
+        data, _, _ = self.decode(stream)
+        widths = stream.get('W')
+        index = stream.get('Index') or [0, stream.get('Size')]
+        row, pos = sum(widths), 0
+        for start, count in zip(index[::2], index[1::2]):
+            for num in range(start, start + count):
+                fields, p = [], pos
+                for w in widths:
+                    fields.append(int.from_bytes(data[p:p + w], 'big') if w else None)
+                    p += w
+                pos += row
+                kind = 1 if fields[0] is None else fields[0]
+                if kind == 1:
+                    entry = ('offset', fields[1])
+                elif kind == 2:
+                    entry = ('compressed', fields[1], fields[2] or 0)
+                else:
+                    entry = None
+                # Sections read earlier belong to newer revisions
+                self.xref.setdefault(num, entry)
+        return stream.attrs
+
+    def _reconstruct_xref(self):
+        """Rebuild the table by scanning for 'n g obj' headers (damaged or truncated files)."""
+        self.xref, self._objects, trailer = {}, {}, {}
+        for m in _ANY_OBJ.finditer(self.buf):
+            self.xref[int(m.group(1))] = ('offset', m.start())
+        for num in list(self.xref):
+            try:
+                obj = self.get(num)
+            except (ValueError, IndexError, KeyError, TypeError):
+                continue
+            attrs = obj.attrs if isinstance(obj, Stream) else obj
+            if not isinstance(attrs, dict):
+                continue
+            if attrs.get('Type') == 'ObjStm':
+                n, first = attrs.get('N', 0), attrs.get('First', 0)
+                head = self.decode(obj)[0][:first].split()
+                for i, member in enumerate(head[:2 * n:2]):
+                    self.xref.setdefault(int(member), ('compressed', num, i))
+            elif attrs.get('Type') == 'Catalog':
+                trailer.setdefault('Root', Ref(num, 0))
+        pos = self.buf.rfind(b'trailer')
+        if pos >= 0:
+            try:
+                trailer.update(parse_object(self.buf, pos + 7)[0])
+            except (ValueError, IndexError):
+                pass
+        if 'Root' not in trailer:
+            raise ValueError(f"{self.path}: cannot find the document catalog")
+        self._objects = {}
+        self.trailer = trailer
+
+    # Objects
+
+    def _object_at(self, offset):
+        buf = self.buf
+        m = _OBJ_HEADER.match(buf, offset)
+        if m is None:
+            raise ValueError(f"no object at offset {offset}")
+        obj, pos = parse_object(buf, m.end())
+        if not isinstance(obj, dict):
+            return obj
+        m = _STREAM_START.match(buf, pos)
+        if m is None:
+            return obj
+        start = m.end()
+        length = self.resolve(obj.get('Length'))
+        if not (isinstance(length, int) and _STREAM_END.match(buf, start + length)):
+            # Missing or wrong /Length: fall back to the endstream keyword
+            end = buf.find(b'endstream', start)
+            if end < 0:
+                raise ValueError(f"unterminated stream at offset {offset}")
+            length = end - start
+            for eol in (b'\r\n', b'\n', b'\r'):
+                if buf[start:start + length].endswith(eol):
+                    length -= len(eol)
+                    break
+        return Stream(obj, buf[start:start + length])
+
+    def get(self, num):
+        """Object number num, or None if it is free or missing."""
+        if num in self._objects:
+            return self._objects[num]
+        entry = self.xref.get(num)
+        obj = None
+        if entry is not None and entry[0] == 'offset':
+            obj = self._object_at(entry[1])
+        elif entry is not None:
+            data, offsets = self._object_stream(entry[1])
+            if entry[2] < len(offsets):
+                obj = parse_object(data, offsets[entry[2]])[0]
+        self._objects[num] = obj
+        return obj
+
+    def _object_stream(self, num):
+        if num not in self._object_streams:
+            stream = self.get(num)
+            if not isinstance(stream, Stream):
+                raise ValueError(f"object stream {num} is missing")
+            data = self.decode(stream)[0]
+            first, n = stream.get('First'), stream.get('N')
+            head = data[:first].split()
+            offsets = [first + int(o) for o in head[1:2 * n:2]]
+            self._object_streams[num] = (data, offsets)
+        return self._object_streams[num]
+
+    def resolve(self, obj):
+        while isinstance(obj, Ref):
+            obj = self.get(obj.num)
+        return obj
+
+    def codec(self, stream):
+        """The image codec (DCTDecode, ...) a stream's filter chain ends in, or None."""
+        filters = self.resolve(stream.get('Filter'))
+        last = self.resolve(filters[-1] if isinstance(filters, list) and filters else filters)
+        return IMAGE_CODECS.get(last)
+
+    def decode(self, stream):
+        """
+        Apply a stream's filters: (data, image codec, its DecodeParms). If the
+        chain ends in an image codec (DCTDecode, ...) the data is still encoded
+        with it and its name is returned, otherwise the codec is None.
+        """
+        filters = self.resolve(stream.get('Filter')) or []
+        parms = self.resolve(stream.get('DecodeParms', stream.get('DP'))) or []
+        if not isinstance(filters, list):
+            filters, parms = [filters], [parms]
+        elif not isinstance(parms, list):
+            parms = [parms]
+        data = bytes(stream.data)
+        for i, name in enumerate(self.resolve(f) for f in filters):
+            parm = self.resolve(parms[i]) if i < len(parms) else None
+            parm = {k: self.resolve(v) for k, v in (parm or {}).items()}
+            if name in IMAGE_CODECS:
+                return data, IMAGE_CODECS[name], parm
+            if name in ('FlateDecode', 'Fl'):
+                data = unpredict(_inflate(data), parm)
+            elif name in ('LZWDecode', 'LZW'):
+                data = unpredict(_lzw(data, parm.get('EarlyChange', 1)), parm)
+            elif name in ('ASCIIHexDecode', 'AHx'):
+                data = parse_object(b'<' + data.split(b'>')[0] + b'>', 0)[0]
+            elif name in ('ASCII85Decode', 'A85'):
+                data = _ascii85(data)
+            elif name in ('RunLengthDecode', 'RL'):
+                data = _run_length(data)
+            else:
+                raise ValueError(f"unsupported filter {name}")
+        return data, None, None
+
+    # Pages and the images they paint
+
+    def pages(self):
+        """Page dictionaries in order, with inherited Resources/MediaBox/Rotate filled in."""
+        if self._pages is None:
+            pages, seen = [], set()
+            root = self.resolve(self.resolve(self.trailer['Root'])['Pages'])
+            todo = [(root, {})]
+            while todo:
+                node, inherited = todo.pop()
+                inherited = dict(inherited, **{k: node[k] for k in
+                                               ('Resources', 'MediaBox', 'CropBox', 'Rotate')
+                                               if k in node})
+                if node.get('Type') == 'Page' or 'Kids' not in node:
+                    pages.append(dict(node, **inherited))
+                    continue
+                kids = [k for k in self.resolve(node['Kids']) if k not in seen]
+                seen.update(k for k in kids if isinstance(k, Ref))
+                todo.extend((self.resolve(k), inherited) for k in reversed(kids))
+            self._pages = pages
+        return self._pages
+
+    def page(self, number):
+        pages = self.pages()
+        if not 1 <= number <= len(pages):
+            raise ValueError(f"{self.path}: no page {number} (it has {len(pages)})")
+        return pages[number - 1]
+
+    def content(self, page):
+        contents = self.resolve(page.get('Contents'))
+        if not isinstance(contents, list):
+            contents = [contents]
+        streams = [self.resolve(c) for c in contents]
+        return b'\n'.join(self.decode(s)[0] for s in streams if isinstance(s, Stream))
+
+    def page_images(self, page):
+        """Placements of the images a page paints, in painting order, each image once."""
+        placements, seen = [], set()
+        self._walk(self.content(page), self.resolve(page.get('Resources')) or {},
+                   IDENTITY, placements, seen, ())
+        return placements
+
+    def _walk(self, content, resources, ctm, placements, seen, forms):
+        stack, operands = [], []
+        for token in content_tokens(content):
+            if not isinstance(token, Keyword):
+                operands.append(token)
+                continue
+            if token == 'q':
+                stack.append(ctm)
+            elif token == 'Q':
+                ctm = stack.pop() if stack else ctm
+            elif token == 'cm' and len(operands) >= 6 and all(
+                    isinstance(v, (int, float)) for v in operands[-6:]):
+                ctm = multiply(tuple(float(v) for v in operands[-6:]), ctm)
+            elif token == 'Do' and operands and isinstance(operands[-1], Name):
+                self._paint(operands[-1], resources, ctm, placements, seen, forms)
+            operands = []
+
+    def _paint(self, name, resources, ctm, placements, seen, forms):
+        ref = (self.resolve(resources.get('XObject')) or {}).get(name)
+        xobject = self.resolve(ref)
+        if not isinstance(xobject, Stream):
+            return
+        subtype = xobject.get('Subtype')
+        if subtype == 'Image':
+            key = ref if isinstance(ref, Ref) else id(xobject)
+            if key not in seen and not self.resolve(xobject.get('ImageMask')):
+                seen.add(key)
+                placements.append(Placement(ref, name, xobject, ctm))
+        elif subtype == 'Form' and ref not in forms and len(forms) < MAX_FORM_DEPTH:
+            matrix = self.resolve(xobject.get('Matrix')) or IDENTITY
+            self._walk(self.decode(xobject)[0],
+                       self.resolve(xobject.get('Resources')) or resources,
+                       multiply(tuple(float(v) for v in matrix), ctm),
+                       placements, seen, forms + (ref,))
+
+
+def _colorspace(doc, cs, resources=None):
+    """(PIL mode, components, palette) for an image ColorSpace."""
+    cs = doc.resolve(cs)
+    if isinstance(cs, Name) and cs not in ('DeviceGray', 'G', 'DeviceRGB', 'RGB',
+                                           'DeviceCMYK', 'CMYK', 'CalGray', 'CalRGB'):
+        named = doc.resolve((resources or {}).get('ColorSpace')) or {}
+        if cs in named:
+            return _colorspace(doc, named[cs])
+    family = doc.resolve(cs[0]) if isinstance(cs, list) else cs
+    if family in ('DeviceGray', 'G', 'CalGray'):
+        return 'L', 1, None
+    if family in ('DeviceRGB', 'RGB', 'CalRGB'):
+        return 'RGB', 3, None
+    if family in ('DeviceCMYK', 'CMYK'):
+        return 'CMYK', 4, None
+    if family == 'ICCBased':
+        n = doc.resolve(cs[1]).get('N', 3)
+        return {1: 'L', 3: 'RGB', 4: 'CMYK'}[n], n, None
+    if family in ('Indexed', 'I'):
+        base_mode, base_n, _ = _colorspace(doc, cs[1], resources)
+        hival, lookup = doc.resolve(cs[2]), doc.resolve(cs[3])
+        if isinstance(lookup, Stream):
+            lookup = doc.decode(lookup)[0]
+        lookup = lookup[:(hival + 1) * base_n].ljust((hival + 1) * base_n, b'\0')
+        palette = Image.frombytes(base_mode, (hival + 1, 1), lookup).convert('RGB')
+        return 'P', 1, palette.tobytes()
+    if family == 'Separation':
+        # One colorant: 1 is full ink, so show it as inverted gray
+        return 'separation', 1, None
+    raise ValueError(f"unsupported color space {family}")
+
+
+# Raw modes PIL unpacks samples with, by (mode, bits per component)
+_RAW_MODES = {('L', 1): ('1', '1'), ('L', 2): ('L', 'L;2'), ('L', 4): ('L', 'L;4'),
+              ('L', 8): ('L', 'L'), ('L', 16): ('I;16B', 'I;16B'),
+              ('RGB', 8): ('RGB', 'RGB'), ('RGB', 16): ('RGB', 'RGB;16B'),
+              ('CMYK', 8): ('CMYK', 'CMYK'),
+              ('P', 1): ('P', 'P;1'), ('P', 2): ('P', 'P;2'), ('P', 4): ('P', 'P;4'),
+              ('P', 8): ('P', 'P')}
+
+
+def _adobe_inverted(jpeg):
+    """Photoshop writes CMYK JPEGs inverted and marks them with an Adobe APP14 segment."""
+    return b'\xff\xeeAdobe' in jpeg[:jpeg.find(b'\xff\xda')]
+
+
+def decode_image(doc, stream, resources=None):
+    """The image XObject as a PIL image (RGB, L, 1, P, or with a soft mask LA/RGBA)."""
+    width, height = doc.resolve(stream.get('Width')), doc.resolve(stream.get('Height'))
+    bpc = doc.resolve(stream.get('BitsPerComponent')) or 8
+    data, codec, _ = doc.decode(stream)
+    decode = doc.resolve(stream.get('Decode'))
+    if codec in ('DCTDecode', 'JPXDecode'):
+        image = Image.open(io.BytesIO(data))
+        image.load()
+        if image.mode == 'CMYK' and codec == 'DCTDecode' and _adobe_inverted(data):
+            image = Image.eval(image, lambda v: 255 - v)
+        inverted = decode is not None and decode[:2] == [1, 0]
+    elif codec is not None:
+        raise ValueError(f"unsupported image filter {codec}")
+    else:
+        mode, n, palette = _colorspace(doc, stream.get('ColorSpace', 'DeviceGray'), resources)
+        inverted = mode == 'separation'
+        if inverted:
+            mode = 'L'
+        if (mode, bpc) not in _RAW_MODES:
+            raise ValueError(f"unsupported {mode} image with {bpc} bits per component")
+        pil_mode, raw_mode = _RAW_MODES[mode, bpc]
+        size = (width * n * bpc + 7) // 8 * height
+        image = Image.frombytes(pil_mode, (width, height), data[:size].ljust(size, b'\0'),
+                                'raw', raw_mode)
+        if palette is not None:
+            image.putpalette(palette)
+        if pil_mode == 'I;16B':
+            image = Image.fromarray((np.asarray(image) >> 8).astype(np.uint8), 'L')
+        if decode is not None and decode[:2] == [1, 0] and mode != 'P':
+            inverted = not inverted
+    if inverted:
+        image = Image.eval(image.convert('L' if image.mode in ('1', 'L') else 'RGB'),
+                           lambda v: 255 - v)
+    if image.mode in ('CMYK', 'I', 'I;16'):
+        image = image.convert('RGB')
+    smask = doc.resolve(stream.get('SMask'))
+    if isinstance(smask, Stream):
+        alpha = decode_image(doc, smask).convert('L')
+        if alpha.size != image.size:
+            alpha = alpha.resize(image.size, Image.BILINEAR)
+        image = image.convert('LA' if image.mode in ('1', 'L') else 'RGBA')
+        image.putalpha(alpha)
+    return image
+
+
+def image_crop_box(placement, box):
+    """Pixel box (left, top, right, bottom) of an image under a page-space box."""
+    a, b, c, d, e, f = placement.ctm
+    det = a * d - b * c
+    if det == 0:
+        raise ValueError(f"image {placement.name} is painted with a singular matrix")
+    width, height = placement.stream.get('Width'), placement.stream.get('Height')
+    us, vs = [], []
+    x0, y0, x1, y1 = box
+    for x, y in ((x0, y0), (x1, y0), (x0, y1), (x1, y1)):
+        us.append((d * (x - e) - c * (y - f)) / det)
+        vs.append((a * (y - f) - b * (x - e)) / det)
+    # Image row 0 is the top of the unit square
+    left, right = max(0, round(min(us) * width)), min(width, round(max(us) * width))
+    top, bottom = max(0, round((1 - max(vs)) * height)), min(height, round((1 - min(vs)) * height))
+    if left >= right or top >= bottom:
+        raise ValueError(f"crop box {list(box)} does not overlap image {placement.name}")
+    return left, top, right, bottom
+
+
+def _overlap(bbox, box):
+    w = min(bbox[2], box[2]) - max(bbox[0], box[0])
+    h = min(bbox[3], box[3]) - max(bbox[1], box[1])
+    return max(w, 0) * max(h, 0)
+
+
+def select_image(doc, spec):
+    """The Placement a manifest entry names, and its pixel crop box or None."""
+    page = doc.page(spec['page'])
+    images = doc.page_images(page)
+    crop = spec.get('crop')
+    if 'image' in spec:
+        if not 0 <= spec['image'] < len(images):
+            raise ValueError(f"page {spec['page']} has {len(images)} images, "
+                             f"no image {spec['image']}")
+        placement = images[spec['image']]
+    elif crop is not None:
+        covered = [(_overlap(placement_bbox(p.ctm), crop), i) for i, p in enumerate(images)]
+        area, index = max(covered, default=(0, None))
+        if not area:
+            raise ValueError(f"no image under crop box {crop} on page {spec['page']}")
+        placement = images[index]
+    else:
+        raise ValueError("a pdf_image entry needs an image index or a crop box")
+    return placement, page, (image_crop_box(placement, crop) if crop is not None else None)
+
+
+def extract(doc, spec, out):
+    """Write the image a manifest entry names to out (atomically)."""
+    placement, page, box = select_image(doc, spec)
+    stream = placement.stream
+    ext = os.path.splitext(out)[1].lower()
+    tmp = f'{out}.tmp-{os.getpid()}'
+    if (ext in ('.jpg', '.jpeg') and doc.codec(stream) == 'DCTDecode' and box is None
+            and stream.get('SMask') is None and stream.get('Decode') is None):
+        with open(tmp, 'wb') as f:
+            f.write(doc.decode(stream)[0])
+    else:
+        image = decode_image(doc, stream, doc.resolve(page.get('Resources')))
+        if box is not None:
+            image = image.crop(box)
+        if ext in ('.jpg', '.jpeg'):
+            image.convert('L' if image.mode in ('1', 'L', 'LA') else 'RGB').save(
+                tmp, format='JPEG', quality=JPEG_QUALITY)
+        elif ext == '.png':
+            image.save(tmp, format='PNG')
+        else:
+            raise ValueError(f"{out}: write images as .png or .jpg")
+    os.replace(tmp, out)
+
+
+def extract_pdf(pdf, jobs, root=ROOT):
+    """Extract [(target, spec)] from one PDF; returns [(target, seconds or None, error)]."""
+    results = []
+    try:
+        doc = PdfDocument(os.path.join(root, pdf))
+    except (OSError, ValueError) as e:
+        return [(target, None, f"{pdf}: {e}") for target, _ in jobs]
+    with doc:
+        for target, spec in jobs:
+            start = time.perf_counter()
+            out = os.path.join(root, target)
+            os.makedirs(os.path.dirname(out), exist_ok=True)
+            try:
+                extract(doc, spec, out)
+            except (OSError, ValueError, KeyError, IndexError, TypeError) as e:
+                results.append((target, None, f"{target}: {type(e).__name__}: {e}"))
+            else:
+                results.append((target, time.perf_counter() - start, None))
+    return results
+
+
+def image_specs(manifest):
+    return {target: spec for target, spec in manifest.items()
+            if spec.get('producer') == 'pdf_image'}
+
+
+def spec_key(target, spec, hashes):
+    payload = json.dumps({'version': EXTRACT_VERSION, 'target': target, 'spec': spec,
+                          'pdf': hashes.digest(spec['pdf'])}, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def load_state(path=STATE_PATH):
+    try:
+        with open(path, encoding='utf-8') as f:
+            state = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        state = {}
+    if state.get('version') != EXTRACT_VERSION:
+        state = {'version': EXTRACT_VERSION}
+    for section in ('files', 'targets'):
+        state.setdefault(section, {})
+    return state
+
+
+def save_state(state, path=STATE_PATH):
+    tmp = f'{path}.tmp-{os.getpid()}'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(state, f, indent=1, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def stale_by_pdf(specs, state, force=False, root=ROOT):
+    """{pdf: [(target, spec)]} of targets to extract, and {target: key} for all of them."""
+    hashes = FileHashes(state['files'], root)
+    stale, keys = {}, {}
+    for target, spec in sorted(specs.items()):
+        keys[target] = spec_key(target, spec, hashes)
+        recorded = state['targets'].get(target)
+        out = os.path.join(root, target)
+        if (force or recorded is None or recorded['key'] != keys[target]
+                or not os.path.exists(out) or recorded['stat'] != hashes.stat(target)):
+            stale.setdefault(spec['pdf'], []).append((target, spec))
+    return stale, keys
+
+
+def extract_all(specs, state, jobs=None, force=False, dry_run=False, root=ROOT, log=print):
+    """
+    Bring pdf_image targets up to date, one worker per PDF. Returns (built,
+    failed) lists of targets (the stale ones with dry_run).
+    """
+    hashes = FileHashes(state['files'], root)
+    stale, keys = stale_by_pdf(specs, state, force, root)
+    if dry_run or not stale:
+        return [target for group in stale.values() for target, _ in group], []
+    workers = min(jobs or os.cpu_count(), len(stale))
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(extract_pdf, pdf, group, root) for pdf, group in stale.items()]
+            results = [r for future in futures for r in future.result()]
+    else:
+        results = [r for pdf, group in stale.items() for r in extract_pdf(pdf, group, root)]
+    built, failed = [], []
+    for target, seconds, error in results:
+        if error is not None:
+            failed.append(target)
+            log(f"FAILED {error}")
+            continue
+        state['targets'][target] = {'key': keys[target], 'stat': hashes.stat(target)}
+        built.append(target)
+        log(f"extracted {target} ({seconds * 1000:.0f} ms)")
+    return built, failed
+
+
+def list_images(path, log=print):
+    """Print every page's images: index, size, color, filter and page-space bbox."""
+    with PdfDocument(path) as doc:
+        log(f"{path}: {len(doc.pages())} pages")
+        for number, page in enumerate(doc.pages(), 1):
+            for index, p in enumerate(doc.page_images(page)):
+                s = p.stream
+                cs = doc.resolve(s.get('ColorSpace'))
+                cs = doc.resolve(cs[0]) if isinstance(cs, list) else cs
+                codec = doc.codec(s)
+                bbox = ' '.join(f'{v:.0f}' for v in placement_bbox(p.ctm))
+                log(f"  page {number:3d} image {index:2d}  {s.get('Width')}x{s.get('Height')} "
+                    f"{cs or '-'} {s.get('BitsPerComponent') or '-'}bpc "
+                    f"{codec or 'raw'}{' +SMask' if s.get('SMask') else ''}  [{bbox}]")
+
+
+# Self-test
+
+def _pdf_value(v):
+    if isinstance(v, Name):
+        return b'/' + v.encode('latin-1')
+    if isinstance(v, Ref):
+        return f'{v.num} {v.gen} R'.encode()
+    if isinstance(v, dict):
+        return b'<<' + b''.join(_pdf_value(Name(k)) + b' ' + _pdf_value(x) + b' '
+                                for k, x in v.items()) + b'>>'
+    if isinstance(v, (list, tuple)):
+        return b'[' + b' '.join(_pdf_value(x) for x in v) + b']'
+    if isinstance(v, bytes):
+        return b'<' + v.hex().encode() + b'>'
+    if isinstance(v, bool):
+        return b'true' if v else b'false'
+    return str(v).encode()
+
+
+def _write_pdf(path, objects, compressed):
+    """
+    Write {num: dict or (dict, data)} as a PDF with the catalog as object 1:
+    with compressed, non-stream objects go into an object stream and the
+    cross-references into an xref stream with the Up predictor.
+    """
+    out = bytearray(b'%PDF-1.5\n%\xe2\xe3\xcf\xd3\n')
+    offsets, packed = {}, []
+    size = max(objects) + 3
+    for num, obj in sorted(objects.items()):
+        if compressed and not isinstance(obj, tuple):
+            packed.append(num)
+            continue
+        offsets[num] = len(out)
+        if isinstance(obj, tuple):
+            attrs, data = obj
+            out += f'{num} 0 obj\n'.encode() + _pdf_value(dict(attrs, Length=len(data)))
+            out += b'\nstream\r\n' + data + b'\r\nendstream\nendobj\n'
+        else:
+            out += f'{num} 0 obj\n'.encode() + _pdf_value(obj) + b'\nendobj\n'
+    if not compressed:
+        xref = len(out)
+        out += f'xref\n0 {size - 2}\n0000000000 65535 f\r\n'.encode()
+        for num in range(1, size - 2):
+            out += (f'{offsets[num]:010d} 00000 n\r\n' if num in offsets
+                    else '0000000000 00000 f\r\n').encode()
+        out += b'trailer\n' + _pdf_value({'Size': size - 2, 'Root': Ref(1, 0)})
+        out += f'\nstartxref\n{xref}\n%%EOF\n'.encode()
+    else:
+        stm, xref_num = size - 2, size - 1
+        bodies = [_pdf_value(objects[num]) for num in packed]
+        head, pos = [], 0
+        for num, body in zip(packed, bodies):
+            head.append(f'{num} {pos}')
+            pos += len(body) + 1
+        head = (' '.join(head) + '\n').encode()
+        data = head + b'\n'.join(bodies)
+        offsets[stm] = len(out)
+        out += f'{stm} 0 obj\n'.encode() + _pdf_value(
+            {'Type': Name('ObjStm'), 'N': len(packed), 'First': len(head),
+             'Filter': Name('FlateDecode'), 'Length': len(zlib.compress(data))})
+        out += b'\nstream\n' + zlib.compress(data) + b'\nendstream\nendobj\n'
+        offsets[xref_num] = len(out)
+        rows = []
+        for num in range(size):
+            if num in offsets:
+                rows.append(bytes([1]) + offsets[num].to_bytes(4, 'big') + bytes(2))
+            elif num in packed:
+                rows.append(bytes([2]) + stm.to_bytes(4, 'big') + packed.index(num).to_bytes(2, 'big'))
+            else:
+                rows.append(bytes(7))
+        table = np.frombuffer(b''.join(rows), np.uint8).reshape(size, 7)
+        up = np.diff(table, axis=0, prepend=np.zeros((1, 7), np.uint8))
+        encoded = zlib.compress(np.hstack([np.full((size, 1), 2, np.uint8), up]).tobytes())
+        out += f'{xref_num} 0 obj\n'.encode() + _pdf_value(
+            {'Type': Name('XRef'), 'Size': size, 'W': [1, 4, 2], 'Root': Ref(1, 0),
+             'Filter': Name('FlateDecode'),
+             'DecodeParms': {'Predictor': 12, 'Columns': 7}, 'Length': len(encoded)})
+        out += b'\nstream\n' + encoded + b'\nendstream\nendobj\n'
+        out += f'startxref\n{offsets[xref_num]}\n%%EOF\n'.encode()
+    with open(path, 'wb') as f:
+        f.write(out)
+
+
+def _png_filter(pixels, bpp):
+    """Encode rows with PNG predictors, cycling through all five filter types."""
+    rows = pixels.reshape(pixels.shape[0], -1).astype(np.int16)
+    out = []
+    for r, line in enumerate(rows):
+        up = rows[r - 1] if r else np.zeros_like(line)
+        left = np.concatenate([np.zeros(bpp, np.int16), line[:-bpp]])
+        upper_left = np.concatenate([np.zeros(bpp, np.int16), up[:-bpp]])
+        kind = r % 5
+        if kind == 0:
+            pred = 0
+        elif kind == 1:
+            pred = left
+        elif kind == 2:
+            pred = up
+        elif kind == 3:
+            pred = (left + up) >> 1
+        else:
+            p = left + up - upper_left
+            pa, pb, pc = abs(p - left), abs(p - up), abs(p - upper_left)
+            pred = np.where((pa <= pb) & (pa <= pc), left, np.where(pb <= pc, up, upper_left))
+        out.append(bytes([kind]) + ((line - pred) & 0xFF).astype(np.uint8).tobytes())
+    return b''.join(out)
+
+
+def check(log=print):
+    """
+    Extract from synthetic PDFs written with classic and with compressed
+    cross-references: a JPEG, a predictor-encoded RGB image with a soft mask
+    inside a Form XObject, and a 4-bit Indexed image on a page inheriting its
+    resources. Then verify that the cache skips unchanged targets and that a
+    new entry only reads its own PDF.
+    """
+    rng = np.random.default_rng(0)
+    yy, xx = np.mgrid[0:40, 0:64]
+    photo = np.dstack([xx * 4, yy * 6, (xx + yy) * 2]).astype(np.uint8)
+    jpeg = io.BytesIO()
+    Image.fromarray(photo).save(jpeg, format='JPEG', quality=90)
+    jpeg = jpeg.getvalue()
+    rgb = rng.integers(0, 256, (30, 20, 3), dtype=np.uint8)
+    alpha = np.tile(np.arange(20, dtype=np.uint8) * 12, (30, 1))
+    palette = rng.integers(0, 256, (16, 3), dtype=np.uint8)
+    indices = rng.integers(0, 16, (10, 9), dtype=np.uint8)
+    packed = np.hstack([indices, np.zeros((10, 1), np.uint8)]).reshape(10, 5, 2)
+    packed = (packed[..., 0] << 4 | packed[..., 1]).tobytes()
+
+    page1 = b'q 128 0 0 80 100 600 cm /Im1 Do Q\nBI /W 2 /H 1 /CS /G /BPC 8 ID \x7fEI EI\n' \
+            b'(a \\) Do string) Tj q 1 0 0 1 200 100 cm /Fm1 Do Q'
+    form = b'q 60 0 0 90 0 0 cm /Im2 Do Q'
+    objects = {
+        1: {'Type': Name('Catalog'), 'Pages': Ref(2, 0)},
+        2: {'Type': Name('Pages'), 'Kids': [Ref(3, 0), Ref(4, 0)], 'Count': 2,
+            'MediaBox': [0, 0, 612, 792],
+            'Resources': {'XObject': {'Im3': Ref(9, 0)}}},
+        3: {'Type': Name('Page'), 'Parent': Ref(2, 0), 'Contents': Ref(5, 0),
+            'Resources': {'XObject': {'Im1': Ref(6, 0), 'Fm1': Ref(7, 0)}}},
+        4: {'Type': Name('Page'), 'Parent': Ref(2, 0), 'Contents': Ref(10, 0)},
+        5: ({'Filter': Name('FlateDecode')}, zlib.compress(page1)),
+        6: ({'Type': Name('XObject'), 'Subtype': Name('Image'), 'Width': 64, 'Height': 40,
+             'ColorSpace': Name('DeviceRGB'), 'BitsPerComponent': 8,
+             'Filter': Name('DCTDecode')}, jpeg),
+        7: ({'Type': Name('XObject'), 'Subtype': Name('Form'), 'BBox': [0, 0, 60, 90],
+             'Matrix': [1, 0, 0, 1, 10, 20], 'Resources': {'XObject': {'Im2': Ref(8, 0)}}},
+            form),
+        8: ({'Type': Name('XObject'), 'Subtype': Name('Image'), 'Width': 20, 'Height': 30,
+             'ColorSpace': [Name('ICCBased'), Ref(12, 0)], 'BitsPerComponent': 8,
+             'SMask': Ref(11, 0), 'Filter': Name('FlateDecode'),
+             'DecodeParms': {'Predictor': 15, 'Colors': 3, 'Columns': 20}},
+            zlib.compress(_png_filter(rgb, 3))),
+        9: ({'Type': Name('XObject'), 'Subtype': Name('Image'), 'Width': 9, 'Height': 10,
+             'ColorSpace': [Name('Indexed'), Name('DeviceRGB'), 15, palette.tobytes()],
+             'BitsPerComponent': 4, 'Filter': [Name('ASCIIHexDecode'), Name('FlateDecode')]},
+            zlib.compress(packed).hex().encode() + b'>'),
+        10: ({}, b'q 90 0 0 100 0 0 cm /Im3 Do Q'),
+        11: ({'Type': Name('XObject'), 'Subtype': Name('Image'), 'Width': 20, 'Height': 30,
+              'ColorSpace': Name('DeviceGray'), 'BitsPerComponent': 8}, alpha.tobytes()),
+        12: ({'N': 3}, b''),
+    }
+    expected_rgba = np.dstack([rgb, alpha])
+    expected_indexed = palette[indices]
+    # Form matrix then cm: the image spans x 210..270, y 120..210
+    crop = [225, 150, 240, 180]
+    crop_rows = slice(round((1 - 60 / 90) * 30), round((1 - 30 / 90) * 30))
+    crop_cols = slice(round(15 / 60 * 20), round(30 / 60 * 20))
+
+    with tempfile.TemporaryDirectory() as root:
+        for compressed in (False, True):
+            name = 'compressed' if compressed else 'classic'
+            pdf = f'{name}.pdf'
+            _write_pdf(os.path.join(root, pdf), objects, compressed)
+            specs = {f'out/{name}-photo.jpg': {'producer': 'pdf_image', 'pdf': pdf,
+                                               'page': 1, 'image': 0},
+                     f'out/{name}-masked.png': {'producer': 'pdf_image', 'pdf': pdf,
+                                                'page': 1, 'image': 1},
+                     f'out/{name}-crop.png': {'producer': 'pdf_image', 'pdf': pdf,
+                                              'page': 1, 'crop': crop},
+                     f'out/{name}-indexed.png': {'producer': 'pdf_image', 'pdf': pdf,
+                                                 'page': 2, 'image': 0}}
+            results = extract_pdf(pdf, list(specs.items()), root)
+            errors = [error for _, _, error in results if error]
+            if errors:
+                raise AssertionError('\n'.join(errors))
+
+            def read(target):
+                return np.asarray(Image.open(os.path.join(root, target)))
+            with open(os.path.join(root, f'out/{name}-photo.jpg'), 'rb') as f:
+                assert f.read() == jpeg, f"{name}: JPEG was not copied verbatim"
+            assert np.array_equal(read(f'out/{name}-masked.png'), expected_rgba), \
+                f"{name}: predictor/soft mask image differs"
+            assert np.array_equal(read(f'out/{name}-crop.png'),
+                                  expected_rgba[crop_rows, crop_cols]), f"{name}: crop differs"
+            indexed = Image.open(os.path.join(root, f'out/{name}-indexed.png')).convert('RGB')
+            assert np.array_equal(np.asarray(indexed), expected_indexed), \
+                f"{name}: indexed image differs"
+            with PdfDocument(os.path.join(root, pdf)) as doc:
+                boxes = [placement_bbox(p.ctm) for p in doc.page_images(doc.page(1))]
+            assert boxes == [(100, 600, 228, 680), (210, 120, 270, 210)], boxes
+            log(f"{name} xref: {len(results)} images extracted and verified")
+
+        # Caching: extract everything, re-run, then add one entry
+        specs = {f'out/{kind}-{i}.png': {'producer': 'pdf_image', 'pdf': f'{kind}.pdf',
+                                         'page': 1, 'image': i}
+                 for kind in ('classic', 'compressed') for i in (0, 1)}
+        state = {'version': EXTRACT_VERSION, 'files': {}, 'targets': {}}
+        quiet = lambda *a: None
+        mtimes = lambda: {p: os.stat(os.path.join(root, p)).st_mtime_ns for p in specs}
+        built, failed = extract_all(specs, state, jobs=2, root=root, log=quiet)
+        assert sorted(built) == sorted(specs) and not failed, (built, failed)
+        before = mtimes()
+        built, _ = extract_all(specs, state, root=root, log=quiet)
+        assert built == [] and mtimes() == before, "unchanged targets were re-extracted"
+        specs['out/compressed-extra.png'] = {'producer': 'pdf_image',
+                                             'pdf': 'compressed.pdf', 'page': 2, 'image': 0}
+        stale, _ = stale_by_pdf(specs, state, root=root)
+        assert list(stale) == ['compressed.pdf'] and len(stale['compressed.pdf']) == 1, stale
+        built, _ = extract_all(specs, state, root=root, log=quiet)
+        assert built == ['out/compressed-extra.png'], built
+        log("cache: unchanged targets skipped; a new entry re-read only its own PDF")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('targets', nargs='*',
+                        help='pdf_image figures to extract, by path or file name (default: all)')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='PDFs processed concurrently (default: all cores)')
+    parser.add_argument('--force', action='store_true', help='extract even if up to date')
+    parser.add_argument('-n', '--dry-run', action='store_true', help='only list stale figures')
+    parser.add_argument('--list', nargs='+', metavar='PDF',
+                        help="list the images on each page of these PDFs")
+    parser.add_argument('--check', action='store_true',
+                        help='self-test on synthetic PDFs')
+    args = parser.parse_args()
+
+    if args.check:
+        check()
+        return 0
+    if args.list:
+        failed = 0
+        for path in args.list:
+            try:
+                list_images(path)
+            except (OSError, ValueError) as e:
+                print(f"{path}: {e}")
+                failed += 1
+        return 1 if failed else 0
+
+    start = time.perf_counter()
+    specs = image_specs(load_manifest())
+    if args.targets:
+        specs = {t: s for t, s in specs.items()
+                 if t in args.targets or os.path.basename(t) in args.targets}
+        unknown = set(args.targets) - set(specs) - {os.path.basename(t) for t in specs}
+        if unknown:
+            parser.error(f"not pdf_image figures: {', '.join(sorted(unknown))}")
+    state = load_state()
+    try:
+        built, failed = extract_all(specs, state, args.jobs, args.force, args.dry_run)
+    finally:
+        if not args.dry_run:
+            save_state(state)
+    elapsed = time.perf_counter() - start
+    if args.dry_run:
+        print('\n'.join(f"stale  {t}" for t in built) or 'Nothing to extract')
+    elif not built and not failed:
+        print(f"{len(specs)} images up to date ({elapsed * 1000:.0f} ms)")
+    else:
+        print(f"Extracted {len(built)}, failed {len(failed)} in {elapsed:.1f} s")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,494 @@
+#!/usr/bin/env python3
+"""
+Print-size variants of the figures, resampled for the width each document prints them at.
+
+The maps are saved at 300 dpi over the whole figure and the PDF page
+renders at 150-200 dpi over the whole page, but the documents include them
+at `width=0.42\\columnwidth`, `0.6\\textwidth` and so on, so most of those
+pixels never reach the paper and only make the PDFs large and slow to build.
+
+For every \\includegraphics this reads the width (or height, or scale)
+option and works out the document's \\textwidth and \\columnwidth from its
+class options (font size, paper, twocolumn), the geometry package settings
+and \\columnsep, as the article class and geometry do. The printed size
+times --dpi (300 by default) is the pixel size the figure needs. A figure
+with more pixels than that is resampled and recompressed, a PNG with an
+opaque alpha channel losing it. Resampling averages over each output pixel
+(a box filter). It does not ring like Lanczos, and it keeps the flat areas
+of the maps flat, so they still compress well; a Lanczos map variant came
+out larger than the full-size map. Figures are never upscaled: one already
+small enough gets no variant, and neither does one whose variant is not
+smaller on disk, so the original is used.
+
+Variants are cached in .print_cache/ under a key of the source's SHA-256,
+the pixel size and VARIANT_VERSION, so each size of a figure is made once,
+and missing ones are made in parallel. Each document gets its variants
+linked into figures/print/<document>/, the first directory of its
+\\graphicspath, under the name it includes; LaTeX falls back to the full
+figure wherever there is no variant. build.py runs this stage after
+building; `python print_sizes.py --list` shows the sizes and `--check` runs
+a self-test.
+"""
+
+import argparse
+import hashlib
+import json
+import math
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image
+
+from build import (PRINT_DIR, ROOT, FileHashes, load_manifest, resolve,
+                   scan_documents)
+
+FIGURES_DIR = os.path.dirname(os.path.abspath(__file__))
+CACHE_DIR = 'figures/.print_cache'
+STATE_PATH = os.path.join(FIGURES_DIR, '.print_state.json')
+
+# Bump when resampling or compression changes
+VARIANT_VERSION = 1
+
+PRINT_DPI = 300
+JPEG_QUALITY = 90
+
+# Paper sizes (width, height) in inches, by class or geometry option
+PAPER_SIZES = {
+    'letterpaper': (8.5, 11.0), 'legalpaper': (8.5, 14.0), 'executivepaper': (7.25, 10.5),
+    'a4paper': (210 / 25.4, 297 / 25.4), 'a5paper': (148 / 25.4, 210 / 25.4),
+    'b5paper': (176 / 25.4, 250 / 25.4),
+}
+
+# Inches per unit; TeX points are 1/72.27 in, PostScript (big) points 1/72
+UNITS = {'in': 1.0, 'cm': 1 / 2.54, 'mm': 1 / 25.4, 'pt': 1 / 72.27, 'bp': 1 / 72.0,
+         'pc': 12 / 72.27}
+
+# The article class's \textwidth cap per column (size1x.clo) and \columnsep
+ARTICLE_TEXTWIDTH_PT = {10: 345, 11: 360, 12: 390}
+ARTICLE_COLUMNSEP_PT = 10
+
+# geometry's text width when no margins or width are given, as a fraction of the paper
+GEOMETRY_HSCALE = 0.7
+
+# Resolution pdflatex assumes for bitmaps with no density set
+DEFAULT_IMAGE_DPI = 72
+
+# Text and column widths of a document, in inches
+Layout = namedtuple('Layout', 'paperwidth textwidth columnwidth')
+
+# One figure of one document: the name it includes (with the extension LaTeX
+# resolves), the source file, the printed size in inches and the pixel size
+# of the source and of the variant (None when the source is small enough)
+Figure = namedtuple('Figure', 'tex name source printed source_px target_px')
+
+_DOCUMENTCLASS = re.compile(r'\\documentclass\s*(?:\[([^\]]*)\])?\s*\{([^}]*)\}')
+_GEOMETRY_PACKAGE = re.compile(r'\\usepackage\s*(?:\[([^\]]*)\])?\s*\{[^}]*\bgeometry\b[^}]*\}')
+_GEOMETRY = re.compile(r'\\geometry\s*\{([^}]*)\}')
+_COLUMNSEP = re.compile(r'\\setlength\s*\{?\s*\\columnsep\s*\}?\s*\{([^}]*)\}')
+_LENGTH = re.compile(r'([+-]?(?:\d+\.?\d*|\.\d+)?)\s*'
+                     r'(\\columnwidth|\\linewidth|\\textwidth|\\hsize|\\paperwidth'
+                     r'|in|cm|mm|pt|bp|pc)')
+_COMMENT = re.compile(r'(?<!\\)%.*')
+
+
+def keyvals(options):
+    """{key: value} of a LaTeX key=value option list; bare flags map to True."""
+    result = {}
+    for item in (options or '').split(','):
+        key, sep, value = item.partition('=')
+        if key.strip():
+            result[key.strip()] = value.strip().strip('{}').strip() if sep else True
+    return result
+
+
+def parse_length(expr, layout=None):
+    """Inches for a length such as 3in, 0.6\\textwidth or \\linewidth; None if not understood."""
+    m = _LENGTH.fullmatch(str(expr).strip())
+    if m is None:
+        return None
+    factor = float(m.group(1)) if m.group(1) not in ('', '+', '-') else 1.0
+    unit = m.group(2)
+    if unit in UNITS:
+        return factor * UNITS[unit]
+    if layout is None:
+        return None
+    if unit == '\\paperwidth':
+        return factor * layout.paperwidth
+    if unit == '\\textwidth':
+        return factor * layout.textwidth
+    # \linewidth and \hsize: the column, outside lists and minipages
+    return factor * layout.columnwidth
+
+
+def document_layout(text):
+    """Layout of a document from its preamble (article-class rules and geometry)."""
+    text = _COMMENT.sub('', text)
+    m = _DOCUMENTCLASS.search(text)
+    class_options = keyvals(m.group(1) if m else '')
+    font_size = next((int(o[:-2]) for o in class_options if re.fullmatch(r'1[012]pt', o)), 10)
+    paper = next((PAPER_SIZES[o] for o in class_options if o in PAPER_SIZES),
+                 PAPER_SIZES['letterpaper'])
+    twocolumn = 'twocolumn' in class_options
+
+    geometry, has_geometry = {}, False
+    for m in _GEOMETRY_PACKAGE.finditer(text):
+        has_geometry = True
+        geometry.update(keyvals(m.group(1)))
+    for m in _GEOMETRY.finditer(text):
+        geometry.update(keyvals(m.group(1)))
+    if has_geometry:
+        paper = next((PAPER_SIZES[o] for o in geometry if o in PAPER_SIZES), paper)
+        if geometry.get('paper', geometry.get('papername')) in PAPER_SIZES:
+            paper = PAPER_SIZES[geometry.get('paper', geometry.get('papername'))]
+        if 'landscape' in geometry:
+            paper = paper[::-1]
+        twocolumn = twocolumn or 'twocolumn' in geometry
+    paperwidth = paper[0]
+
+    if not has_geometry:
+        cap = ARTICLE_TEXTWIDTH_PT.get(font_size, ARTICLE_TEXTWIDTH_PT[10]) * UNITS['pt']
+        textwidth = min(paperwidth - 2.0, (2 if twocolumn else 1) * cap)
+    elif 'textwidth' in geometry or 'width' in geometry:
+        textwidth = parse_length(geometry.get('textwidth', geometry.get('width')))
+    else:
+        hmargin = str(geometry.get('hmargin', '')).split(',')
+        margin = geometry.get('margin')
+
+        def side(keys, default):
+            for key in keys:
+                if key in geometry:
+                    return parse_length(geometry[key])
+            return parse_length(default) if default else None
+        left = side(('left', 'lmargin', 'inner'), hmargin[0] or margin)
+        right = side(('right', 'rmargin', 'outer'), hmargin[-1] or margin)
+        if left is None and right is None:
+            textwidth = float(geometry.get('hscale', GEOMETRY_HSCALE)) * paperwidth
+        else:
+            textwidth = paperwidth - (left if left is not None else right) \
+                - (right if right is not None else left)
+
+    m = _COLUMNSEP.search(text)
+    columnsep = parse_length(m.group(1)) if m else parse_length(geometry.get('columnsep', ''))
+    if columnsep is None:
+        columnsep = ARTICLE_COLUMNSEP_PT * UNITS['pt']
+    columnwidth = (textwidth - columnsep) / 2 if twocolumn else textwidth
+    return Layout(paperwidth, textwidth, columnwidth)
+
+
+def printed_size(options, layout, natural):
+    """
+    (width, height) in inches an \\includegraphics with these options prints
+    at, given the image's natural size; None if an option is not understood.
+    """
+    opts = keyvals(options)
+    angle = float(opts.get('angle', 0) or 0)
+    quarter_turn = abs(angle) % 180 == 90
+    w0, h0 = natural[::-1] if quarter_turn else natural
+    width = parse_length(opts['width'], layout) if 'width' in opts else None
+    height = next((parse_length(opts[k], layout) for k in ('height', 'totalheight')
+                   if k in opts), None)
+    if (width is None and 'width' in opts) or (height is None and
+                                                ('height' in opts or 'totalheight' in opts)):
+        return None
+    if width is not None and height is not None:
+        if 'keepaspectratio' in opts:
+            scale = min(width / w0, height / h0)
+            width, height = w0 * scale, h0 * scale
+    elif width is not None:
+        height = h0 * width / w0
+    elif height is not None:
+        width = w0 * height / h0
+    else:
+        scale = float(opts.get('scale', 1))
+        width, height = w0 * scale, h0 * scale
+    return (height, width) if quarter_turn else (width, height)
+
+
+def target_pixels(source_px, printed, dpi):
+    """Pixel size for printing at dpi, or None if the source has no more than that."""
+    target = tuple(min(s, math.ceil(inches * dpi - 1e-6)) for s, inches in zip(source_px, printed))
+    return None if target == tuple(source_px) else target
+
+
+def plan(manifest, dpi=PRINT_DPI, root=ROOT, log=print):
+    """Figures of every document, with the variant size each needs."""
+    layouts, figures = {}, {}
+    for tex, name, dirs, options in scan_documents(root):
+        if tex not in layouts:
+            with open(os.path.join(root, tex), encoding='utf-8') as f:
+                layouts[tex] = document_layout(f.read())
+        path = resolve(name, dirs, manifest, root)
+        if path is None or not os.path.exists(os.path.join(root, path)):
+            continue
+        ext = os.path.splitext(path)[1].lower()
+        if ext not in ('.png', '.jpg', '.jpeg'):
+            continue
+        with Image.open(os.path.join(root, path)) as image:
+            source_px = image.size
+            image_dpi = image.info.get('dpi', (DEFAULT_IMAGE_DPI,) * 2)
+        natural = tuple(px / (d or DEFAULT_IMAGE_DPI) for px, d in zip(source_px, image_dpi))
+        printed = printed_size(options, layouts[tex], natural)
+        if printed is None:
+            log(f"{tex}: cannot size {name} [{options}]; using the full figure")
+            continue
+        variant = name if os.path.splitext(name)[1] else name + os.path.splitext(path)[1]
+        figure = Figure(tex, os.path.normpath(variant), path, printed, source_px,
+                        target_pixels(source_px, printed, dpi))
+        # A figure used twice in a document gets the larger of its sizes
+        previous = figures.get((tex, figure.name))
+        if previous is None or previous.target_px and (
+                figure.target_px is None or figure.target_px[0] > previous.target_px[0]):
+            figures[tex, figure.name] = figure
+    return list(figures.values())
+
+
+def density(figure):
+    """
+    Pixels per inch a variant is tagged with, so one included without a width
+    keeps its natural size.
+    """
+    return round(figure.target_px[0] / figure.printed[0], 3)
+
+
+def variant_key(figure, hashes):
+    payload = json.dumps({'version': VARIANT_VERSION, 'source': hashes.digest(figure.source),
+                          'size': figure.target_px, 'dpi': density(figure),
+                          'jpeg_quality': JPEG_QUALITY}, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def make_variant(source, size, out, dpi):
+    """Resample source to size and write it to out, recompressed (atomically)."""
+    ext = os.path.splitext(out)[1].lower()
+    with Image.open(source) as image:
+        if ext in ('.jpg', '.jpeg'):
+            # Let the JPEG decoder skip the resolution it would throw away
+            image.draft('RGB', size)
+        image = image.convert({'P': 'RGBA', 'LA': 'RGBA', '1': 'L'}.get(image.mode, image.mode))
+        if image.mode == 'RGBA' and image.getchannel('A').getextrema()[0] == 255:
+            image = image.convert('RGB')
+        resized = image.resize(size, Image.BOX)
+    tmp = f'{out}.tmp-{os.getpid()}'
+    if ext == '.png':
+        resized.save(tmp, format='PNG', optimize=True, dpi=(dpi, dpi))
+    else:
+        resized.save(tmp, format='JPEG', quality=JPEG_QUALITY, optimize=True, dpi=(dpi, dpi))
+    os.replace(tmp, out)
+    return out
+
+
+def _make(job):
+    return make_variant(*job)
+
+
+def _link(src, dest):
+    if os.path.lexists(dest):
+        os.remove(dest)
+    try:
+        os.link(src, dest)
+    except OSError:
+        shutil.copy2(src, dest)
+
+
+def load_state(path=STATE_PATH):
+    try:
+        with open(path, encoding='utf-8') as f:
+            state = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        state = {}
+    if state.get('version') != VARIANT_VERSION:
+        state = {'version': VARIANT_VERSION}
+    for section in ('files', 'links'):
+        state.setdefault(section, {})
+    return state
+
+
+def save_state(state, path=STATE_PATH):
+    tmp = f'{path}.tmp-{os.getpid()}'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(state, f, indent=1, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def update(figures, state, jobs=None, prune=False, root=ROOT, log=print):
+    """
+    Make missing variants (in parallel) and link each document's into
+    figures/print/<document>/; remove links no figure needs any more.
+    Returns the number of variants made.
+    """
+    hashes = FileHashes(state['files'], root)
+    cache_dir = os.path.join(root, CACHE_DIR)
+    os.makedirs(cache_dir, exist_ok=True)
+    links, keys = {}, {}
+    for figure in figures:
+        if figure.target_px is None:
+            continue
+        key = variant_key(figure, hashes)
+        keys[key] = figure
+        doc = os.path.splitext(figure.tex)[0]
+        links[os.path.join(PRINT_DIR, doc, figure.name)] = key
+
+    def cached(key):
+        return os.path.join(cache_dir, key + os.path.splitext(keys[key].name)[1].lower())
+    missing = [key for key in keys if not os.path.exists(cached(key))]
+    jobs_list = [(os.path.join(root, keys[k].source), keys[k].target_px, cached(k),
+                  density(keys[k])) for k in missing]
+    start = time.perf_counter()
+    workers = min(jobs or os.cpu_count(), len(jobs_list))
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(_make, jobs_list))
+    else:
+        for job in jobs_list:
+            _make(job)
+    for key in missing:
+        figure = keys[key]
+        before, after = (os.path.getsize(os.path.join(root, figure.source)),
+                         os.path.getsize(cached(key)))
+        log(f"variant {figure.source} {figure.source_px[0]}x{figure.source_px[1]} -> "
+            f"{figure.target_px[0]}x{figure.target_px[1]} "
+            f"({before / 1e6:.2f} -> {after / 1e6:.2f} MB"
+            f"{'; not smaller, the original is used' if after >= before else ''})")
+    if missing:
+        log(f"Made {len(missing)} print variants in {time.perf_counter() - start:.1f} s")
+
+    for dest, key in list(links.items()):
+        if os.path.getsize(cached(key)) >= os.path.getsize(os.path.join(root, keys[key].source)):
+            del links[dest]
+            continue
+        path = os.path.join(root, dest)
+        recorded = state['links'].get(dest)
+        if recorded == key and os.path.exists(path):
+            continue
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        _link(cached(key), path)
+        state['links'][dest] = key
+    print_dir = os.path.join(root, PRINT_DIR)
+    for dirpath, _, files in os.walk(print_dir, topdown=False):
+        for name in files:
+            dest = os.path.relpath(os.path.join(dirpath, name), root)
+            if dest not in links:
+                os.remove(os.path.join(dirpath, name))
+                state['links'].pop(dest, None)
+        if dirpath != print_dir and not os.listdir(dirpath):
+            os.rmdir(dirpath)
+    if prune:
+        used = {os.path.basename(cached(key)) for key in keys}
+        for name in os.listdir(cache_dir):
+            if name not in used:
+                os.remove(os.path.join(cache_dir, name))
+    return len(missing)
+
+
+def run(dpi=PRINT_DPI, jobs=None, prune=False, log=print):
+    """The stage as build.py runs it: plan, update and save the state."""
+    state = load_state()
+    try:
+        return update(plan(load_manifest(), dpi, log=log), state, jobs, prune, log=log)
+    finally:
+        save_state(state)
+
+
+def format_plan(figures, dpi):
+    lines = [f"{'document':34s} {'figure':36s} {'printed in':>10s} {'source px':>11s} "
+             f"{f'{dpi} dpi px':>11s}"]
+    for f in sorted(figures):
+        target = f"{f.target_px[0]}x{f.target_px[1]}" if f.target_px else 'original'
+        lines.append(f"{f.tex:34s} {f.name:36s} {f.printed[0]:5.2f}x{f.printed[1]:<4.2f} "
+                     f"{f.source_px[0]:>5d}x{f.source_px[1]:<5d} {target:>11s}")
+    return '\n'.join(lines)
+
+
+def check(log=print):
+    """
+    Lay out synthetic documents and verify the computed widths against the
+    article class and geometry, the variant sizes, that nothing is upscaled,
+    and that a second run and a switch back to an earlier dpi make nothing.
+    """
+    cases = [
+        (r'\documentclass[10pt,letterpaper,twocolumn]{article}\usepackage[margin=0.6in]{geometry}',
+         (7.3, (7.3 - 10 / 72.27) / 2)),
+        (r'\documentclass[12pt]{article}\usepackage{geometry}\geometry{margin=1in}', (6.5, 6.5)),
+        (r'\documentclass[11pt]{article}', (360 / 72.27, 360 / 72.27)),
+        (r'\documentclass[twocolumn]{article}', (6.5, (6.5 - 10 / 72.27) / 2)),
+        (r'\documentclass[a4paper]{article}\usepackage{geometry}', (0.7 * 210 / 25.4,) * 2),
+        (r'\documentclass{article}\usepackage[left=1in,right=2cm]{geometry}'
+         r'\setlength{\columnsep}{0.5in}', (8.5 - 1 - 2 / 2.54,) * 2),
+    ]
+    for preamble, (textwidth, columnwidth) in cases:
+        layout = document_layout(preamble)
+        assert abs(layout.textwidth - textwidth) < 1e-6, (preamble, layout)
+        assert abs(layout.columnwidth - columnwidth) < 1e-6, (preamble, layout)
+    layout = Layout(8.5, 6.5, 3.0)
+    assert printed_size('width=0.5\\textwidth', layout, (4, 2)) == (3.25, 1.625)
+    assert printed_size('angle=90,height=1in', layout, (4, 2)) == (1.0, 0.5)
+    assert printed_size('width=\\linewidth,height=1in,keepaspectratio', layout, (4, 2)) == (2, 1)
+    assert printed_size('scale=0.5', layout, (4, 2)) == (2, 1)
+    assert printed_size('width=\\dimexpr 2in', layout, (4, 2)) is None
+    log(f"layouts: {len(cases)} preambles and 5 \\includegraphics forms sized correctly")
+
+    with tempfile.TemporaryDirectory() as root:
+        os.makedirs(os.path.join(root, 'figs'))
+        big = Image.frombytes('RGB', (1200, 750), os.urandom(1200 * 750 * 3))
+        big.convert('RGBA').save(os.path.join(root, 'figs', 'map.png'), dpi=(300, 300))
+        big.crop((0, 0, 100, 100)).save(os.path.join(root, 'figs', 'small.jpg'))
+        with open(os.path.join(root, 'doc.tex'), 'w', encoding='utf-8') as f:
+            f.write(cases[0][0] + '\n\\graphicspath{{figures/print/doc/}{figs/}}\n'
+                    '\\includegraphics[width=0.42\\columnwidth]{map}\n'
+                    '\\includegraphics[width=0.95\\columnwidth]{map}\n'
+                    '% \\includegraphics[width=\\textwidth]{map}\n'
+                    '\\includegraphics[width=\\textwidth]{small.jpg}\n')
+        state = {'version': VARIANT_VERSION, 'files': {}, 'links': {}}
+        quiet = lambda *a: None
+        figures = plan({}, 300, root, log=quiet)
+        by_name = {f.name: f for f in figures}
+        width = math.ceil(0.95 * cases[0][1][1] * 300)
+        target = by_name['map.png'].target_px
+        assert target[0] == width and abs(target[1] - 750 * width / 1200) <= 1, by_name
+        assert by_name['small.jpg'].target_px is None, "small.jpg would be upscaled"
+        assert update(figures, state, root=root, log=quiet) == 1
+        variant = os.path.join(root, PRINT_DIR, 'doc', 'map.png')
+        with Image.open(variant) as image:
+            assert image.size == by_name['map.png'].target_px and image.mode == 'RGB', image
+        assert not os.path.exists(os.path.join(root, PRINT_DIR, 'doc', 'small.jpg'))
+        assert update(plan({}, 300, root, log=quiet), state, root=root, log=quiet) == 0
+        assert update(plan({}, 150, root, log=quiet), state, root=root, log=quiet) == 1
+        assert update(plan({}, 300, root, log=quiet), state, root=root, log=quiet) == 0, \
+            "switching back to 300 dpi resampled again"
+        log(f"variants: map.png 1200 px -> {width} px at 300 dpi, small.jpg kept, "
+            f"cached sizes reused")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--dpi', type=int, default=PRINT_DPI, help='target print resolution')
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help='variants made concurrently (default: all cores)')
+    parser.add_argument('--prune', action='store_true',
+                        help='delete cached variants no document uses at this dpi')
+    parser.add_argument('--list', action='store_true',
+                        help='show each figure\'s printed and pixel sizes')
+    parser.add_argument('--check', action='store_true', help='self-test on synthetic documents')
+    args = parser.parse_args()
+
+    if args.check:
+        check()
+        return 0
+    if args.list:
+        print(format_plan(plan(load_manifest(), args.dpi), args.dpi))
+        return 0
+    start = time.perf_counter()
+    made = run(args.dpi, args.jobs, args.prune)
+    if not made:
+        print(f"Print variants up to date ({(time.perf_counter() - start) * 1000:.0f} ms)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
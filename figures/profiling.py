@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+"""
+Opt-in stage profiling for the map pipelines.
+
+Pipeline code marks its stages with `with stage('dem.smooth'):` or the
+@staged('draw') decorator, and stages nest. While no trace is active (the
+default) a stage does nothing but check a global, so the marks stay in the
+code and any stage added later shows up in traces with no further wiring.
+
+Inside tracing() every stage records its wall time, the process CPU time
+and the peak memory it allocated above the level at its start. Memory is
+traced with tracemalloc, which numpy reports its buffers to. That slows
+Python-heavy stages (matplotlib drawing) down, so memory=False gives
+undistorted timings. The trace is written as JSON, and optionally in the
+Chrome trace event format, which chrome://tracing, Perfetto and speedscope
+open. One stage, chosen by name, can also be run under cProfile.
+
+The map scripts take --trace, --chrome-trace and --profile-stage, e.g.
+`python create_territory_map_geo.py --no-cache --trace trace.json
+--profile-stage shade.rgb`.
+"""
+
+import argparse
+import cProfile
+import functools
+import io
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+TRACE_VERSION = 1
+
+# Rows of cProfile statistics printed for --profile-stage
+PROFILE_ROWS = 20
+
+# The active Trace, or None when profiling is off
+_active = None
+
+
+class Trace:
+    """Stage records of one traced run."""
+
+    def __init__(self, memory=True, profile_stage=None):
+        self.memory = memory
+        self.profile_stage = profile_stage
+        self.profile = cProfile.Profile() if profile_stage else None
+        self.profile_calls = 0
+        self.stages = []
+        self.thread = threading.current_thread()
+        self._stack = []
+        self._origin = time.perf_counter()
+        self.started = time.time()
+
+    def enter(self, name, args):
+        current = 0
+        if self.memory:
+            current, peak = tracemalloc.get_traced_memory()
+            if self._stack:
+                self._stack[-1]['_peak'] = max(self._stack[-1]['_peak'], peak)
+            tracemalloc.reset_peak()
+        record = dict(name=name, depth=len(self._stack), start=time.perf_counter() - self._origin,
+                      _cpu=time.process_time(), _base=current, _peak=current)
+        if args:
+            record['args'] = args
+        self.stages.append(record)
+        self._stack.append(record)
+        if name == self.profile_stage and self.profile_calls == 0:
+            self.profile.enable()
+            record['_profiling'] = True
+        return record
+
+    def exit(self, record, error=None):
+        if record.pop('_profiling', False):
+            self.profile.disable()
+            self.profile_calls += 1
+        record['wall'] = time.perf_counter() - self._origin - record['start']
+        record['cpu'] = time.process_time() - record.pop('_cpu')
+        base, peak = record.pop('_base'), record.pop('_peak')
+        if self.memory:
+            peak = max(peak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+            record['peak_bytes'] = peak - base
+        self._stack.pop()
+        if self._stack:
+            self._stack[-1]['_peak'] = max(self._stack[-1]['_peak'], peak)
+        if error is not None:
+            record['error'] = error
+
+    def summary(self):
+        """{name: {calls, wall, cpu, peak_bytes}} totalled over calls, in first-call order."""
+        totals = {}
+        for record in self.stages:
+            total = totals.setdefault(record['name'], dict(calls=0, wall=0.0, cpu=0.0))
+            total['calls'] += 1
+            total['wall'] += record['wall']
+            total['cpu'] += record['cpu']
+            if 'peak_bytes' in record:
+                total['peak_bytes'] = max(total.get('peak_bytes', 0), record['peak_bytes'])
+        return totals
+
+    def to_json(self):
+        return dict(version=TRACE_VERSION, command=sys.argv, started=self.started,
+                    memory=self.memory, max_rss_bytes=max_rss_bytes(),
+                    stages=self.stages, summary=self.summary())
+
+    def to_chrome(self):
+        """Chrome trace event format (complete events, times in microseconds)."""
+        pid = os.getpid()
+        events = []
+        for record in self.stages:
+            args = dict(record.get('args', {}), cpu_ms=round(record['cpu'] * 1e3, 3))
+            if 'peak_bytes' in record:
+                args['peak_mb'] = round(record['peak_bytes'] / 1e6, 3)
+            events.append(dict(name=record['name'], cat='stage', ph='X', pid=pid, tid=0,
+                               ts=round(record['start'] * 1e6, 1),
+                               dur=round(record['wall'] * 1e6, 1), args=args))
+        return dict(traceEvents=events, displayTimeUnit='ms')
+
+    def format_table(self):
+        lines = [f"{'stage':34s} {'calls':>5s} {'wall ms':>9s} {'cpu ms':>9s} {'peak MB':>8s}"]
+        for name, total in self.summary().items():
+            peak = f"{total['peak_bytes'] / 1e6:8.1f}" if 'peak_bytes' in total else f"{'-':>8s}"
+            lines.append(f"{name:34s} {total['calls']:5d} {total['wall'] * 1e3:9.1f} "
+                         f"{total['cpu'] * 1e3:9.1f} {peak}")
+        rss = max_rss_bytes()
+        if rss is not None:
+            lines.append(f"peak RSS {rss / 1e6:.0f} MB")
+        return '\n'.join(lines)
+
+    def format_profile(self, rows=PROFILE_ROWS):
+        out = io.StringIO()
+        pstats.Stats(self.profile, stream=out).sort_stats('cumulative').print_stats(rows)
+        return out.getvalue()
+
+
+def max_rss_bytes():
+    """Peak resident set size of this process so far, or None where unavailable."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+@contextmanager
+def stage(name, **args):
+    """Record the enclosed block as a stage of the active trace (if any)."""
+    trace = _active
+    # Stages are timed on the thread that started the trace; worker
+    # threads (e.g. export's encoders) run untraced
+    if trace is None or threading.current_thread() is not trace.thread:
+        yield
+        return
+    record = trace.enter(name, args)
+    try:
+        yield
+    except BaseException as e:
+        trace.exit(record, type(e).__name__)
+        raise
+    trace.exit(record)
+
+
+def staged(name):
+    """Decorator form of stage() for a whole function."""
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+@contextmanager
+def tracing(memory=True, profile_stage=None):
+    """Activate a Trace for the enclosed block and yield it."""
+    global _active
+    if _active is not None:
+        raise RuntimeError("A trace is already active")
+    started_tracemalloc = memory and not tracemalloc.is_tracing()
+    if started_tracemalloc:
+        tracemalloc.start()
+    _active = Trace(memory, profile_stage)
+    try:
+        yield _active
+    finally:
+        _active = None
+        if started_tracemalloc:
+            tracemalloc.stop()
+
+
+def add_profiling_arguments(parser):
+    """Add --trace, --chrome-trace, --profile-stage and --profile-output to a parser."""
+    group = parser.add_argument_group('profiling')
+    group.add_argument('--trace', metavar='JSON',
+                       help='record per-stage wall/CPU time and peak memory to a JSON file')
+    group.add_argument('--chrome-trace', metavar='JSON',
+                       help='also write the stages in Chrome trace format (speedscope, Perfetto)')
+    group.add_argument('--trace-no-memory', action='store_true',
+                       help='skip memory tracing (tracemalloc slows drawing down)')
+    group.add_argument('--profile-stage', metavar='NAME',
+                       help='run the first call of this stage under cProfile')
+    group.add_argument('--profile-output', metavar='PROF',
+                       help='cProfile stats file for --profile-stage (default: NAME.prof)')
+    return parser
+
+
+@contextmanager
+def profiled(args, log=None):
+    """
+    Trace the enclosed block if args asks for it (see add_profiling_arguments),
+    then write the requested files and print the stage table to stderr.
+    """
+    if not (args.trace or args.chrome_trace or args.profile_stage):
+        yield None
+        return
+    log = log or functools.partial(print, file=sys.stderr)
+    with tracing(not args.trace_no_memory, args.profile_stage) as trace:
+        yield trace
+    log(trace.format_table())
+    if args.trace:
+        write_json(trace.to_json(), args.trace)
+        log(f"Trace written to {args.trace}")
+    if args.chrome_trace:
+        write_json(trace.to_chrome(), args.chrome_trace)
+        log(f"Chrome trace written to {args.chrome_trace}")
+    if args.profile_stage:
+        if not trace.profile_calls:
+            log(f"Stage '{args.profile_stage}' did not run; "
+                f"stages were: {', '.join(trace.summary())}")
+        else:
+            path = args.profile_output or f'{args.profile_stage}.prof'
+            trace.profile.dump_stats(path)
+            log(trace.format_profile())
+            log(f"cProfile stats written to {path}")
+
+
+def write_json(data, path):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('trace_file', help='JSON trace written with --trace')
+    args = parser.parse_args()
+
+    with open(args.trace_file, encoding='utf-8') as f:
+        data = json.load(f)
+    if data.get('version') != TRACE_VERSION:
+        raise ValueError(f"{args.trace_file}: unsupported trace version {data.get('version')}")
+    for record in data['stages']:
+        peak = f"{record['peak_bytes'] / 1e6:8.1f} MB" if 'peak_bytes' in record else ''
+        print(f"{'  ' * record['depth']}{record['name']:{40 - 2 * record['depth']}s} "
+              f"{record['wall'] * 1e3:9.1f} ms {record['cpu'] * 1e3:9.1f} ms cpu {peak}")
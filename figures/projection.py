@@ -0,0 +1,467 @@
+#!/usr/bin/env python3
+"""
+Map projections for the territory maps: UTM and Albers equal-area conic on WGS 84.
+
+Both maps plot longitude and latitude by default, which stretches east-west
+distances by 1/cos(latitude) (about 25% at 37°N). With --projection the
+maps are drawn in projected metres instead:
+
+  utm     transverse Mercator (Krüger series, Karney 2011) in the UTM zone
+          of the map center; conformal, scale within 0.04% of true
+  albers  Albers equal-area conic with standard parallels at 1/6 and 5/6 of
+          the map's latitude range; areas are true
+
+The shaded relief is reprojected by inverse mapping: every output pixel is
+mapped back to a fractional position on a geographic source grid that
+encloses the projected map, and sampled bilinearly. The index grid (source
+pixel and fractional offsets per output pixel) depends only on the grids
+and the projection, so it is stored in the raster cache per (extent,
+resolution, projection) and reused across basemaps. Vector layers are
+transformed in vectorized batches (project_rings()).
+"""
+
+import argparse
+import math
+import sys
+
+import numpy as np
+
+from raster_cache import cached_arrays
+from shading import row_chunks
+
+# WGS 84 ellipsoid
+WGS84_A = 6378137.0
+WGS84_F = 1 / 298.257223563
+
+UTM_SCALE = 0.9996
+UTM_FALSE_EASTING = 500000.0
+
+PROJECTIONS = ('utm', 'albers')
+
+# Points per edge when tracing the map extent's outline through a projection
+OUTLINE_POINTS = 256
+
+CHUNK_ROWS = 256
+
+
+class Geographic:
+    """Identity projection: map coordinates are longitude and latitude in degrees."""
+
+    name = 'geographic'
+    description = 'Geographic coordinates (WGS 84)'
+    params = dict(name='geographic')
+
+    def forward(self, lon, lat):
+        return np.asarray(lon, dtype=np.float64), np.asarray(lat, dtype=np.float64)
+
+    def inverse(self, x, y):
+        return np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)
+
+
+class TransverseMercator:
+    """UTM (northern hemisphere) on WGS 84; forward and inverse vectorized over points."""
+
+    name = 'utm'
+
+    def __init__(self, zone, a=WGS84_A, f=WGS84_F):
+        self.zone = zone
+        self.lon0 = math.radians(zone * 6 - 183)
+        self.a, self.f = a, f
+        n = f / (2 - f)
+        self._A = a / (1 + n) * (1 + n**2 / 4 + n**4 / 64)
+        self._alpha = (n / 2 - 2 * n**2 / 3 + 5 * n**3 / 16,
+                       13 * n**2 / 48 - 3 * n**3 / 5,
+                       61 * n**3 / 240)
+        self._beta = (n / 2 - 2 * n**2 / 3 + 37 * n**3 / 96,
+                      n**2 / 48 + n**3 / 15,
+                      17 * n**3 / 480)
+        self._delta = (2 * n - 2 * n**2 / 3 - 2 * n**3,
+                       7 * n**2 / 3 - 8 * n**3 / 5,
+                       56 * n**3 / 15)
+        self._c = 2 * math.sqrt(n) / (1 + n)
+        self.description = f'UTM zone {zone}N (WGS 84)'
+        self.params = dict(name='utm', zone=zone, a=a, f=f)
+
+    def forward(self, lon, lat):
+        lon, lat = np.radians(lon), np.radians(lat)
+        sin_lat = np.sin(lat)
+        t = np.sinh(np.arctanh(sin_lat) - self._c * np.arctanh(self._c * sin_lat))
+        dlon = lon - self.lon0
+        xi = np.arctan2(t, np.cos(dlon))
+        eta = np.arctanh(np.sin(dlon) / np.sqrt(1 + t * t))
+        x, y = eta.copy(), xi.copy()
+        for j, alpha in enumerate(self._alpha, 1):
+            x += alpha * np.cos(2 * j * xi) * np.sinh(2 * j * eta)
+            y += alpha * np.sin(2 * j * xi) * np.cosh(2 * j * eta)
+        scale = UTM_SCALE * self._A
+        return UTM_FALSE_EASTING + scale * x, scale * y
+
+    def inverse(self, x, y):
+        scale = UTM_SCALE * self._A
+        xi, eta = np.broadcast_arrays(np.asarray(y, dtype=np.float64) / scale,
+                                      (np.asarray(x, dtype=np.float64) - UTM_FALSE_EASTING)
+                                      / scale)
+        xi_, eta_ = xi.copy(), eta.copy()
+        for j, beta in enumerate(self._beta, 1):
+            xi_ -= beta * np.sin(2 * j * xi) * np.cosh(2 * j * eta)
+            eta_ -= beta * np.cos(2 * j * xi) * np.sinh(2 * j * eta)
+        chi = np.arcsin(np.sin(xi_) / np.cosh(eta_))
+        lat = chi.copy()
+        for j, delta in enumerate(self._delta, 1):
+            lat += delta * np.sin(2 * j * chi)
+        lon = self.lon0 + np.arctan2(np.sinh(eta_), np.cos(xi_))
+        return np.degrees(lon), np.degrees(lat)
+
+
+class AlbersEqualArea:
+    """Albers equal-area conic on WGS 84 (Snyder 1987, ch. 14); vectorized over points."""
+
+    name = 'albers'
+
+    # Inverse latitude iterations (Snyder eq. 3-16); converges to 1e-15 rad in 5
+    ITERATIONS = 8
+
+    def __init__(self, lon0, lat0, lat1, lat2, a=WGS84_A, f=WGS84_F):
+        self.a, self.e2 = a, f * (2 - f)
+        self.e = math.sqrt(self.e2)
+        self.lon0 = math.radians(lon0)
+        m1, m2 = self._m(math.radians(lat1)), self._m(math.radians(lat2))
+        q0, q1, q2 = (self._q(math.radians(v)) for v in (lat0, lat1, lat2))
+        self.n = (m1 * m1 - m2 * m2) / (q2 - q1)
+        self.C = m1 * m1 + self.n * q1
+        self.rho0 = a * math.sqrt(self.C - self.n * q0) / self.n
+        self.description = (f'Albers equal-area conic (WGS 84; parallels '
+                            f'{lat1:.2f}°N, {lat2:.2f}°N)')
+        self.params = dict(name='albers', lon0=lon0, lat0=lat0, lat1=lat1, lat2=lat2,
+                           a=a, f=f)
+
+    def _m(self, lat):
+        return np.cos(lat) / np.sqrt(1 - self.e2 * np.sin(lat)**2)
+
+    def _q(self, lat):
+        s = np.sin(lat)
+        return (1 - self.e2) * (s / (1 - self.e2 * s * s)
+                                - np.log((1 - self.e * s) / (1 + self.e * s)) / (2 * self.e))
+
+    def forward(self, lon, lat):
+        lon, lat = np.radians(lon), np.radians(lat)
+        rho = self.a * np.sqrt(self.C - self.n * self._q(lat)) / self.n
+        theta = self.n * (lon - self.lon0)
+        return rho * np.sin(theta), self.rho0 - rho * np.cos(theta)
+
+    def inverse(self, x, y):
+        x, y = np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)
+        dy = self.rho0 - y
+        rho = np.hypot(x, dy)
+        q = (self.C - (rho * self.n / self.a)**2) / self.n
+        lat = np.arcsin(np.clip(q / 2, -1, 1))
+        for _ in range(self.ITERATIONS):
+            s = np.sin(lat)
+            w = 1 - self.e2 * s * s
+            lat = lat + w * w / (2 * np.cos(lat)) * (
+                q / (1 - self.e2) - s / w
+                + np.log((1 - self.e * s) / (1 + self.e * s)) / (2 * self.e))
+        lon = self.lon0 + np.arctan2(x, dy) / self.n
+        return np.degrees(lon), np.degrees(lat)
+
+
+def get_projection(name, extent):
+    """The projection called name (None for geographic) fitted to extent."""
+    lon_min, lon_max, lat_min, lat_max = extent
+    if name in (None, 'geographic'):
+        return Geographic()
+    if name == 'utm':
+        return TransverseMercator(int(((lon_min + lon_max) / 2 + 180) // 6) + 1)
+    if name == 'albers':
+        span = lat_max - lat_min
+        return AlbersEqualArea((lon_min + lon_max) / 2, (lat_min + lat_max) / 2,
+                               lat_min + span / 6, lat_max - span / 6)
+    raise ValueError(f"Unknown projection {name!r}; expected one of {PROJECTIONS}")
+
+
+def outline(extent, points=OUTLINE_POINTS):
+    """Densified boundary of a rectangle (x_min, x_max, y_min, y_max) as two arrays."""
+    x_min, x_max, y_min, y_max = extent
+    t = np.linspace(0, 1, points)
+    xs = np.concatenate([x_min + t * (x_max - x_min), np.full(points, x_max),
+                         x_max - t * (x_max - x_min), np.full(points, x_min)])
+    ys = np.concatenate([np.full(points, y_min), y_min + t * (y_max - y_min),
+                         np.full(points, y_max), y_max - t * (y_max - y_min)])
+    return xs, ys
+
+
+def map_bounds(projection, extent):
+    """Projected (x_min, x_max, y_min, y_max) enclosing the geographic extent."""
+    x, y = projection.forward(*outline(extent))
+    return float(x.min()), float(x.max()), float(y.min()), float(y.max())
+
+
+def projected_grids(projection, extent, nx, ny):
+    """
+    Grids for reprojecting an (ny, nx) basemap of extent.
+
+    Returns (source_extent, (source_nx, source_ny), bounds, (out_nx, out_ny)):
+    the geographic grid enclosing the projected map at the basemap's pixel
+    spacing, and the projected output grid, nx pixels wide with square
+    pixels.
+    """
+    bounds = map_bounds(projection, extent)
+    out_ny = max(2, round(nx * (bounds[3] - bounds[2]) / (bounds[1] - bounds[0])))
+    lon, lat = projection.inverse(*outline(bounds))
+    lon_min, lon_max, lat_min, lat_max = extent
+    # Pad by a pixel: the outline is sampled, its extremes may lie between samples
+    dx, dy = (lon_max - lon_min) / (nx - 1), (lat_max - lat_min) / (ny - 1)
+    source = (float(lon.min()) - dx, float(lon.max()) + dx,
+              float(lat.min()) - dy, float(lat.max()) + dy)
+    source_nx = round((nx - 1) * (source[1] - source[0]) / (lon_max - lon_min)) + 1
+    source_ny = round((ny - 1) * (source[3] - source[2]) / (lat_max - lat_min)) + 1
+    return source, (source_nx, source_ny), bounds, (nx, out_ny)
+
+
+def inverse_map(projection, source_extent, source_shape, bounds, shape,
+                chunk_rows=CHUNK_ROWS):
+    """
+    Bilinear sampling positions of every output pixel on the source grid.
+
+    Returns dict(index=int32 (ny, nx) flat index of the upper-left source
+    pixel of the 2x2 neighbourhood, -1 outside the source grid;
+    frac=float32 (ny, nx, 2) column and row offsets within it). Pixels sit
+    on the grid nodes, as in dem.grid_coords.
+    """
+    lon_min, lon_max, lat_min, lat_max = source_extent
+    source_nx, source_ny = source_shape
+    nx, ny = shape
+    x = np.linspace(bounds[0], bounds[1], nx)
+    y = np.linspace(bounds[2], bounds[3], ny)
+    index = np.empty((ny, nx), dtype=np.int32)
+    frac = np.empty((ny, nx, 2), dtype=np.float32)
+    for r0, r1 in row_chunks(ny, chunk_rows):
+        lon, lat = projection.inverse(x[None, :], y[r0:r1, None])
+        col = (lon - lon_min) / (lon_max - lon_min) * (source_nx - 1)
+        row = (lat - lat_min) / (lat_max - lat_min) * (source_ny - 1)
+        # Allow rounding error at the edges of the source grid
+        eps = 1e-6
+        outside = ((col < -eps) | (col > source_nx - 1 + eps)
+                   | (row < -eps) | (row > source_ny - 1 + eps))
+        c0 = np.clip(np.floor(col), 0, source_nx - 2)
+        rr0 = np.clip(np.floor(row), 0, source_ny - 2)
+        flat = (rr0 * source_nx + c0).astype(np.int32)
+        flat[outside] = -1
+        index[r0:r1] = flat
+        frac[r0:r1, :, 0] = np.clip(col - c0, 0, 1)
+        frac[r0:r1, :, 1] = np.clip(row - rr0, 0, 1)
+    return dict(index=index, frac=frac)
+
+
+def cached_inverse_map(cache, projection, source_extent, source_shape, bounds, shape):
+    """inverse_map() through the raster cache, keyed by both grids and the projection."""
+    params = dict(raster='inverse_map', projection=projection.params,
+                  source_extent=list(source_extent), source_shape=list(source_shape),
+                  bounds=list(bounds), shape=list(shape))
+    return cached_arrays(cache, params, ('index', 'frac'),
+                         lambda: inverse_map(projection, source_extent, source_shape,
+                                             bounds, shape))
+
+
+def reproject(raster, index, frac, fill=1.0, chunk_rows=CHUNK_ROWS):
+    """
+    Sample raster ((ny, nx) or (ny, nx, bands), on the source grid) at the
+    inverse-mapped positions; pixels outside the source get fill.
+    """
+    source_nx = raster.shape[1]
+    flat = raster.reshape(raster.shape[0] * source_nx, -1)
+    out = np.empty(index.shape + flat.shape[1:], dtype=raster.dtype)
+    for r0, r1 in row_chunks(index.shape[0], chunk_rows):
+        i = index[r0:r1].ravel()
+        outside = i < 0
+        i = np.where(outside, 0, i)
+        fx = frac[r0:r1, :, 0].reshape(-1, 1)
+        fy = frac[r0:r1, :, 1].reshape(-1, 1)
+        top = flat[i] * (1 - fx) + flat[i + 1] * fx
+        bottom = flat[i + source_nx] * (1 - fx) + flat[i + source_nx + 1] * fx
+        values = top * (1 - fy) + bottom * fy
+        values[outside] = fill
+        out[r0:r1] = values.reshape(r1 - r0, index.shape[1], -1)
+    return out.reshape(index.shape + raster.shape[2:])
+
+
+def project_rings(projection, rings):
+    """Transform a list of (n, 2) lon/lat arrays with one vectorized call."""
+    if not rings:
+        return []
+    x, y = projection.forward(*np.concatenate(rings).T)
+    return np.split(np.column_stack([x, y]), np.cumsum([len(r) for r in rings])[:-1])
+
+
+def point(projection, lon, lat):
+    """Map coordinates of one point as floats."""
+    x, y = projection.forward(lon, lat)
+    return float(x), float(y)
+
+
+def graticule(extent, step, points=64):
+    """Meridians and parallels every step degrees across extent, as lon/lat rings."""
+    lon_min, lon_max, lat_min, lat_max = extent
+    lons = np.arange(math.ceil(lon_min / step) * step, lon_max + 1e-9, step)
+    lats = np.arange(math.ceil(lat_min / step) * step, lat_max + 1e-9, step)
+    t_lat = np.linspace(lat_min, lat_max, points)
+    t_lon = np.linspace(lon_min, lon_max, points)
+    meridians = [np.column_stack([np.full(points, lon), t_lat]) for lon in lons]
+    parallels = [np.column_stack([t_lon, np.full(points, lat)]) for lat in lats]
+    return meridians, parallels
+
+
+def geodesic_km(lon1, lat1, lon2, lat2, a=WGS84_A, f=WGS84_F):
+    """Ellipsoidal distance between two points in km (Vincenty's inverse formula)."""
+    b = a * (1 - f)
+    L = math.radians(lon2 - lon1)
+    U1 = math.atan((1 - f) * math.tan(math.radians(lat1)))
+    U2 = math.atan((1 - f) * math.tan(math.radians(lat2)))
+    sin_u1, cos_u1, sin_u2, cos_u2 = math.sin(U1), math.cos(U1), math.sin(U2), math.cos(U2)
+    lam = L
+    for _ in range(200):
+        sin_lam, cos_lam = math.sin(lam), math.cos(lam)
+        sin_sigma = math.hypot(cos_u2 * sin_lam, cos_u1 * sin_u2 - sin_u1 * cos_u2 * cos_lam)
+        if sin_sigma == 0:
+            return 0.0
+        cos_sigma = sin_u1 * sin_u2 + cos_u1 * cos_u2 * cos_lam
+        sigma = math.atan2(sin_sigma, cos_sigma)
+        sin_alpha = cos_u1 * cos_u2 * sin_lam / sin_sigma
+        cos2_alpha = 1 - sin_alpha**2
+        cos_2sm = cos_sigma - 2 * sin_u1 * sin_u2 / cos2_alpha if cos2_alpha else 0.0
+        C = f / 16 * cos2_alpha * (4 + f * (4 - 3 * cos2_alpha))
+        previous = lam
+        lam = L + (1 - C) * f * sin_alpha * (
+            sigma + C * sin_sigma * (cos_2sm + C * cos_sigma * (-1 + 2 * cos_2sm**2)))
+        if abs(lam - previous) < 1e-13:
+            break
+    u2 = cos2_alpha * (a * a - b * b) / (b * b)
+    A = 1 + u2 / 16384 * (4096 + u2 * (-768 + u2 * (320 - 175 * u2)))
+    B = u2 / 1024 * (256 + u2 * (-128 + u2 * (74 - 47 * u2)))
+    delta = B * sin_sigma * (cos_2sm + B / 4 * (
+        cos_sigma * (-1 + 2 * cos_2sm**2)
+        - B / 6 * cos_2sm * (-3 + 4 * sin_sigma**2) * (-3 + 4 * cos_2sm**2)))
+    return b * A * (sigma - delta) / 1000
+
+
+def scale_bar(projection, lon, lat, length_km):
+    """
+    Map coordinates (x0, y0, x1, y1) of a horizontal bar starting at lon,
+    lat whose ends are length_km apart on the ground.
+    """
+    x0, y0 = (float(v) for v in projection.forward(lon, lat))
+    # Map units per km, refined until the ground length is exact
+    per_km = 1 / 111.32 if isinstance(projection, Geographic) else 1000.0
+    for _ in range(4):
+        x1 = x0 + length_km * per_km
+        lon1, lat1 = projection.inverse(x1, y0)
+        per_km *= length_km / geodesic_km(lon, lat, float(lon1), float(lat1))
+    return x0, y0, x0 + length_km * per_km, y0
+
+
+def check(extent=(-118.6, -116.8, 35.8, 37.8)):
+    """Round trips, reference coordinates, equal area and scale bar lengths."""
+    lon, lat = np.meshgrid(np.linspace(extent[0] - 1, extent[1] + 1, 101),
+                           np.linspace(extent[2] - 1, extent[3] + 1, 91))
+    for name in PROJECTIONS:
+        projection = get_projection(name, extent)
+        back = projection.inverse(*projection.forward(lon, lat))
+        error = max(np.abs(back[0] - lon).max(), np.abs(back[1] - lat).max())
+        # About 1 mm; the n^3 series of the UTM inverse limits it
+        if error > 1e-8:
+            raise AssertionError(f"{name}: round trip error {error:.2e}°")
+
+    # UTM: true scale k0 along the central meridian (northing = k0 times the
+    # meridian arc, integrated numerically), and conformal elsewhere (equal
+    # scale along the meridian and the parallel, at right angles)
+    from scipy.integrate import quad
+    utm = get_projection('utm', extent)
+    e2 = WGS84_F * (2 - WGS84_F)
+    lon0 = utm.zone * 6 - 183
+    for lat_ in (35.5, 36.8, 38.1):
+        arc, _ = quad(lambda p: WGS84_A * (1 - e2) / (1 - e2 * math.sin(p)**2)**1.5,
+                      0, math.radians(lat_), epsabs=1e-6)
+        _, y = utm.forward(lon0, lat_)
+        if abs(y - UTM_SCALE * arc) > 1e-3:
+            raise AssertionError(f"UTM northing at {lat_}°N is {y:.4f}, "
+                                 f"expected {UTM_SCALE * arc:.4f}")
+    step = 1e-5
+    for lon_, lat_ in ((-118.6, 35.8), (-116.8, 37.8), (-119.5, 36.5)):
+        x, y = utm.forward(np.array([lon_, lon_ + step, lon_]),
+                           np.array([lat_, lat_, lat_ + step]))
+        east = np.array([x[1] - x[0], y[1] - y[0]])
+        north = np.array([x[2] - x[0], y[2] - y[0]])
+        k = np.hypot(*east) / geodesic_km(lon_, lat_, lon_ + step, lat_) / 1000
+        h = np.hypot(*north) / geodesic_km(lon_, lat_, lon_, lat_ + step) / 1000
+        angle = math.degrees(math.acos(np.dot(east, north) / np.hypot(*east) / np.hypot(*north)))
+        if abs(k / h - 1) > 1e-5 or abs(angle - 90) > 1e-3:
+            raise AssertionError(f"UTM at ({lon_}, {lat_}) is not conformal: "
+                                 f"k/h={k / h:.7f}, angle {angle:.5f}°")
+
+    # Equal area: a 0.1° cell's projected area against the ellipsoidal one
+    albers = get_projection('albers', extent)
+    e = math.sqrt(e2)
+
+    def authalic(phi):
+        s = math.sin(math.radians(phi))
+        return (s / (1 - e2 * s * s) - math.log((1 - e * s) / (1 + e * s)) / (2 * e)) / 2
+
+    for lon_, lat_ in ((-118.5, 35.9), (-117.7, 36.8), (-116.9, 37.7)):
+        # Shoelace area, with the cell's edges densified (parallels are arcs)
+        x, y = albers.forward(*outline((lon_, lon_ + 0.1, lat_, lat_ + 0.1), points=400))
+        area = 0.5 * abs(np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1)))
+        true = (WGS84_A**2 * (1 - e2) * math.radians(0.1)
+                * (authalic(lat_ + 0.1) - authalic(lat_)))
+        if abs(area / true - 1) > 1e-5:
+            raise AssertionError(f"Albers area at ({lon_}, {lat_}) off by "
+                                 f"{area / true - 1:.2e}")
+
+    for name in (None,) + PROJECTIONS:
+        projection = get_projection(name, extent)
+        x0, y0, x1, y1 = scale_bar(projection, -118.4, 35.92, 50)
+        ends = projection.inverse(np.array([x0, x1]), np.array([y0, y1]))
+        length = geodesic_km(ends[0][0], ends[1][0], ends[0][1], ends[1][1])
+        if abs(length - 50) > 1e-6:
+            raise AssertionError(f"{projection.name} scale bar is {length:.6f} km")
+    # Vincenty against a published geodesic (Flinders Peak - Buninyong)
+    d = geodesic_km(144.42486788888889, -37.95103341666667, 143.92649552777778,
+                    -37.65282113888889)
+    if abs(d - 54.972271) > 1e-6:
+        raise AssertionError(f"geodesic_km gives {d:.6f} km, expected 54.972271")
+    print("Projections round-trip; UTM is conformal with true scale k0 on its central "
+          "meridian, Albers areas are true, scale bars are true length")
+
+    # Reprojecting a smooth field matches the field evaluated at the inverse-mapped points
+    for name in PROJECTIONS:
+        projection = get_projection(name, extent)
+        source, (snx, sny), bounds, (nx, ny) = projected_grids(projection, extent, 200, 220)
+        field = lambda lo, la: np.sin(3 * lo) + np.cos(2 * la)
+        slon = np.linspace(source[0], source[1], snx)
+        slat = np.linspace(source[2], source[3], sny)
+        raster = field(slon[None, :], slat[:, None]).astype(np.float32)
+        grid = inverse_map(projection, source, (snx, sny), bounds, (nx, ny), chunk_rows=17)
+        out = reproject(raster, grid['index'], grid['frac'], fill=np.nan, chunk_rows=13)
+        x = np.linspace(bounds[0], bounds[1], nx)
+        y = np.linspace(bounds[2], bounds[3], ny)
+        expected = field(*projection.inverse(x[None, :], y[:, None]))
+        if np.isnan(out).any():
+            raise AssertionError(f"{name}: output pixels outside the source grid")
+        error = np.abs(out - expected).max()
+        if error > 2e-3:
+            raise AssertionError(f"{name}: reprojection error {error:.2e}")
+        rgb = reproject(np.dstack([raster] * 3), grid['index'], grid['frac'])
+        if not np.allclose(rgb[..., 1], out):
+            raise AssertionError(f"{name}: band-wise reprojection differs")
+    print("Reprojected rasters match the field at the inverse-mapped points")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--check', action='store_true',
+                        help='verify the projections, scale bars and reprojection')
+    args = parser.parse_args()
+    if args.check:
+        check()
+    else:
+        parser.print_help()
+    sys.exit(0)
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Persistent, content-addressed cache for the basemap rasters (DEM, hillshade, shaded RGB).
+
+An entry is a directory named by the SHA-256 of every parameter that affects
+the rasters (extent, resolution, landforms, noise seed, light source,
+vertical exaggeration, colormap stops, ...). Arrays are stored as .npy files
+and loaded back as read-only memmaps, so a warm re-render only pays for the
+matplotlib drawing. Entries are evicted least-recently-used first once the
+cache exceeds its size cap.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+
+# Bump when the raster algorithms change in a way the parameters don't capture
+CACHE_VERSION = 2
+
+DEFAULT_CACHE_DIR = os.environ.get(
+    'RASTER_CACHE_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '.raster_cache'))
+DEFAULT_MAX_BYTES = 2 * 1024**3
+
+
+def cache_key(params):
+    """SHA-256 hex digest of a JSON-serializable parameter dict."""
+    payload = json.dumps({'version': CACHE_VERSION, 'params': params},
+                         sort_keys=True, separators=(',', ':'), default=repr)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def _entry_size(path):
+    return sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+
+
+class RasterCache:
+    """On-disk LRU cache of named arrays grouped under a parameter key."""
+
+    def __init__(self, root=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+
+    def _entry(self, key):
+        return os.path.join(self.root, key)
+
+    def load(self, key, names):
+        """
+        Return {name: read-only memmap} if every name is cached under key,
+        otherwise None. A hit marks the entry as most recently used.
+        """
+        entry = self._entry(key)
+        paths = {name: os.path.join(entry, f'{name}.npy') for name in names}
+        if not all(os.path.exists(p) for p in paths.values()):
+            return None
+        os.utime(entry)
+        return {name: np.load(p, mmap_mode='r') for name, p in paths.items()}
+
+    def store(self, key, arrays, params=None):
+        """Write {name: array} under key atomically, then enforce the size cap."""
+        entry = self._entry(key)
+        tmp = f'{entry}.tmp-{os.getpid()}'
+        os.makedirs(tmp, exist_ok=True)
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp, f'{name}.npy'), array)
+        if params is not None:
+            with open(os.path.join(tmp, 'params.json'), 'w') as f:
+                json.dump(params, f, indent=1, sort_keys=True, default=repr)
+        if os.path.exists(entry):
+            shutil.rmtree(entry)
+        os.replace(tmp, entry)
+        self.evict(keep=key)
+
+    def entries(self):
+        """List (key, size_bytes, last_used) for complete entries, oldest first."""
+        if not os.path.isdir(self.root):
+            return []
+        found = []
+        for key in os.listdir(self.root):
+            path = self._entry(key)
+            if '.tmp-' in key or not os.path.isdir(path):
+                continue
+            found.append((key, _entry_size(path), os.path.getmtime(path)))
+        return sorted(found, key=lambda e: e[2])
+
+    def evict(self, keep=None):
+        """Remove least-recently-used entries until the cache fits max_bytes."""
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for key, size, _ in entries:
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            shutil.rmtree(self._entry(key), ignore_errors=True)
+            total -= size
+
+    def clear(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+
+def cached_arrays(cache, params, names, compute):
+    """
+    Load names for params from cache, or call compute() -> {name: array},
+    store the result and return it. cache may be None to disable caching.
+    """
+    if cache is None:
+        return compute()
+    key = cache_key(params)
+    arrays = cache.load(key, names)
+    if arrays is None:
+        arrays = compute()
+        cache.store(key, {name: arrays[name] for name in names}, params)
+    return arrays
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR)
+    parser.add_argument('--clear', action='store_true', help='delete all entries')
+    args = parser.parse_args()
+
+    cache = RasterCache(args.cache_dir)
+    if args.clear:
+        cache.clear()
+        print(f"Cleared {args.cache_dir}")
+    else:
+        entries = cache.entries()
+        for key, size, _ in entries:
+            print(f"{key[:16]}  {size / 1e6:8.1f} MB")
+        print(f"{len(entries)} entries, "
+              f"{sum(size for _, size, _ in entries) / 1e6:.1f} MB in {args.cache_dir}")
@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+"""
+Vectorized shaded-relief engine used in place of matplotlib's LightSource on the basemap hot path.
+
+LightSource.hillshade and LightSource.shade_rgb each compute the surface
+gradients, so calling both (as the geo map did) differentiates the DEM twice.
+Here the illumination intensity is computed once from the gradient and reused
+for the hillshade and the blended RGB. Work is done in float32 in row chunks
+(each with a one-row halo for the gradient), so it also runs on memmapped
+tiled DEMs. The math follows LightSource: the same azimuth/altitude
+convention, vert_exag, dx/dy, global contrast stretch and the 'soft',
+'overlay' and 'hsv' blend modes.
+
+Run `python shading.py --check` for numerical parity with matplotlib and
+`python shading.py --benchmark` for timings.
+"""
+
+import argparse
+import time
+
+import numpy as np
+from matplotlib.colors import LightSource, hsv_to_rgb, rgb_to_hsv
+
+from profiling import stage
+
+DEFAULT_CHUNK_ROWS = 512
+
+# LightSource defaults for the 'hsv' blend mode
+HSV_MIN_VAL, HSV_MAX_VAL = 0, 1
+HSV_MIN_SAT, HSV_MAX_SAT = 1, 0
+
+
+def light_direction(azdeg, altdeg):
+    """Unit vector towards the light source (as LightSource.direction)."""
+    az = np.radians(90 - azdeg)
+    alt = np.radians(altdeg)
+    return np.array([np.cos(az) * np.cos(alt),
+                     np.sin(az) * np.cos(alt),
+                     np.sin(alt)])
+
+
+def raw_intensity(elevation, azdeg, altdeg, vert_exag=1, dx=1, dy=1, dtype=np.float32):
+    """
+    Illumination intensity before the contrast stretch: the dot product of
+    the unit surface normal with the light direction.
+    """
+    # Row 0 is treated as the top of the image, as LightSource does
+    e_dy, e_dx = np.gradient(vert_exag * np.asarray(elevation, dtype=dtype), -dy, dx)
+    lx, ly, lz = light_direction(azdeg, altdeg).astype(dtype)
+    intensity = lz - lx * e_dx - ly * e_dy
+    e_dx *= e_dx
+    e_dy *= e_dy
+    e_dx += e_dy
+    e_dx += 1
+    np.sqrt(e_dx, out=e_dx)
+    intensity /= e_dx
+    return intensity
+
+
+def stretch(intensity, imin, imax, fraction=1.0):
+    """LightSource.shade_normals' contrast stretch to 0-1, in place."""
+    intensity *= fraction
+    if (imax - imin) > 1e-6:
+        intensity -= imin
+        intensity /= (imax - imin)
+    np.clip(intensity, 0, 1, out=intensity)
+    return intensity
+
+
+def row_chunks(n, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """Yield (start, stop) row ranges covering n rows."""
+    for r0 in range(0, n, chunk_rows):
+        yield r0, min(r0 + chunk_rows, n)
+
+
+def hillshade(elevation, azdeg=315, altdeg=45, vert_exag=1, dx=1, dy=1,
+              fraction=1.0, chunk_rows=DEFAULT_CHUNK_ROWS, out=None):
+    """Hillshade in 0-1 as LightSource.hillshade, computed in row chunks."""
+    ny = elevation.shape[0]
+    if out is None:
+        out = np.empty(elevation.shape, dtype=np.float32)
+    for r0, r1 in row_chunks(ny, chunk_rows):
+        p0, p1 = max(0, r0 - 1), min(ny, r1 + 1)
+        raw = raw_intensity(elevation[p0:p1], azdeg, altdeg, vert_exag, dx, dy)
+        out[r0:r1] = raw[r0 - p0:r1 - p0]
+    imin, imax = float(out.min()), float(out.max())
+    for r0, r1 in row_chunks(ny, chunk_rows):
+        stretch(out[r0:r1], imin, imax, fraction)
+    return out
+
+
+def blend_soft_light(rgb, intensity):
+    """'soft' blending (pegtop soft light), as LightSource.blend_soft_light."""
+    return 2 * intensity * rgb + (1 - 2 * intensity) * rgb**2
+
+
+def blend_overlay(rgb, intensity):
+    """'overlay' blending, as LightSource.blend_overlay."""
+    low = 2 * intensity * rgb
+    high = 1 - 2 * (1 - intensity) * (1 - rgb)
+    return np.where(rgb <= 0.5, low, high)
+
+
+def blend_hsv(rgb, intensity):
+    """'hsv' blending with LightSource's default saturation/value limits."""
+    intensity = 2 * intensity[..., 0] - 1
+    hsv = rgb_to_hsv(rgb[..., :3])
+    sat, val = hsv[..., 1], hsv[..., 2]
+    has_sat = np.abs(sat) > 1.e-10
+    np.putmask(sat, has_sat & (intensity > 0),
+               (1 - intensity) * sat + intensity * HSV_MAX_SAT)
+    np.putmask(sat, has_sat & (intensity < 0),
+               (1 + intensity) * sat - intensity * HSV_MIN_SAT)
+    np.putmask(val, intensity > 0, (1 - intensity) * val + intensity * HSV_MAX_VAL)
+    np.putmask(val, intensity < 0, (1 + intensity) * val - intensity * HSV_MIN_VAL)
+    np.clip(hsv[..., 1:], 0, 1, out=hsv[..., 1:])
+    return hsv_to_rgb(hsv)
+
+
+BLEND_MODES = {
+    'soft': blend_soft_light,
+    'overlay': blend_overlay,
+    'hsv': blend_hsv,
+}
+
+
+def shaded_relief(elevation, cmap, vmin, vmax, azdeg=315, altdeg=45,
+                  vert_exag=1, dx=1, dy=1, fraction=1.0, blend_mode='soft',
+                  chunk_rows=DEFAULT_CHUNK_ROWS, intensity=None):
+    """
+    Colormap the elevation between vmin and vmax and blend it with the hillshade.
+
+    Equivalent to ls.hillshade(...) plus ls.shade_rgb(cmap(norm(elev))[..., :3],
+    elevation, ...), but the gradient is computed once and the colormap
+    lookup and blend run per row chunk. A precomputed hillshade may be passed
+    as intensity. Returns (hillshade, rgb) as float32 arrays.
+    """
+    blend = BLEND_MODES[blend_mode]
+    if intensity is None:
+        with stage('shade.hillshade'):
+            intensity = hillshade(elevation, azdeg, altdeg, vert_exag, dx, dy,
+                                  fraction, chunk_rows)
+    with stage('shade.rgb'):
+        rgb = np.empty(elevation.shape + (3,), dtype=np.float32)
+        for r0, r1 in row_chunks(elevation.shape[0], chunk_rows):
+            norm = np.asarray(elevation[r0:r1], dtype=np.float32) - vmin
+            norm /= (vmax - vmin)
+            np.clip(norm, 0, 1, out=norm)
+            colors = cmap(norm)[..., :3].astype(np.float32)
+            rgb[r0:r1] = blend(colors, intensity[r0:r1, :, np.newaxis])
+    return intensity, rgb
+
+
+def _matplotlib_relief(elevation, cmap, vmin, vmax, azdeg, altdeg, vert_exag, blend_mode):
+    ls = LightSource(azdeg=azdeg, altdeg=altdeg)
+    shade = ls.hillshade(elevation, vert_exag=vert_exag, dx=1, dy=1)
+    colors = cmap(np.clip((elevation - vmin) / (vmax - vmin), 0, 1))[:, :, :3]
+    return shade, ls.shade_rgb(colors, elevation, vert_exag=vert_exag,
+                               blend_mode=blend_mode)
+
+
+def _test_surface(nx, ny):
+    import dem
+    return dem.build_terrain(nx=nx, ny=ny)
+
+
+def check_parity(nx=360, ny=400, atol=1e-4):
+    """Compare hillshade and every blend mode with matplotlib. Returns max errors."""
+    from matplotlib import colormaps
+    elevation = _test_surface(nx, ny)
+    cmap = colormaps['terrain']
+    errors = {}
+    for mode in BLEND_MODES:
+        ref_shade, ref_rgb = _matplotlib_relief(elevation, cmap, -100, 4000,
+                                                315, 35, 2, mode)
+        shade, rgb = shaded_relief(elevation, cmap, -100, 4000, 315, 35,
+                                   vert_exag=2, blend_mode=mode, chunk_rows=37)
+        errors[mode] = (float(np.abs(shade - ref_shade).max()),
+                        float(np.abs(rgb - ref_rgb).max()))
+        if max(errors[mode]) > atol:
+            raise AssertionError(f"'{mode}' differs from matplotlib: "
+                                 f"hillshade {errors[mode][0]:g}, rgb {errors[mode][1]:g}")
+    return errors
+
+
+def benchmark(nx=2000, ny=2000, blend_mode='soft', repeat=3):
+    """Best-of-repeat seconds for matplotlib vs this module on the same DEM."""
+    from matplotlib import colormaps
+    elevation = _test_surface(nx, ny)
+    cmap = colormaps['terrain']
+    timings = {}
+    for name, fn in [
+            ('matplotlib', lambda: _matplotlib_relief(elevation, cmap, -100, 4000,
+                                                      315, 35, 2, blend_mode)),
+            ('shading', lambda: shaded_relief(elevation, cmap, -100, 4000, 315, 35,
+                                              vert_exag=2, blend_mode=blend_mode))]:
+        best = float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            fn()
+            best = min(best, time.perf_counter() - start)
+        timings[name] = best
+    return timings
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--check', action='store_true',
+                        help='check numerical parity with matplotlib LightSource')
+    parser.add_argument('--benchmark', action='store_true',
+                        help='time matplotlib vs this module')
+    parser.add_argument('--nx', type=int, default=2000)
+    parser.add_argument('--ny', type=int, default=2000)
+    parser.add_argument('--blend-mode', default='soft', choices=sorted(BLEND_MODES))
+    args = parser.parse_args()
+
+    if args.check:
+        for mode, (shade_err, rgb_err) in check_parity().items():
+            print(f"{mode:8s} max |d hillshade| = {shade_err:.2e}, max |d rgb| = {rgb_err:.2e}")
+    if args.benchmark:
+        timings = benchmark(args.nx, args.ny, args.blend_mode)
+        print(f"{args.nx}x{args.ny} '{args.blend_mode}': "
+              f"matplotlib {timings['matplotlib']:.3f} s, "
+              f"shading {timings['shading']:.3f} s "
+              f"({timings['matplotlib'] / timings['shading']:.1f}x)")
+    if not (args.check or args.benchmark):
+        parser.print_help()
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""
+Shared registry of territory polygons and place names for the Saline Valley maps.
+
+The data lives in territories.geojson (territory Polygons, place Points and
+fault LineStrings, with keys, labels, colors and label weights as properties)
+and is loaded once into a Registry with precomputed bounding boxes. Both map scripts draw from
+it, and Registry.classify() assigns large batches of (lon, lat) points to a
+territory in one vectorized call.
+
+Territories are based on ethnographic sources: Kroeber (1925), Steward
+(1933, 1938), Zigmond (1981), and Native Land Digital.
+"""
+
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+DATA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'territories.geojson')
+
+# Cells per side of the uniform grid index used by Registry.classify()
+INDEX_CELLS = 128
+
+# Returned by classify() for points outside every territory
+NO_TERRITORY = -1
+
+_BOUNDARY = -2
+
+
+def points_in_polygon(lon, lat, ring):
+    """Even-odd test of points against a closed (n, 2) ring, vectorized over points."""
+    inside = np.zeros(np.shape(lon), dtype=bool)
+    x1, y1 = ring[:-1, 0], ring[:-1, 1]
+    x2, y2 = ring[1:, 0], ring[1:, 1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for k in range(len(x1)):
+            crosses = (y1[k] > lat) != (y2[k] > lat)
+            x_cross = x1[k] + (lat - y1[k]) * (x2[k] - x1[k]) / (y2[k] - y1[k])
+            inside ^= crosses & (lon < x_cross)
+    return inside
+
+
+class Registry:
+    """
+    Territories and places loaded from GeoJSON.
+
+    territories is a list of dicts (key, label, color, coords as an (n, 2)
+    array, bbox as (lon_min, lat_min, lon_max, lat_max), ...) in drawing
+    order; places is a list of dicts (name, lon, lat, weight, optional note);
+    faults is a list of dicts (name, coords as an (n, 2) array).
+    """
+
+    def __init__(self, territories, places, faults=()):
+        self.territories = territories
+        self.places = places
+        self.faults = list(faults)
+        self.keys = [t['key'] for t in territories]
+        self.colors = {t['key']: t['color'] for t in territories}
+        boxes = np.array([t['bbox'] for t in territories])
+        self.bbox = (boxes[:, 0].min(), boxes[:, 1].min(),
+                     boxes[:, 2].max(), boxes[:, 3].max())
+        self._build_index()
+
+    def __getitem__(self, key):
+        return self.territories[self.keys.index(key)]
+
+    def _build_index(self, cells=INDEX_CELLS):
+        """
+        Label each cell of a uniform grid over the registry bbox with the
+        territory covering all of it, NO_TERRITORY, or _BOUNDARY when a
+        polygon edge may pass through it (those points get the exact test).
+        """
+        lon_min, lat_min, lon_max, lat_max = self.bbox
+        self._cell_w = (lon_max - lon_min) / cells
+        self._cell_h = (lat_max - lat_min) / cells
+        self._cells = cells
+        boundary = np.zeros((cells, cells), dtype=bool)
+        for t in self.territories:
+            ring = t['coords']
+            for (x1, y1), (x2, y2) in zip(ring[:-1], ring[1:]):
+                # Split the edge into pieces shorter than a cell; the union of
+                # their bboxes covers the edge, so marking them is conservative
+                n = int(max(abs(x2 - x1) / self._cell_w, abs(y2 - y1) / self._cell_h)) + 1
+                t0, t1 = np.linspace(0, 1, n + 1)[:-1], np.linspace(0, 1, n + 1)[1:]
+                xa, xb = x1 + t0 * (x2 - x1), x1 + t1 * (x2 - x1)
+                ya, yb = y1 + t0 * (y2 - y1), y1 + t1 * (y2 - y1)
+                c0 = self._cell_col(np.minimum(xa, xb)) - 1
+                c1 = self._cell_col(np.maximum(xa, xb)) + 1
+                r0 = self._cell_row(np.minimum(ya, yb)) - 1
+                r1 = self._cell_row(np.maximum(ya, yb)) + 1
+                for a, b, c, d in zip(r0, r1, c0, c1):
+                    boundary[max(a, 0):min(b, cells - 1) + 1,
+                             max(c, 0):min(d, cells - 1) + 1] = True
+
+        centers_lon = lon_min + (np.arange(cells) + 0.5) * self._cell_w
+        centers_lat = lat_min + (np.arange(cells) + 0.5) * self._cell_h
+        clon, clat = np.meshgrid(centers_lon, centers_lat)
+        labels = self._classify_exact(clon.ravel(), clat.ravel()).reshape(cells, cells)
+        labels[boundary] = _BOUNDARY
+        self._index = labels
+
+    def _cell_col(self, lon):
+        return np.floor((lon - self.bbox[0]) / self._cell_w).astype(np.int64)
+
+    def _cell_row(self, lat):
+        return np.floor((lat - self.bbox[1]) / self._cell_h).astype(np.int64)
+
+    def _classify_exact(self, lon, lat):
+        """Bbox prefilter then exact polygon test; first territory in order wins."""
+        result = np.full(lon.shape, NO_TERRITORY, dtype=np.int16)
+        for i, t in enumerate(self.territories):
+            x0, y0, x1, y1 = t['bbox']
+            cand = np.flatnonzero((result == NO_TERRITORY)
+                                  & (lon >= x0) & (lon <= x1) & (lat >= y0) & (lat <= y1))
+            if len(cand):
+                hit = points_in_polygon(lon[cand], lat[cand], t['coords'])
+                result[cand[hit]] = i
+        return result
+
+    def classify(self, lon, lat):
+        """
+        Territory index for each (lon, lat) point, NO_TERRITORY if none.
+
+        Points in grid cells no polygon edge passes through are labeled from
+        the index; only points in boundary cells get the exact polygon test.
+        """
+        lon = np.asarray(lon, dtype=np.float64)
+        lat = np.asarray(lat, dtype=np.float64)
+        shape = np.broadcast_shapes(lon.shape, lat.shape)
+        lon, lat = np.broadcast_to(lon, shape).ravel(), np.broadcast_to(lat, shape).ravel()
+        result = np.full(lon.shape, NO_TERRITORY, dtype=np.int16)
+
+        col, row = self._cell_col(lon), self._cell_row(lat)
+        on_grid = np.flatnonzero((col >= 0) & (col < self._cells)
+                                 & (row >= 0) & (row < self._cells))
+        labels = self._index[row[on_grid], col[on_grid]]
+        result[on_grid] = labels
+        edge = on_grid[labels == _BOUNDARY]
+        result[edge] = self._classify_exact(lon[edge], lat[edge])
+        # Points exactly on the far bbox edges fall outside the grid
+        rim = np.flatnonzero(((col == self._cells) | (row == self._cells))
+                             & (col <= self._cells) & (row <= self._cells)
+                             & (col >= 0) & (row >= 0))
+        result[rim] = self._classify_exact(lon[rim], lat[rim])
+        return result.reshape(shape)
+
+    def classify_keys(self, lon, lat):
+        """Like classify(), but returns territory keys ('' for none)."""
+        keys = np.array(self.keys + [''], dtype=object)
+        return keys[self.classify(lon, lat)]
+
+
+def load_registry(path=DATA_PATH):
+    """Load territories, places and faults from a GeoJSON FeatureCollection."""
+    with open(path, encoding='utf-8') as f:
+        collection = json.load(f)
+    territories, places, faults = [], [], []
+    for feature in collection['features']:
+        props = dict(feature['properties'])
+        geom = feature['geometry']
+        if geom['type'] == 'Polygon':
+            coords = np.array(geom['coordinates'][0], dtype=np.float64)
+            if not np.array_equal(coords[0], coords[-1]):
+                coords = np.vstack([coords, coords[:1]])
+            props['coords'] = coords
+            props['bbox'] = (float(coords[:, 0].min()), float(coords[:, 1].min()),
+                             float(coords[:, 0].max()), float(coords[:, 1].max()))
+            territories.append(props)
+        elif geom['type'] == 'Point':
+            props['lon'], props['lat'] = geom['coordinates'][:2]
+            places.append(props)
+        elif geom['type'] == 'LineString':
+            props['coords'] = np.array(geom['coordinates'], dtype=np.float64)
+            faults.append(props)
+    return Registry(territories, places, faults)
+
+
+def check_index(n=2_000_000, seed=0):
+    """
+    Check the grid index against the exact test on random points (including
+    points on polygon vertices) and return points per second.
+    """
+    registry = load_registry()
+    rng = np.random.default_rng(seed)
+    lon_min, lat_min, lon_max, lat_max = registry.bbox
+    lon = rng.uniform(lon_min - 0.1, lon_max + 0.1, n)
+    lat = rng.uniform(lat_min - 0.1, lat_max + 0.1, n)
+    vertices = np.vstack([t['coords'] for t in registry.territories])
+    lon = np.concatenate([lon, vertices[:, 0]])
+    lat = np.concatenate([lat, vertices[:, 1]])
+
+    start = time.perf_counter()
+    fast = registry.classify(lon, lat)
+    elapsed = time.perf_counter() - start
+    exact = registry._classify_exact(lon, lat)
+    if not np.array_equal(fast, exact):
+        raise AssertionError(f"{(fast != exact).sum()} points differ from the exact test")
+    return len(lon) / elapsed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--check', action='store_true',
+                        help='verify the spatial index and report throughput')
+    args = parser.parse_args()
+
+    if args.check:
+        print(f"Index matches exact test; {check_index() / 1e6:.1f} M points/s")
+    else:
+        registry = load_registry()
+        for t in registry.territories:
+            print(f"{t['key']:18s} bbox {tuple(round(v, 2) for v in t['bbox'])}")
+        print(f"{len(registry.places)} places, {len(registry.faults)} faults")
@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+"""
+Watch mode: keep the territory maps drawn in memory and re-render them on edits.
+
+Starting a map script pays for Python startup, importing matplotlib and
+scipy, building (or loading) the basemap, laying out the figure and a
+300-dpi save. Here all of that happens once. The process then polls
+territories.geojson and the map scripts, which hold the map styling
+(colors, line widths, label offsets, fonts):
+
+- a registry edit replaces only the registry layers (territories, faults,
+  places, legend) of every map and blits them, with every artist drawn
+  above them, over the cached static layers (see layers.py);
+- an edit to a map script reloads that module and redraws that map only,
+  reusing the basemap unless its raster parameters changed.
+
+Each affected map is first written as a low-dpi <name>.preview.png, then in
+the full-resolution formats. If another edit lands while the preview is
+written, the full-resolution export is skipped for the newer edit. Broken
+intermediate states (invalid JSON, a syntax error) are reported and the last
+good render is kept.
+
+Run `python watch.py --check` to time an edit-to-preview cycle on a copy of
+the registry.
+"""
+
+import argparse
+import importlib
+import json
+import os
+import shutil
+import tempfile
+import time
+import traceback
+
+import matplotlib
+import matplotlib.pyplot as plt
+import numpy as np
+from PIL import Image
+
+from create_territory_map_geo import add_basemap_arguments
+from export import add_export_arguments, export_figure, tight_bbox
+from layers import LayeredFigure, crop_pixels, overlying_artists, registry_artists
+from territories import DATA_PATH, load_registry
+
+# Map key -> (module, output name)
+MAPS = {
+    'geo': ('create_territory_map_geo', 'saline_valley_territories_geo'),
+    'simple': ('create_territory_map', 'saline_valley_territories'),
+}
+
+PREVIEW_DPI = 50
+# zlib level for previews: fastest, the default level takes longer than the draw
+PREVIEW_COMPRESS_LEVEL = 1
+POLL_SECONDS = 0.05
+
+
+class WarmMap:
+    """One map script's figure, kept drawn, with its registry layers as dynamic layers."""
+
+    def __init__(self, key, args):
+        module_name, self.name = MAPS[key]
+        self.module = importlib.import_module(module_name)
+        self.path = os.path.abspath(self.module.__file__)
+        self.args = args
+        self.shaded = None
+        self._basemap_params = None
+        self.fig = None
+
+    def load_basemap(self):
+        """Load the shaded relief if the map has one and its parameters changed."""
+        module = self.module
+        if not hasattr(module, 'load_basemap'):
+            return
+        nx, ny = self.args.resolution
+        params = module.basemap_params(module.MAP_EXTENT, nx, ny, self.args)
+        if params != self._basemap_params:
+            self.shaded = module.load_basemap(module.MAP_EXTENT, self.args)['shaded']
+            self._basemap_params = params
+
+    def draw(self, registry):
+        """Draw the whole figure from scratch."""
+        if self.fig is not None:
+            plt.close(self.fig)
+        module = self.module
+        if hasattr(module, 'load_basemap'):
+            self.fig, self.ax = module.draw_map(self.shaded, registry,
+                                                module.topography_caption(self.args))
+        else:
+            self.fig, self.ax = module.draw_map(registry)
+        self.bbox = tight_bbox(self.fig, self.args.preview_dpi)
+        # The registry layers and everything drawn over them (graticule,
+        # labels, scale bar) are blitted, so the preview keeps the z-order
+        self.layered = LayeredFigure(self.fig,
+                                     overlying_artists(self.ax, registry_artists(self.ax)))
+
+    def reload(self, registry):
+        """Re-import the map script (its styling changed) and redraw."""
+        self.module = importlib.reload(self.module)
+        self.load_basemap()
+        self.draw(registry)
+
+    def update_registry(self, registry):
+        """Replace the registry layers; the static layers stay cached."""
+        self.layered.remove_dynamic(*registry_artists(self.ax))
+        self.layered.add_dynamic(*self.module.draw_registry(self.ax, registry,
+                                                            self.module.MAP_EXTENT))
+
+    def image(self, rgba, dpi):
+        """Crop a canvas buffer to the tight bounding box."""
+        top, bottom, left, right = crop_pixels(self.bbox, dpi, rgba.shape[0])
+        return Image.fromarray(rgba[top:bottom, left:right].copy(), 'RGBA')
+
+    def preview(self, out_dir, dpi=PREVIEW_DPI):
+        """Write <name>.preview.png (atomically, for image viewers that auto-reload)."""
+        image = self.image(self.layered.frame(dpi), dpi)
+        path = os.path.join(out_dir, f'{self.name}.preview.png')
+        tmp = os.path.join(out_dir, f'.{self.name}.preview.tmp-{os.getpid()}')
+        image.save(tmp, format='PNG', dpi=(dpi, dpi), compress_level=PREVIEW_COMPRESS_LEVEL)
+        os.replace(tmp, path)
+        return path
+
+    def export(self, out_dir, formats, dpis, workers=None):
+        with self.layered.drawn_in_full() as fig:
+            return export_figure(fig, self.name, out_dir, formats, dpis, workers)
+
+
+def snapshot(paths):
+    """{path: (mtime_ns, size)}, None for files missing mid-save."""
+    state = {}
+    for path in paths:
+        try:
+            st = os.stat(path)
+            state[path] = (st.st_mtime_ns, st.st_size)
+        except FileNotFoundError:
+            state[path] = None
+    return state
+
+
+class Watcher:
+    """Poll the registry and map scripts and re-render the maps they affect."""
+
+    def __init__(self, maps, registry_path, args, log=print):
+        self.maps = maps
+        self.registry_path = os.path.abspath(registry_path)
+        self.args = args
+        self.log = log
+        self.registry = load_registry(self.registry_path)
+        for m in maps:
+            m.load_basemap()
+            m.draw(self.registry)
+        self.paths = [self.registry_path] + [m.path for m in maps]
+        self.state = snapshot(self.paths)
+        os.makedirs(args.output_dir, exist_ok=True)
+
+    def changed(self):
+        """Paths modified since the last call."""
+        state = snapshot(self.paths)
+        changed = [p for p in self.paths if state[p] is not None and state[p] != self.state[p]]
+        self.state.update((p, state[p]) for p in changed)
+        return changed
+
+    def apply(self, changed):
+        """Update the in-memory maps for changed paths; returns the affected maps."""
+        affected = []
+        if self.registry_path in changed:
+            try:
+                registry = load_registry(self.registry_path)
+            except (OSError, ValueError, KeyError, IndexError) as e:
+                self.log(f"{os.path.basename(self.registry_path)}: {type(e).__name__}: {e}")
+            else:
+                self.registry = registry
+                for m in self.maps:
+                    m.update_registry(registry)
+                affected = list(self.maps)
+        for m in self.maps:
+            if m.path in changed:
+                try:
+                    m.reload(self.registry)
+                except Exception:
+                    self.log(traceback.format_exc(limit=-1).rstrip())
+                    continue
+                if m not in affected:
+                    affected.append(m)
+        return affected
+
+    def render(self, maps, start, full=True):
+        for m in maps:
+            path = m.preview(self.args.output_dir, self.args.preview_dpi)
+            self.log(f"preview {path} ({(time.perf_counter() - start) * 1000:.0f} ms)")
+        if not full:
+            return
+        for m in maps:
+            if any(s != self.state[p] for p, s in snapshot(self.paths).items()):
+                self.log("newer edit; skipping the full-resolution export")
+                return
+            t = time.perf_counter()
+            paths = m.export(self.args.output_dir, self.args.formats, self.args.dpi,
+                             self.args.export_workers)
+            self.log(f"wrote   {', '.join(os.path.basename(p) for p in paths)} "
+                     f"({time.perf_counter() - t:.1f} s)")
+
+    def run(self, once=False):
+        self.render(self.maps, time.perf_counter(), full=not self.args.preview_only)
+        if once:
+            return
+        self.log(f"Watching {', '.join(os.path.basename(p) for p in self.paths)} "
+                 f"(Ctrl-C to stop)")
+        try:
+            while True:
+                time.sleep(self.args.interval)
+                changed = self.changed()
+                if not changed:
+                    continue
+                start = time.perf_counter()
+                affected = self.apply(changed)
+                if affected:
+                    self.render(affected, start, full=not self.args.preview_only)
+        except KeyboardInterrupt:
+            pass
+
+
+def check(args, log=print):
+    """
+    Time an edit-to-preview cycle: shift one territory vertex in a copy of the
+    registry, apply it, and compare the preview with a from-scratch draw.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        registry_path = shutil.copy(args.registry, os.path.join(tmp, 'territories.geojson'))
+        args.output_dir = tmp
+        args.preview_only = True
+        maps = [WarmMap(key, args) for key in args.maps]
+        watcher = Watcher(maps, registry_path, args, log=lambda *a: None)
+        watcher.render(maps, time.perf_counter(), full=False)
+
+        with open(registry_path, encoding='utf-8') as f:
+            collection = json.load(f)
+        ring = collection['features'][0]['geometry']['coordinates'][0]
+        ring[1][0] += 0.05
+        with open(registry_path, 'w', encoding='utf-8') as f:
+            json.dump(collection, f)
+        os.utime(registry_path, ns=(time.time_ns(), time.time_ns() + 1))
+
+        start = time.perf_counter()
+        changed = watcher.changed()
+        affected = watcher.apply(changed)
+        watcher.render(affected, start, full=False)
+        latency = time.perf_counter() - start
+
+        for m in maps:
+            preview = np.asarray(Image.open(os.path.join(tmp, f'{m.name}.preview.png')))
+            m.draw(watcher.registry)
+            m.fig.set_dpi(args.preview_dpi)
+            with m.layered.drawn_in_full():
+                m.fig.canvas.draw()
+            reference = np.asarray(m.image(np.asarray(m.fig.canvas.buffer_rgba()),
+                                           args.preview_dpi))
+            if preview.shape != reference.shape:
+                raise AssertionError(f"{m.name}: preview {preview.shape} "
+                                     f"vs full draw {reference.shape}")
+            mismatch = np.any(preview != reference, axis=-1).mean()
+            if mismatch:
+                raise AssertionError(f"{m.name}: {mismatch:.2%} of preview pixels "
+                                     f"differ from a full draw")
+            log(f"{m.name}: preview matches a full draw")
+        log(f"Edit to preview of {len(maps)} map(s) at {args.preview_dpi} dpi: "
+            f"{latency * 1000:.0f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--maps', nargs='+', default=list(MAPS), choices=MAPS)
+    parser.add_argument('--registry', default=DATA_PATH,
+                        help='territory registry to watch')
+    parser.add_argument('--preview-dpi', type=int, default=PREVIEW_DPI)
+    parser.add_argument('--preview-only', action='store_true',
+                        help='skip the full-resolution export')
+    parser.add_argument('--interval', type=float, default=POLL_SECONDS,
+                        help='seconds between polls')
+    parser.add_argument('--once', action='store_true',
+                        help='render once and exit')
+    parser.add_argument('--check', action='store_true',
+                        help='time an edit-to-preview cycle on a copy of the registry')
+    add_basemap_arguments(parser)
+    add_export_arguments(parser)
+    args = parser.parse_args()
+
+    matplotlib.use('Agg')
+    if args.check:
+        check(args)
+        return
+    maps = [WarmMap(key, args) for key in args.maps]
+    Watcher(maps, args.registry, args).run(once=args.once)
+
+
+if __name__ == '__main__':
+    main()
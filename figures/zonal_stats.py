@@ -0,0 +1,356 @@
+#!/usr/bin/env python3
+"""
+Per-territory elevation and area statistics over the basemap DEM.
+
+Statistics cover the parts of the territories inside the map extent.
+
+Each territory polygon is rasterized once onto the DEM grid into a label
+raster (int16 territory index per pixel, territories.NO_TERRITORY outside),
+with the same even-odd rule and first-territory-wins order as
+Registry.classify. The label raster is cached in the raster cache per grid
+spec (extent, resolution and territory geometry), so re-running over the
+same grid only reads it back as a memmap.
+
+All statistics then come from one pass over the DEM in row chunks, with
+np.bincount over the labels: cell areas (from the latitude of each row),
+an area-weighted elevation histogram per territory in HYPSOMETRY_BIN_M
+bins, and the elevation sums for the mean. Area, mean, the hypsometric
+curve and the share below the valley floor follow from these; the exact
+minimum and maximum are taken only over the cells in each territory's
+lowest and highest occupied bin of a chunk. Chunking keeps the memory
+bounded, so the tiled and cached (memmapped) DEMs work at poster sizes.
+"""
+
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+
+import dem
+from profiling import add_profiling_arguments, profiled, stage
+from raster_cache import RasterCache, cached_arrays
+from shading import row_chunks
+from territories import NO_TERRITORY, load_registry
+
+# Mean Earth radius for the cell areas
+EARTH_RADIUS_KM = 6371.0088
+
+# Histogram bins of the hypsometric curve; elevations outside the range
+# count in the end bins (the minimum and maximum stay exact)
+HYPSOMETRY_BIN_M = 10
+HYPSOMETRY_RANGE_M = (-500, 5000)
+
+# Valley floor: the basin level of the synthetic DEM (dem.BASE_ELEVATION)
+VALLEY_FLOOR_M = dem.BASE_ELEVATION
+
+CHUNK_ROWS = 256
+
+# Bump when the rasterization changes in a way the parameters don't capture
+LABELS_VERSION = 1
+
+
+def label_params(registry, extent, nx, ny):
+    """Every parameter that affects the label raster (the cache key)."""
+    return dict(
+        raster='territory_labels', version=LABELS_VERSION,
+        extent=list(extent), nx=nx, ny=ny,
+        territories=[[t['key'], t['coords'].tolist()] for t in registry.territories],
+    )
+
+
+def rasterize(registry, extent, nx, ny, chunk_rows=CHUNK_ROWS):
+    """
+    Label raster of the territories on the (ny, nx) DEM grid: the index of
+    the first territory containing each pixel center, NO_TERRITORY if none.
+
+    Scanline fill: for every row, each polygon edge crossing it toggles the
+    pixels west of the crossing, so the even-odd parity is a cumulative sum
+    over the row instead of a point-in-polygon test per pixel.
+    """
+    x, y = dem.grid_coords(extent, nx, ny)
+    labels = np.full((ny, nx), NO_TERRITORY, dtype=np.int16)
+    for i, t in enumerate(registry.territories):
+        ring = t['coords']
+        x1, y1 = ring[:-1, 0], ring[:-1, 1]
+        x2, y2 = ring[1:, 0], ring[1:, 1]
+        lon_min, lat_min, lon_max, lat_max = t['bbox']
+        c0, c1 = np.searchsorted(x, lon_min), np.searchsorted(x, lon_max, side='right')
+        r0, r1 = np.searchsorted(y, lat_min), np.searchsorted(y, lat_max, side='right')
+        cols = x[c0:c1]
+        if not len(cols):
+            continue
+        for a, b in row_chunks(r1 - r0, chunk_rows):
+            lat = y[r0 + a:r0 + b, None]
+            # Same arithmetic as territories.points_in_polygon, so the
+            # parity agrees with Registry.classify pixel for pixel
+            with np.errstate(divide='ignore', invalid='ignore'):
+                crosses = (y1 > lat) != (y2 > lat)
+                x_cross = x1 + (lat - y1) * (x2 - x1) / (y2 - y1)
+            row, edge = np.nonzero(crosses)
+            # Pixels [0, first) lie west of the crossing and are toggled by it
+            first = np.searchsorted(cols, x_cross[row, edge], side='left')
+            toggles = np.bincount(row * (len(cols) + 1) + first,
+                                  minlength=(b - a) * (len(cols) + 1))
+            toggles = toggles.reshape(b - a, len(cols) + 1)
+            inside = (np.cumsum(toggles[:, ::-1], axis=1)[:, ::-1][:, 1:] & 1).astype(bool)
+            block = labels[r0 + a:r0 + b, c0:c1]
+            block[inside & (block == NO_TERRITORY)] = i
+    return labels
+
+
+def territory_labels(registry, extent, nx, ny, cache=None):
+    """The label raster from the cache (a read-only memmap), rasterized on a miss."""
+    with stage('zonal.labels'):
+        return cached_arrays(cache, label_params(registry, extent, nx, ny), ('labels',),
+                             lambda: dict(labels=rasterize(registry, extent, nx, ny)))['labels']
+
+
+def row_areas(extent, nx, ny):
+    """Area in km^2 of one cell in each row of the grid (cells centered on the nodes)."""
+    lon_min, lon_max, lat_min, lat_max = extent
+    _, y = dem.grid_coords(extent, nx, ny)
+    dlon = np.radians((lon_max - lon_min) / (nx - 1))
+    half = np.radians((lat_max - lat_min) / (ny - 1)) / 2
+    lat = np.radians(y)
+    return EARTH_RADIUS_KM**2 * dlon * np.abs(np.sin(lat + half) - np.sin(lat - half))
+
+
+def zonal_stats(elevation, labels, extent, zones, chunk_rows=CHUNK_ROWS):
+    """
+    Accumulate the per-zone statistics of elevation over labels (zone
+    indexes 0..zones-1, NO_TERRITORY ignored) in one chunked pass.
+
+    Returns dict of arrays indexed by zone: cells, area_km2 (all cells),
+    valid_km2 (cells with elevation), elevation_sum (area-weighted), min,
+    max (NaN for zones without elevation) and hist (zones, bins) of km^2.
+    NaN elevations are voids: they count towards the area only.
+    """
+    ny, nx = labels.shape
+    if elevation.shape != labels.shape:
+        raise ValueError(f"Elevation grid {elevation.shape} does not match labels {labels.shape}")
+    floor, ceiling = HYPSOMETRY_RANGE_M
+    bins = (ceiling - floor) // HYPSOMETRY_BIN_M
+    # Zone 0 collects the cells outside every territory
+    n = zones + 1
+    cells = np.zeros(n, dtype=np.int64)
+    area = np.zeros(n)
+    elevation_sum = np.zeros(n)
+    hist = np.zeros(n * bins)
+    low = np.full(n, np.inf)
+    high = np.full(n, -np.inf)
+    areas = row_areas(extent, nx, ny)
+
+    for r0, r1 in row_chunks(ny, chunk_rows):
+        zone = labels[r0:r1].ravel().astype(np.intp) + 1
+        weight = np.repeat(areas[r0:r1], nx)
+        cells += np.bincount(zone, minlength=n)
+        area += np.bincount(zone, weights=weight, minlength=n)
+
+        elev = np.asarray(elevation[r0:r1], dtype=np.float64).ravel()
+        valid = ~np.isnan(elev)
+        zone, elev, weight = zone[valid], elev[valid], weight[valid]
+        b = np.clip(((elev - floor) // HYPSOMETRY_BIN_M).astype(np.intp), 0, bins - 1)
+        index = zone * bins + b
+        chunk_hist = np.bincount(index, weights=weight, minlength=n * bins)
+        hist += chunk_hist
+        elevation_sum += np.bincount(zone, weights=weight * elev, minlength=n)
+
+        # Exact extremes: only the cells in each zone's lowest and highest
+        # occupied bin of this chunk can hold them
+        occupied = chunk_hist.reshape(n, bins) > 0
+        lowest = np.argmax(occupied, axis=1)
+        highest = bins - 1 - np.argmax(occupied[:, ::-1], axis=1)
+        at = b == lowest[zone]
+        np.minimum.at(low, zone[at], elev[at])
+        at = b == highest[zone]
+        np.maximum.at(high, zone[at], elev[at])
+
+    hist = hist.reshape(n, bins)[1:]
+    empty = ~np.isfinite(low[1:])
+    return dict(cells=cells[1:], area_km2=area[1:], valid_km2=hist.sum(axis=1),
+                elevation_sum=elevation_sum[1:],
+                min=np.where(empty, np.nan, low[1:]), max=np.where(empty, np.nan, high[1:]),
+                hist=hist)
+
+
+def area_below(hist, threshold):
+    """km^2 below threshold per zone; threshold must fall on a histogram bin edge."""
+    offset = threshold - HYPSOMETRY_RANGE_M[0]
+    if offset % HYPSOMETRY_BIN_M or not 0 <= offset <= HYPSOMETRY_RANGE_M[1] - HYPSOMETRY_RANGE_M[0]:
+        raise ValueError(f"{threshold} m is not a {HYPSOMETRY_BIN_M} m bin edge "
+                         f"within {HYPSOMETRY_RANGE_M}")
+    return hist[:, :offset // HYPSOMETRY_BIN_M].sum(axis=1)
+
+
+def hypsometric_curve(hist_row, low, high):
+    """[(elevation_m, fraction of the area above)] at the bin edges from low to high."""
+    total = hist_row.sum()
+    first = int((low - HYPSOMETRY_RANGE_M[0]) // HYPSOMETRY_BIN_M)
+    last = int((high - HYPSOMETRY_RANGE_M[0]) // HYPSOMETRY_BIN_M)
+    first, last = max(first, 0), min(last, len(hist_row) - 1)
+    above = np.cumsum(hist_row[::-1])[::-1] / total
+    curve = [(float(low), 1.0)]
+    for k in range(first + 1, last + 1):
+        curve.append((float(HYPSOMETRY_RANGE_M[0] + k * HYPSOMETRY_BIN_M), float(above[k])))
+    curve.append((float(high), 0.0))
+    return curve
+
+
+def territory_stats(registry, stats, valley_floor=VALLEY_FLOOR_M):
+    """One summary dict per territory, in registry order."""
+    below = area_below(stats['hist'], valley_floor)
+    records = []
+    for i, t in enumerate(registry.territories):
+        valid = stats['valid_km2'][i]
+        record = dict(key=t['key'], label=t['label'].replace('\n', ' '),
+                      cells=int(stats['cells'][i]), area_km2=float(stats['area_km2'][i]),
+                      void_km2=float(stats['area_km2'][i] - valid))
+        if valid > 0:
+            low, high = float(stats['min'][i]), float(stats['max'][i])
+            mean = float(stats['elevation_sum'][i] / valid)
+            record.update(
+                min_m=low, max_m=high, mean_m=mean, relief_m=high - low,
+                # Elevation-relief ratio; equals the area under the hypsometric curve
+                hypsometric_integral=(mean - low) / (high - low) if high > low else 0.0,
+                valley_floor_m=valley_floor,
+                valley_floor_share=float(below[i] / valid),
+                hypsometric_curve=hypsometric_curve(stats['hist'][i], low, high))
+        records.append(record)
+    return records
+
+
+def format_table(records):
+    """Plain-text table of the territory summaries."""
+    lines = [f"{'Territory':34s} {'Area km2':>9s} {'Min m':>7s} {'Max m':>7s} "
+             f"{'Mean m':>7s} {'HI':>5s} {'Floor %':>8s}"]
+    for r in records:
+        if 'min_m' not in r:
+            lines.append(f"{r['label'][:34]:34s} {r['area_km2']:9.0f}   (no elevation data)")
+            continue
+        lines.append(f"{r['label'][:34]:34s} {r['area_km2']:9.0f} {r['min_m']:7.0f} "
+                     f"{r['max_m']:7.0f} {r['mean_m']:7.0f} {r['hypsometric_integral']:5.2f} "
+                     f"{100 * r['valley_floor_share']:7.1f}%")
+    return '\n'.join(lines)
+
+
+def brute_force(elevation, labels, extent, zones):
+    """Per-zone masks over the whole grid: the reference for check()."""
+    ny, nx = labels.shape
+    weight = np.repeat(row_areas(extent, nx, ny)[:, None], nx, axis=1)
+    floor = HYPSOMETRY_RANGE_M[0]
+    result = []
+    for i in range(zones):
+        mask = labels == i
+        valid = mask & ~np.isnan(elevation)
+        elev, w = elevation[valid].astype(np.float64), weight[valid]
+        result.append(dict(
+            cells=mask.sum(), area_km2=weight[mask].sum(), valid_km2=w.sum(),
+            min=elev.min(), max=elev.max(), mean=(elev * w).sum() / w.sum(),
+            below=w[elev < VALLEY_FLOOR_M].sum(),
+            above_1500=w[elev >= 1500].sum(),
+            edge_1500=(1500 - floor) // HYPSOMETRY_BIN_M))
+    return result
+
+
+def check(nx=360, ny=400):
+    """Compare the rasterization and the one-pass statistics with direct computations."""
+    import tempfile
+    from create_territory_map_geo import MAP_EXTENT
+
+    registry = load_registry()
+    zones = len(registry.territories)
+    for extent, size in ((MAP_EXTENT, (nx, ny)), (MAP_EXTENT, (997, 613)),
+                         ((-118.0, -117.2, 36.3, 37.1), (211, 180))):
+        labels = rasterize(registry, extent, *size, chunk_rows=37)
+        x, y = dem.grid_coords(extent, *size)
+        expected = registry.classify(x[None, :], y[:, None])
+        mismatched = int((labels != expected).sum())
+        if mismatched:
+            raise AssertionError(f"Label raster {size} differs from Registry.classify "
+                                 f"at {mismatched} pixels")
+    print(f"Label rasters match Registry.classify ({zones} territories)")
+
+    elevation = dem.build_terrain(MAP_EXTENT, nx, ny)
+    elevation[::17, ::13] = np.nan
+    labels = rasterize(registry, MAP_EXTENT, nx, ny)
+    reference = brute_force(elevation, labels, MAP_EXTENT, zones)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'elevation.npy')
+        np.save(path, elevation)
+        cache = RasterCache(tmp)
+        cached = territory_labels(registry, MAP_EXTENT, nx, ny, cache)
+        again = territory_labels(registry, MAP_EXTENT, nx, ny, cache)
+        if not isinstance(again, np.memmap) or not np.array_equal(again, labels) \
+                or not np.array_equal(cached, labels):
+            raise AssertionError("Cached label raster differs from the rasterization")
+        runs = [zonal_stats(elevation, labels, MAP_EXTENT, zones),
+                zonal_stats(np.load(path, mmap_mode='r'), again, MAP_EXTENT, zones,
+                            chunk_rows=7)]
+        for stats in runs:
+            below = area_below(stats['hist'], VALLEY_FLOOR_M)
+            for i, ref in enumerate(reference):
+                got = dict(cells=stats['cells'][i], area_km2=stats['area_km2'][i],
+                           valid_km2=stats['valid_km2'][i], min=stats['min'][i],
+                           max=stats['max'][i],
+                           mean=stats['elevation_sum'][i] / stats['valid_km2'][i],
+                           below=below[i],
+                           above_1500=stats['hist'][i, ref['edge_1500']:].sum())
+                for name, value in got.items():
+                    if not np.isclose(value, ref[name], rtol=1e-9, atol=1e-6):
+                        raise AssertionError(f"{registry.keys[i]} {name}: {value} "
+                                             f"vs {ref[name]}")
+    records = territory_stats(registry, runs[0])
+    for r in records:
+        curve = np.array(r['hypsometric_curve'])
+        if np.any(np.diff(curve[:, 0]) < 0) or np.any(np.diff(curve[:, 1]) > 0):
+            raise AssertionError(f"{r['key']}: hypsometric curve is not monotonic")
+    print(f"One-pass statistics match per-territory masks (whole grid, memmapped in "
+          f"7-row chunks, with voids)")
+    print(format_table(records))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    from create_territory_map_geo import (MAP_EXTENT, add_basemap_arguments,
+                                          load_elevation, topography_caption)
+    add_basemap_arguments(parser)
+    add_profiling_arguments(parser)
+    parser.add_argument('--valley-floor', type=int, default=VALLEY_FLOOR_M, metavar='M',
+                        help=f'valley floor elevation for the share below it '
+                             f'(a multiple of {HYPSOMETRY_BIN_M} m)')
+    parser.add_argument('--json', metavar='PATH',
+                        help='write the statistics, with the hypsometric curves, here')
+    parser.add_argument('--check', action='store_true',
+                        help='compare with direct per-territory computations and exit')
+    args = parser.parse_args()
+    if args.check:
+        check()
+        return 0
+
+    nx, ny = args.resolution
+    registry = load_registry()
+    cache = None if args.no_cache else RasterCache(args.cache_dir, args.cache_max_mb * 1024**2)
+    with profiled(args):
+        elevation = load_elevation(MAP_EXTENT, args)
+        labels = territory_labels(registry, MAP_EXTENT, nx, ny, cache)
+        with stage('zonal.stats'):
+            stats = zonal_stats(elevation, labels, MAP_EXTENT, len(registry.territories))
+        records = territory_stats(registry, stats, args.valley_floor)
+
+    print(f"{topography_caption(args)}, {nx} x {ny} grid; "
+          f"valley floor below {args.valley_floor} m")
+    print(format_table(records))
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(dict(extent=list(MAP_EXTENT), resolution=[nx, ny],
+                           topography=topography_caption(args), territories=records),
+                      f, indent=1)
+            f.write('\n')
+        print(f"Statistics written to {args.json}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())